@@ -0,0 +1,913 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Benchmark ExtData test cases: run each case N times (after warm-up runs),
+# collect the harness phase times and the MAPL EXTDATA timers/memory, store
+# medians and dispersion in a baseline file and flag statistically
+# significant slowdowns against that baseline.
+#
+# Modes:
+#     regress: compare against (or update) the baseline file
+#       sweep: strong-scaling sweep of each case over NX/NY layouts
+#    prefetch: interleaved A/B runs with ExtData Prefetch on and off
+#    frontend: run each case through ExtData.rc and extdata.yaml, check that
+#              the imports agree and compare initialization and run times;
+#              with --exports, do so for generated cases of growing size
+#
+#      median
+#      mad
+#      mann_whitney_pvalue
+#      get_run_metrics
+#      run_samples
+#      summarize
+#      compare_to_baseline
+#      choose_layout
+#      run_sweep
+#      run_interleaved
+#      compare_variants
+#      prefetch_log_metrics
+#      run_prefetch_ab
+#      import_history_overrides
+#      compare_outputs
+#      run_frontend_compare
+#      run_export_scaling
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import json
+import math
+import time
+import itertools
+import csv
+import resource
+import shutil
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+
+import utils
+import case_config
+import gen_case
+from run_case import ExtDataCase
+
+# turn on MAPL timers and memory reports in the staged CAP1.rc/CAP2.rc
+TIMER_OVERRIDES = OrderedDict([('MAPL_ENABLE_TIMERS', 'YES'),
+                               ('MAPL_ENABLE_MEMUTILS', 'YES'),
+                               ('MAPL_MEMUTILS_MODE', '1')])
+
+# HISTORY collection with the imports of the CAPs that read through ExtData
+IMPORT_COLLECTION = 'extdata_imports'
+
+# above this many permutations the Mann-Whitney p-value is approximated
+MAX_EXACT_PERMUTATIONS = 20000
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Benchmark ExtData test cases')
+
+    p.add_argument("--mode",  dest="mode",default="regress",choices=['regress','sweep','prefetch','frontend'],help='what to benchmark')
+
+    p.add_argument("--builddir",  dest="build_dir",help='dir with ExtDataDriver.x and g5_modules')
+    p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
+    p.add_argument("--cases",  dest="cases",help='file with list of cases')
+    p.add_argument("--nrep",  dest="nrep",type=int,default=5,help='measured runs per case')
+    p.add_argument("--warmup",  dest="warmup",type=int,default=1,help='unmeasured runs per case')
+    p.add_argument("--baseline",  dest="baseline",default="bench_baseline.json",help='baseline file')
+    p.add_argument("--update-baseline",  dest="update_baseline",action="store_true",help='store results as new baseline')
+    p.add_argument("--threshold",  dest="threshold",type=float,default=0.05,help='relative slowdown to flag (0.05 = 5%%)')
+    p.add_argument("--alpha",  dest="alpha",type=float,default=0.05,help='significance level of the slowdown test')
+    p.add_argument("--logdir",  dest="log_dir",default=".",help='where run logs are written')
+    p.add_argument("--savelog",dest="save_log",default="false",help='keep the log files of all runs')
+
+    # sweep mode
+    # ----------
+    p.add_argument("--layouts",  dest="layouts",help='NXxNY layouts to run, e.g. 1x6,2x12')
+    p.add_argument("--ranks",  dest="ranks",default="1,2,4,6,8,12,16,24,36,48",
+                   help='rank counts to run (most square valid layout) if no --layouts')
+    p.add_argument("--csv",  dest="csv",help='csv file of the sweep results (default: scaling_<case>.csv)')
+
+    # prefetch mode
+    # -------------
+    p.add_argument("--frontends",  dest="frontends",default="rc,yaml",help='ExtData front ends to run (rc, yaml)')
+
+    # frontend mode
+    # -------------
+    p.add_argument("--exports",  dest="exports",help='export counts of generated cases, e.g. 10,100,500')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    # some checks on inputs
+    # ---------------------
+    if not args['build_dir'] or not os.path.isdir(args['build_dir']):
+        raise Exception('build_dir [%s] does not exist' % args['build_dir'])
+    if not args['case_dir'] or not os.path.isdir(args['case_dir']):
+        raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+    if args['exports'] and args['mode'] != 'frontend':
+        raise Exception('--exports is only used in frontend mode')
+    if args['exports']:
+        args['cases'] = args['cases'] or None
+    elif not args['cases'] or not os.path.isfile(args['cases']):
+        raise Exception('case file [%s] does not exist' % args['cases'])
+    if args['nrep'] < 1:
+        raise Exception('nrep must be at least 1')
+
+    return args
+
+
+def read_case_list(case_file):
+    """
+    # --------------------------------------------------------------------------
+    # return the (non-empty) case names listed in case_file
+    # --------------------------------------------------------------------------
+    """
+
+    fin = open(case_file, 'r')
+    cases = [line.strip() for line in fin if line.strip()]
+    fin.close()
+    return cases
+
+
+def median(values):
+    """
+    # --------------------------------------------------------------------------
+    # median of a list of numbers (None if empty)
+    # --------------------------------------------------------------------------
+    """
+
+    vals = sorted(values)
+    n = len(vals)
+    if n == 0: return None
+    if n % 2: return vals[n//2]
+    return 0.5*(vals[n//2-1] + vals[n//2])
+
+
+def mad(values):
+    """
+    # --------------------------------------------------------------------------
+    # median absolute deviation of a list of numbers (None if empty)
+    # --------------------------------------------------------------------------
+    """
+
+    med = median(values)
+    if med is None: return None
+    return median([abs(v-med) for v in values])
+
+
+def _u_statistic(xs, ys):
+    # number of (x, y) pairs with y > x, ties counting one half
+    u = 0.0
+    for x in xs:
+        for y in ys:
+            if y > x: u += 1.0
+            elif y == x: u += 0.5
+    return u
+
+
+def mann_whitney_pvalue(base, cur):
+    """
+    # --------------------------------------------------------------------------
+    # one-sided Mann-Whitney U test that 'cur' tends to be larger than 'base'.
+    # The p-value is exact (permutation) for small samples, else it uses the
+    # normal approximation
+    #
+    # Inputs:
+    #     base: baseline samples
+    #      cur: current samples
+    # Output:
+    #     p-value (float)
+    # --------------------------------------------------------------------------
+    """
+
+    n1, n2 = len(base), len(cur)
+    if n1 == 0 or n2 == 0: return 1.0
+
+    u = _u_statistic(base, cur)
+    nperm = math.factorial(n1+n2) // (math.factorial(n1)*math.factorial(n2))
+
+    if nperm <= MAX_EXACT_PERMUTATIONS:
+        pooled = list(base) + list(cur)
+        count = 0
+        for idx in itertools.combinations(range(n1+n2), n2):
+            chosen = set(idx)
+            ys = [pooled[i] for i in idx]
+            xs = [pooled[i] for i in range(n1+n2) if i not in chosen]
+            if _u_statistic(xs, ys) >= u - 1e-9: count += 1
+        return float(count)/nperm
+
+    mu = 0.5*n1*n2
+    sigma = math.sqrt(n1*n2*(n1+n2+1)/12.0)
+    z = (u - 0.5 - mu)/sigma
+    return 0.5*math.erfc(z/math.sqrt(2.0))
+
+
+def get_run_metrics(this_case, logfile):
+    """
+    # --------------------------------------------------------------------------
+    # collect the metrics of one finished run
+    #
+    # Inputs:
+    #     this_case: ExtDataCase that was run
+    #       logfile: path of the log the run was written to
+    # Output:
+    #       metrics: OrderedDict with harness phase times (s), EXTDATA timer
+    #                entries (s) and MAPL memory high water mark (MB). Entries
+    #                missing from the log are None
+    # --------------------------------------------------------------------------
+    """
+
+    metrics = OrderedDict(this_case.phase_times)
+    timer = utils.get_mapl_timer_block(logfile, 'EXTDATA')
+    metrics['extdata_init'] = timer.get('Initialize', timer.get('GenInitTot'))
+    metrics['extdata_run'] = timer.get('Run')
+    metrics['extdata_total'] = timer.get('TOTAL')
+    cap_mems = utils.get_mapl_memusage(logfile, ['EXTDATA'])[0]
+    if cap_mems:
+        metrics['hwm'] = max(cap_mems['high water mark'])
+    else:
+        metrics['hwm'] = None
+    return metrics
+
+
+def with_overrides(comm_opts, *overrides):
+    """
+    # --------------------------------------------------------------------------
+    # return a copy of comm_opts whose rc_overrides ({rc file pattern:
+    # {label: value}}) are merged with the given overrides (later ones win)
+    # --------------------------------------------------------------------------
+    """
+
+    opts = dict(comm_opts)
+    merged = OrderedDict()
+    for override in [opts.get('rc_overrides') or {}] + list(overrides):
+        for pattern in override:
+            merged.setdefault(pattern, OrderedDict()).update(override[pattern])
+    opts['rc_overrides'] = merged
+    return opts
+
+
+def run_once(case_name, comm_opts, logfile, save_log=False, log_metrics=None):
+    """
+    # --------------------------------------------------------------------------
+    # run a case once with MAPL timers on and return its metrics (see
+    # get_run_metrics) plus 'total' (s), 'block_input' (bytes of block input
+    # of the child processes as reported by getrusage; reads served from the
+    # page cache or by GPFS/NFS clients are not counted) and what
+    # log_metrics(logfile) returns, if given. Raise if the case fails
+    # --------------------------------------------------------------------------
+    """
+
+    opts = with_overrides(comm_opts, {'CAP?.rc': TIMER_OVERRIDES})
+    this_case = ExtDataCase(case_name, opts)
+    log = open(logfile, 'w')
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    sTart = time.time()
+    success = this_case.run(log)
+    eNd = time.time()
+    log.close()
+    if not success:
+        raise Exception('case [%s] failed, see [%s]' % (case_name, logfile))
+    metrics = get_run_metrics(this_case, logfile)
+    metrics['total'] = eNd-sTart
+    metrics['block_input'] = 512.0*(resource.getrusage(resource.RUSAGE_CHILDREN).ru_inblock-usage.ru_inblock)
+    if log_metrics:
+        metrics.update(log_metrics(logfile))
+    if not save_log:
+        os.remove(logfile)
+    return metrics
+
+
+def run_samples(case_name, comm_opts, nrep, nwarm=0, log_dir='.', save_log=False, tag='bench'):
+    """
+    # --------------------------------------------------------------------------
+    # run a case nwarm+nrep times with MAPL timers on and return the metrics
+    # of the last nrep runs
+    #
+    # Inputs:
+    #     case_name: case to run
+    #     comm_opts: options dict as passed to ExtDataCase
+    #          nrep: number of measured runs
+    #         nwarm: number of warm-up runs (not returned)
+    #       log_dir: where the run logs are written
+    #      save_log: keep the run logs
+    #           tag: used in the log file names
+    # Output:
+    #       samples: list of metrics dicts (see run_once)
+    # --------------------------------------------------------------------------
+    """
+
+    samples = []
+    for i in range(nwarm+nrep):
+        logfile = os.path.join(log_dir, '%s.%s%d.log' % (case_name, tag, i))
+        metrics = run_once(case_name, comm_opts, logfile, save_log)
+        if i >= nwarm:
+            samples.append(metrics)
+
+    return samples
+
+
+def summarize(samples):
+    """
+    # --------------------------------------------------------------------------
+    # reduce a list of metrics dicts to {metric: {median, mad, samples}}
+    # --------------------------------------------------------------------------
+    """
+
+    summary = OrderedDict()
+    for metric in samples[0].keys():
+        values = [s[metric] for s in samples if s.get(metric) is not None]
+        if not values: continue
+        summary[metric] = OrderedDict([('median', median(values)),
+                                       ('mad', mad(values)),
+                                       ('samples', values)])
+    return summary
+
+
+def compare_to_baseline(base, cur, threshold, alpha):
+    """
+    # --------------------------------------------------------------------------
+    # compare two summaries (see summarize) metric by metric
+    #
+    # Inputs:
+    #          base: baseline summary
+    #           cur: current summary
+    #     threshold: relative increase of the median that counts as slowdown
+    #         alpha: significance level of the Mann-Whitney test
+    # Output:
+    #          rows: list of (metric, base median, cur median, relative
+    #                change, p-value, flagged) tuples
+    # --------------------------------------------------------------------------
+    """
+
+    rows = []
+    for metric in cur:
+        if metric not in base or not base[metric]['median']: continue
+        bmed = base[metric]['median']
+        cmed = cur[metric]['median']
+        change = (cmed-bmed)/bmed
+        pvalue = mann_whitney_pvalue(base[metric]['samples'], cur[metric]['samples'])
+        flagged = change > threshold and pvalue <= alpha
+        rows.append((metric, bmed, cmed, change, pvalue, flagged))
+    return rows
+
+
+def write_comparison(case_name, rows, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # print the rows returned by compare_to_baseline as a table
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    utils.writemsg('\n %s\n' % case_name, fout)
+    utils.writemsg(' %-16s %12s %12s %9s %8s\n' % ('metric', 'baseline', 'current', 'change', 'p'), fout)
+    for metric, bmed, cmed, change, pvalue, flagged in rows:
+        utils.writemsg(' %-16s %12.4f %12.4f %8.1f%% %8.4f%s\n' %
+                       (metric, bmed, cmed, 100.0*change, pvalue, '  SLOWER' if flagged else ''), fout)
+
+
+def read_baseline(baseline_file):
+
+    if not os.path.isfile(baseline_file): return OrderedDict()
+    fin = open(baseline_file, 'r')
+    baseline = json.load(fin, object_pairs_hook=OrderedDict)
+    fin.close()
+    return baseline
+
+
+def write_baseline(baseline_file, baseline):
+
+    fout = open(baseline_file, 'w')
+    json.dump(baseline, fout, indent=2)
+    fout.write('\n')
+    fout.close()
+
+
+def choose_layout(grid, nranks):
+    """
+    # --------------------------------------------------------------------------
+    # return the valid (NX, NY) with NX*NY = nranks whose local domains are
+    # closest to square, or None if nranks cannot decompose the grid
+    # --------------------------------------------------------------------------
+    """
+
+    best = None
+    for nx in range(1, nranks+1):
+        if nranks % nx: continue
+        ny = nranks//nx
+        if not case_config.is_valid_layout(grid, nx, ny): continue
+        if grid['grid_type'] == 'Cubed-Sphere':
+            lx, ly = float(grid['im'])/nx, float(grid['im'])/(ny//6)
+        else:
+            lx, ly = float(grid['im'])/nx, float(grid['jm'])/ny
+        aspect = max(lx/ly, ly/lx)
+        if best is None or aspect < best[0]:
+            best = (aspect, nx, ny)
+    if best is None: return None
+    return best[1:]
+
+
+def run_sweep(case, comm_opts, save_log=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # strong-scaling sweep: run a case over a list of layouts (rewriting NX/NY
+    # in the staged AGCM rc files and the rank count in nproc.rc) and report
+    # EXTDATA run time, driver time and memory versus ranks
+    #
+    # Inputs:
+    #          case: case to sweep
+    #     comm_opts: parsed command line options
+    #      save_log: keep the run logs
+    #          fout: open output file handle, if None set to sys.stdout
+    # Output:
+    #          rows: list of OrderedDicts, one per layout
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    grid = case_config.get_grid(os.path.join(comm_opts['case_dir'], case, 'AGCM1.rc'))
+    if comm_opts['layouts']:
+        layouts = []
+        for layout in comm_opts['layouts'].split(','):
+            nx, ny = [int(n) for n in layout.lower().split('x')]
+            if not case_config.is_valid_layout(grid, nx, ny):
+                raise Exception('layout [%s] is not valid for %s grid %dx%d' %
+                                (layout, grid['grid_type'], grid['im'], grid['jm']))
+            layouts.append((nx, ny))
+    else:
+        layouts = []
+        for nranks in [int(n) for n in comm_opts['ranks'].split(',')]:
+            layout = choose_layout(grid, nranks)
+            if layout: layouts.append(layout)
+            else: utils.writemsg(' %s: skipping %d ranks (no valid layout)\n' % (case, nranks), fout)
+
+    rows = []
+    for nx, ny in sorted(layouts, key=lambda layout: layout[0]*layout[1]):
+        utils.writemsg(' Running %s on %dx%d...' % (case, nx, ny), fout)
+        opts = with_overrides(comm_opts, {'AGCM?.rc': OrderedDict([('NX', nx), ('NY', ny)])})
+        opts['nproc'] = nx*ny
+        samples = run_samples(case, opts, comm_opts['nrep'], comm_opts['warmup'],
+                              comm_opts['log_dir'], save_log, tag='sweep%dx%d.' % (nx, ny))
+        summary = summarize(samples)
+        utils.writemsg('done.\n', fout)
+        row = OrderedDict([('ranks', nx*ny), ('nx', nx), ('ny', ny)])
+        for metric in ['extdata_run', 'execute', 'hwm']:
+            row[metric] = summary[metric]['median'] if metric in summary else None
+        rows.append(row)
+
+    # speedup and efficiency relative to the smallest run
+    # ---------------------------------------------------
+    for row in rows:
+        row['speedup'] = None
+        row['efficiency'] = None
+        if rows[0]['extdata_run'] and row['extdata_run']:
+            row['speedup'] = rows[0]['extdata_run']/row['extdata_run']
+            row['efficiency'] = row['speedup']*rows[0]['ranks']/row['ranks']
+
+    fmt = lambda val: '%.4f' % val if isinstance(val, float) else str(val)
+    utils.writemsg('\n %s (%s %dx%d)\n' % (case, grid['grid_type'], grid['im'], grid['jm']), fout)
+    if rows:
+        utils.writemsg(' ' + ' '.join(['%12s' % key for key in rows[0]]) + '\n', fout)
+    for row in rows:
+        utils.writemsg(' ' + ' '.join(['%12s' % fmt(val) for val in row.values()]) + '\n', fout)
+
+    csv_file = comm_opts['csv'] or 'scaling_%s.csv' % case
+    fcsv = open(csv_file, 'w')
+    writer = csv.writer(fcsv)
+    if rows: writer.writerow(list(rows[0].keys()))
+    for row in rows:
+        writer.writerow(['' if val is None else fmt(val) for val in row.values()])
+    fcsv.close()
+    utils.writemsg(' Results written to %s\n' % csv_file, fout)
+
+    return rows
+
+
+def frontend_overrides(frontend):
+    """
+    # --------------------------------------------------------------------------
+    # rc overrides selecting the ExtData front end: 'rc' reads ExtData.rc,
+    # 'yaml' reads extdata.yaml (ExtData2G)
+    # --------------------------------------------------------------------------
+    """
+
+    use_2g = '.true.' if frontend == 'yaml' else '.false.'
+    return {'CAP?.rc': OrderedDict([('USE_EXTDATA2G', use_2g)])}
+
+
+def prefetch_overrides(frontend, prefetch):
+    """
+    # --------------------------------------------------------------------------
+    # rc overrides switching Prefetch on or off in the config of a front end
+    # --------------------------------------------------------------------------
+    """
+
+    if frontend == 'yaml':
+        return {'extdata.yaml': {'Prefetch': 'true' if prefetch else 'false'}}
+    return {'ExtData.rc': {'Prefetch': '.true.' if prefetch else '.false.'}}
+
+
+def case_frontends(case_path, frontends):
+    """
+    # --------------------------------------------------------------------------
+    # the front ends in 'frontends' that case_path can be run with
+    # --------------------------------------------------------------------------
+    """
+
+    # ExtDataCase converts ExtData.rc for cases without an extdata.yaml
+    config_files = {'rc': ['ExtData.rc'], 'yaml': ['extdata.yaml', 'ExtData.rc']}
+    return [frontend for frontend in frontends
+            if [f for f in config_files[frontend] if os.path.isfile(os.path.join(case_path, f))]]
+
+
+def run_interleaved(case_name, variants, nrep, nwarm=0, log_dir='.', save_log=False, log_metrics=None):
+    """
+    # --------------------------------------------------------------------------
+    # run the variants of a case interleaved: each repetition runs every
+    # variant once, rotating the order so that slow drifts of the machine
+    # (file system cache, other jobs) hit all variants alike
+    #
+    # Inputs:
+    #     case_name: case to run
+    #      variants: OrderedDict with label as key and options dict as val
+    #          nrep: number of measured repetitions
+    #         nwarm: number of warm-up repetitions (not returned)
+    #   log_metrics: passed to run_once
+    # Output:
+    #       samples: OrderedDict with label as key and list of metrics dicts
+    #                (see run_once) as val
+    # --------------------------------------------------------------------------
+    """
+
+    labels = list(variants.keys())
+    samples = OrderedDict([(label, []) for label in labels])
+    for i in range(nwarm+nrep):
+        shift = i % len(labels)
+        for label in labels[shift:] + labels[:shift]:
+            logfile = os.path.join(log_dir, '%s.%s.%d.log' % (case_name, label, i))
+            metrics = run_once(case_name, variants[label], logfile, save_log, log_metrics)
+            if i >= nwarm:
+                samples[label].append(metrics)
+    return samples
+
+
+def compare_variants(sum_a, sum_b, metrics=None):
+    """
+    # --------------------------------------------------------------------------
+    # compare the summaries (see summarize) of two variants A and B
+    #
+    # Output:
+    #     rows: list of (metric, median A, median B, A-B, (A-B)/B, p-value)
+    #           tuples, p-value of the two-sided Mann-Whitney test
+    # --------------------------------------------------------------------------
+    """
+
+    rows = []
+    for metric in metrics or list(sum_a.keys()):
+        if metric not in sum_a or metric not in sum_b: continue
+        amed = sum_a[metric]['median']
+        bmed = sum_b[metric]['median']
+        change = (amed-bmed)/bmed if bmed else None
+        pvalue = min(1.0, 2.0*min(mann_whitney_pvalue(sum_a[metric]['samples'], sum_b[metric]['samples']),
+                                  mann_whitney_pvalue(sum_b[metric]['samples'], sum_a[metric]['samples'])))
+        rows.append((metric, amed, bmed, amed-bmed, change, pvalue))
+    return rows
+
+
+def write_variant_comparison(title, label_a, label_b, rows, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # print the rows returned by compare_variants as a table
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    utils.writemsg('\n %s\n' % title, fout)
+    utils.writemsg(' %-14s %14s %14s %14s %8s %8s\n' %
+                   ('metric', label_a, label_b, 'difference', 'change', 'p'), fout)
+    for metric, amed, bmed, diff, change, pvalue in rows:
+        change = '%7.1f%%' % (100.0*change) if change is not None else '%8s' % '-'
+        utils.writemsg(' %-14s %14.4f %14.4f %14.4f %s %8.4f\n' %
+                       (metric, amed, bmed, diff, change, pvalue), fout)
+
+
+def prefetch_log_metrics(logfile):
+    """
+    # --------------------------------------------------------------------------
+    # 'prefetch_msgs' (prefetch messages) and 'io_msgs' (all ExtData I/O
+    # messages) in the debug output of a case log, see io_events
+    # --------------------------------------------------------------------------
+    """
+
+    # io_events imports this module
+    import io_events
+    events = [e for e in io_events.parse_events(logfile) if e['action'] != 'step']
+    return OrderedDict([('prefetch_msgs', len([e for e in events if e['action'] == 'prefetch'])),
+                        ('io_msgs', len(events))])
+
+
+def run_prefetch_ab(case, comm_opts, save_log=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # run a case with Prefetch on and off, for each front end the case has a
+    # config for, interleaved, and report the difference in EXTDATA run time
+    # and memory high water mark. The runs have ExtData DEBUG_LEVEL 20: a
+    # front end whose logs show no prefetch with Prefetch on (a MAPL build
+    # that ignores the option) or prefetch with it off gets no A/B result
+    #
+    # Output:
+    #     OrderedDict with front end as key and the rows of compare_variants
+    #     as val (None if the runs did not differ in prefetching)
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    frontends = case_frontends(os.path.join(comm_opts['case_dir'], case),
+                               comm_opts['frontends'].split(','))
+    if not frontends:
+        raise Exception('case [%s] has no config for front ends [%s]' % (case, comm_opts['frontends']))
+
+    variants = OrderedDict()
+    for frontend in frontends:
+        for prefetch in [True, False]:
+            label = '%s-prefetch-%s' % (frontend, 'on' if prefetch else 'off')
+            variants[label] = with_overrides(comm_opts, frontend_overrides(frontend),
+                                             prefetch_overrides(frontend, prefetch),
+                                             {'ExtData.rc': {'DEBUG_LEVEL': '20'}})
+
+    utils.writemsg(' Running %s prefetch A/B (%s, %d+%d repetitions)...' %
+                   (case, ', '.join(frontends), comm_opts['warmup'], comm_opts['nrep']), fout)
+    samples = run_interleaved(case, variants, comm_opts['nrep'], comm_opts['warmup'],
+                              comm_opts['log_dir'], save_log, prefetch_log_metrics)
+    utils.writemsg('done.\n', fout)
+
+    results = OrderedDict()
+    for frontend in frontends:
+        title = '%s, %s front end' % (case, frontend)
+        sum_on = summarize(samples['%s-prefetch-on' % frontend])
+        sum_off = summarize(samples['%s-prefetch-off' % frontend])
+        prefetch_on = min(sum_on['prefetch_msgs']['samples'])
+        prefetch_off = max(sum_off['prefetch_msgs']['samples'])
+        why = None
+        if not max(sum_on['io_msgs']['samples']):
+            why = 'no ExtData debug output in the logs, prefetching cannot be checked'
+        elif not prefetch_on:
+            why = 'no prefetch in the log of a run with Prefetch on, the build ignores the option'
+        elif prefetch_off:
+            why = 'prefetch in the log of a run with Prefetch off'
+        if why:
+            utils.writemsg('\n %s\n No A/B result: %s\n' % (title, why), fout)
+            results[frontend] = None
+            continue
+        rows = compare_variants(sum_on, sum_off, ['extdata_run', 'hwm'])
+        write_variant_comparison(title, 'prefetch on', 'prefetch off', rows, fout)
+        # block input misses reads from the page cache and network file
+        # systems, so it is shown but not compared
+        utils.writemsg(' block input (not compared): %.0f vs %.0f bytes\n' %
+                       (sum_on['block_input']['median'], sum_off['block_input']['median']), fout)
+        results[frontend] = rows
+    return results
+
+
+def import_history_overrides(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # rc overrides that make each CAP of the case that reads imports through
+    # ExtData (RUN_MODE other than GenerateExports) copy them to its exports
+    # (FillExportsFromImports) and write those in the HISTORY collection
+    # IMPORT_COLLECTION, so that what ExtData delivered can be compared
+    # between runs. The outputs of the GenerateExports CAP do not depend on
+    # the ExtData front end. None if no CAP has imports that are also exports
+    # --------------------------------------------------------------------------
+    """
+
+    names = lambda rows: [row.split(',')[0].strip() for row in rows]
+    overrides = OrderedDict()
+    for cap_file in case_config.get_cap_cases(case_path):
+        values = case_config.read_rc(os.path.join(case_path, cap_file))[0]
+        root_name = case_config.clean_value(values.get('ROOT_NAME', 'Root'))
+        agcm_rc = case_config.clean_value(values['ROOT_CF'])
+        hist_rc = case_config.clean_value(values['HIST_CF'])
+        agcm_values, agcm_tables = case_config.read_rc(os.path.join(case_path, agcm_rc))
+        if case_config.clean_value(agcm_values.get('RUN_MODE', '')) == 'GenerateExports': continue
+        exports = names(agcm_tables.get('EXPORT_STATE', []))
+        fields = [var for var in names(agcm_tables.get('IMPORT_STATE', [])) if var in exports]
+        if not fields: continue
+        overrides[agcm_rc] = OrderedDict([('RUN_MODE', 'FillExportsFromImports')])
+        # the fields value ends the list with '::' on a line of its own
+        overrides[hist_rc] = OrderedDict([
+            ('COLLECTIONS', IMPORT_COLLECTION),
+            (IMPORT_COLLECTION+'.template', "'%y4%m2%d2_%h2%n2z.nc4',"),
+            (IMPORT_COLLECTION+'.format', "'CFIO',"),
+            (IMPORT_COLLECTION+'.frequency', '010000,'),
+            (IMPORT_COLLECTION+'.duration', '010000'),
+            (IMPORT_COLLECTION+'.fields', ' '.join(["'%s', '%s'," % (var, root_name) for var in fields]) + '\n::')])
+    return overrides or None
+
+
+def compare_outputs(dir_a, dir_b, tolerance=None):
+    """
+    # --------------------------------------------------------------------------
+    # compare the saved outputs (see ExtDataCase.save_outputs) of two runs.
+    # Files that differ byte-wise are compared again with nccmp, if
+    # available, so that differences in global attributes alone (or data
+    # differences within the absolute tolerance) do not count
+    #
+    # Output:
+    #     list of (relpath, reason, detail) tuples as in compare_dir_trees
+    # --------------------------------------------------------------------------
+    """
+
+    differences = []
+    for relpath, reason, detail in utils.compare_dir_trees(dir_a, dir_b):
+        if reason in ['size', 'content'] and relpath.endswith('.nc4') and utils.is_tool('nccmp'):
+            if utils.nc4_compare(os.path.join(dir_a, relpath), os.path.join(dir_b, relpath),
+                                 tolerance=tolerance) == 0:
+                continue
+        differences.append((relpath, reason, detail))
+    return differences
+
+
+def run_frontend_compare(case, comm_opts, save_log=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # run a case through the ExtData.rc and the extdata.yaml front end,
+    # interleaved, check that both deliver the same imports (written by
+    # HISTORY, see import_history_overrides) and report the EXTDATA
+    # initialization and run times of each
+    #
+    # Output:
+    #     a list of three elements
+    #          sums: OrderedDict with front end as key and summary (see
+    #                summarize) as val
+    #          rows: yaml vs rc rows (see compare_variants)
+    #         diffs: differences of the import outputs (see
+    #                compare_outputs), None if they could not be compared
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    frontends = case_frontends(os.path.join(comm_opts['case_dir'], case), ['rc', 'yaml'])
+    if frontends != ['rc', 'yaml']:
+        raise Exception('case [%s] needs both ExtData.rc and extdata.yaml' % case)
+
+    import_overrides = import_history_overrides(os.path.join(comm_opts['case_dir'], case))
+
+    variants = OrderedDict()
+    for frontend in frontends:
+        variants[frontend] = with_overrides(comm_opts, frontend_overrides(frontend), import_overrides or {})
+        variants[frontend]['output_dir'] = os.path.join(comm_opts['log_dir'], '%s.%s.out' % (case, frontend))
+
+    utils.writemsg(' Running %s with rc and yaml front ends (%d+%d repetitions)...' %
+                   (case, comm_opts['warmup'], comm_opts['nrep']), fout)
+    samples = run_interleaved(case, variants, comm_opts['nrep'], comm_opts['warmup'],
+                              comm_opts['log_dir'], save_log)
+    utils.writemsg('done.\n', fout)
+
+    diffs = None
+    imports = [sorted([f for f in os.listdir(variants[frontend]['output_dir']) if IMPORT_COLLECTION in f])
+               for frontend in frontends]
+    if import_overrides and imports[0] and imports[1]:
+        diffs = [diff for diff in compare_outputs(variants['rc']['output_dir'], variants['yaml']['output_dir'])
+                 if IMPORT_COLLECTION in diff[0]]
+    if not save_log:
+        for frontend in frontends:
+            shutil.rmtree(variants[frontend]['output_dir'])
+
+    sums = OrderedDict([(frontend, summarize(samples[frontend])) for frontend in frontends])
+    rows = compare_variants(sums['yaml'], sums['rc'], ['extdata_init', 'extdata_run', 'execute', 'hwm'])
+    write_variant_comparison('%s, yaml vs rc front end' % case, 'yaml', 'rc', rows, fout)
+    if diffs is None:
+        utils.writemsg(' Imports not compared (%s)\n' % ('no import output written' if import_overrides
+                                                          else 'no CAP with imports that are also exports'), fout)
+    elif diffs:
+        utils.writemsg(' Imports differ:\n', fout)
+        for relpath, reason, detail in diffs:
+            utils.writemsg('   %s: %s %s\n' % (relpath, reason, detail), fout)
+    else:
+        utils.writemsg(' Imports identical (%d files)\n' % len(imports[0]), fout)
+    return [sums, rows, diffs]
+
+
+def run_export_scaling(comm_opts, save_log=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # generate cases with the export counts of --exports (2D fields on a
+    # small grid, one file, so that config parsing dominates), run each with
+    # both front ends and tabulate the EXTDATA initialization time against
+    # the number of exports
+    #
+    # Output:
+    #     rows: list of (exports, rc init, yaml init, yaml/rc, identical),
+    #           identical is None if the imports were not compared
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    exports = [int(n) for n in comm_opts['exports'].split(',')]
+    case_dir = tempfile.mkdtemp(prefix='frontend_cases.', dir=comm_opts['log_dir'])
+    opts = dict(comm_opts)
+    opts['case_dir'] = case_dir
+
+    rows = []
+    for nexports in exports:
+        case = 'exports%d' % nexports
+        spec = {'grid': gen_case.parse_grid('24x12', 1), 'n2d': nexports, 'n3d': 0,
+                'collections': 1, 'granularity': 'year', 'frequency': '060000',
+                'start': '20040101', 'span': '1d', 'ncompare': 2, 'layout': None}
+        gen_case.generate_case(os.path.join(case_dir, case), spec)
+        sums, cmp_rows, diffs = run_frontend_compare(case, opts, save_log, fout)
+        rc_init = sums['rc'].get('extdata_init', {}).get('median')
+        yaml_init = sums['yaml'].get('extdata_init', {}).get('median')
+        ratio = yaml_init/rc_init if rc_init and yaml_init is not None else None
+        rows.append((nexports, rc_init, yaml_init, ratio, None if diffs is None else not diffs))
+
+    if not save_log:
+        shutil.rmtree(case_dir)
+
+    fmt = lambda x: '%12.4f' % x if x is not None else '%12s' % '-'
+    utils.writemsg('\n EXTDATA initialization vs number of exports\n', fout)
+    utils.writemsg(' %8s %12s %12s %12s %10s\n' % ('exports', 'rc', 'yaml', 'yaml/rc', 'identical'), fout)
+    for nexports, rc_init, yaml_init, ratio, identical in rows:
+        utils.writemsg(' %8d %s %s %s %10s\n' %
+                       (nexports, fmt(rc_init), fmt(yaml_init), fmt(ratio),
+                        '-' if identical is None else ('yes' if identical else 'NO')), fout)
+    return rows
+
+
+def run_regress(comm_opts, save_log=False):
+    """
+    # --------------------------------------------------------------------------
+    # benchmark the listed cases against (and optionally update) the baseline.
+    # Returns the list of (case, metric) with a significant slowdown
+    # --------------------------------------------------------------------------
+    """
+
+    baseline = read_baseline(comm_opts['baseline'])
+
+    regressions = []
+    for case in read_case_list(comm_opts['cases']):
+        utils.writemsg(' Benchmarking %s (%d+%d runs)...' % (case, comm_opts['warmup'], comm_opts['nrep']))
+        samples = run_samples(case, comm_opts, comm_opts['nrep'], comm_opts['warmup'],
+                              comm_opts['log_dir'], save_log)
+        summary = summarize(samples)
+        utils.writemsg('done.\n')
+
+        if case in baseline:
+            rows = compare_to_baseline(baseline[case]['metrics'], summary,
+                                       comm_opts['threshold'], comm_opts['alpha'])
+            write_comparison(case, rows)
+            regressions += [(case, row[0]) for row in rows if row[-1]]
+        else:
+            utils.writemsg(' %s: no baseline entry\n' % case)
+
+        if comm_opts['update_baseline']:
+            baseline[case] = OrderedDict([('date', datetime.now().strftime('%Y/%m/%d, %H:%M:%S')),
+                                          ('build_dir', os.path.abspath(comm_opts['build_dir'])),
+                                          ('nrep', comm_opts['nrep']),
+                                          ('metrics', summary)])
+
+    if comm_opts['update_baseline']:
+        write_baseline(comm_opts['baseline'], baseline)
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    save_log = comm_opts['save_log'].lower() != "false"
+
+    if comm_opts['mode'] == 'sweep':
+        for case in read_case_list(comm_opts['cases']):
+            run_sweep(case, comm_opts, save_log)
+        sys.exit(0)
+
+    if comm_opts['mode'] == 'prefetch':
+        for case in read_case_list(comm_opts['cases']):
+            run_prefetch_ab(case, comm_opts, save_log)
+        sys.exit(0)
+
+    if comm_opts['mode'] == 'frontend':
+        differ = []
+        if comm_opts['cases']:
+            for case in read_case_list(comm_opts['cases']):
+                if run_frontend_compare(case, comm_opts, save_log)[2]: differ.append(case)
+        if comm_opts['exports']:
+            differ += ['exports%d' % row[0] for row in run_export_scaling(comm_opts, save_log) if row[4] is False]
+        sys.exit(1 if differ else 0)
+
+    regressions = run_regress(comm_opts, save_log)
+    if regressions:
+        utils.writemsg('\n Significant slowdowns:\n')
+        for case, metric in regressions:
+            utils.writemsg('   %s: %s\n' % (case, metric))
+        sys.exit(1)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# helpers to read and edit the resource files of an ExtData test case:
+#
+#      read_rc
+#      get_rc_value
+#      clean_value
+#      set_rc_values
+#      get_cap_cases
+#      get_grid
+#      is_valid_layout
+# ------------------------------------------------------------------------------
+"""
+
+
+import os
+import re
+
+from collections import OrderedDict
+
+
+_TABLE_RE = re.compile(r'^\s*([A-Za-z_][\w.%-]*)::\s*$')
+_KEY_RE = re.compile(r'^\s*([A-Za-z_][\w.%-]*):(?!:)\s*(.*?)\s*$')
+
+
+def read_rc(rc_file):
+    """
+    # --------------------------------------------------------------------------
+    # parse an ESMF style resource file (the subset used by the test cases)
+    #
+    # Inputs:
+    #     rc_file: path to the rc file
+    # Output:
+    #     a list of two dicts
+    #      values: OrderedDict with label as key and the (raw) value string as
+    #              val. Values continued over several lines up to a closing
+    #              '::' (e.g. COLLECTIONS, <coll>.fields) are joined by spaces
+    #      tables: OrderedDict with table label (e.g. 'RUN_TIMES') as key and
+    #              the list of (non-comment) rows as val
+    # --------------------------------------------------------------------------
+    """
+
+    values = OrderedDict()
+    tables = OrderedDict()
+
+    fin = open(rc_file, 'r')
+    lines = [line.rstrip('\n') for line in fin]
+    fin.close()
+
+    # drop comments and blank lines
+    lines = [line for line in lines if line.strip() and not line.strip().startswith('#')]
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        m_table = _TABLE_RE.match(line)
+        m_key = _KEY_RE.match(line)
+        if m_table:
+            rows = []
+            i += 1
+            while i < len(lines) and lines[i].strip() != '::':
+                rows.append(lines[i].strip())
+                i += 1
+            tables[m_table.group(1)] = rows
+        elif m_key:
+            label, value = m_key.group(1), m_key.group(2)
+            # continuation lines count only if a '::' closes them
+            j = i + 1
+            extra = []
+            while j < len(lines) and lines[j].strip() != '::' and not _KEY_RE.match(lines[j]) \
+                    and not _TABLE_RE.match(lines[j]):
+                extra.append(lines[j].strip())
+                j += 1
+            if j < len(lines) and lines[j].strip() == '::':
+                value = ' '.join([value] + extra).strip()
+                i = j
+            values[label] = value
+        i += 1
+
+    return [values, tables]
+
+
+def get_rc_value(rc_file, label, default=None):
+    """
+    # --------------------------------------------------------------------------
+    # return the value of 'label' in rc_file with quotes and trailing commas
+    # stripped, or 'default' if the label (or the file) does not exist
+    # --------------------------------------------------------------------------
+    """
+
+    if not os.path.isfile(rc_file): return default
+    values = read_rc(rc_file)[0]
+    if label not in values: return default
+    return clean_value(values[label])
+
+
+def clean_value(value):
+    """
+    # --------------------------------------------------------------------------
+    # strip blanks, a trailing comma and quotes from a raw rc value
+    # --------------------------------------------------------------------------
+    """
+
+    return value.strip().rstrip(',').strip().strip('\'"')
+
+
+def set_rc_values(rc_file, new_values):
+    """
+    # --------------------------------------------------------------------------
+    # set 'label: value' lines in rc_file, replacing existing (uncommented)
+    # lines for that label and appending labels that are not present
+    #
+    # Inputs:
+    #        rc_file: path to the rc file, edited in place
+    #     new_values: dict with label as key and value as val
+    # --------------------------------------------------------------------------
+    """
+
+    fin = open(rc_file, 'r'); lines = fin.readlines(); fin.close()
+    done = set()
+    rout = open(rc_file, 'w')
+    for line in lines:
+        m_key = _KEY_RE.match(line)
+        if m_key and m_key.group(1) in new_values:
+            label = m_key.group(1)
+            line = '%s: %s\n' % (label, new_values[label])
+            done.add(label)
+        rout.write(line)
+    if lines and not lines[-1].endswith('\n'): rout.write('\n')
+    for label in new_values:
+        if label not in done:
+            rout.write('%s: %s\n' % (label, new_values[label]))
+    rout.close()
+
+
+def get_cap_cases(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # return the list of CAP rc files listed in CASES of case_path/CAP.rc
+    # --------------------------------------------------------------------------
+    """
+
+    cap_rc = os.path.join(case_path, 'CAP.rc')
+    if not os.path.isfile(cap_rc): return []
+    return read_rc(cap_rc)[1].get('CASES', [])
+
+
+def get_grid(agcm_rc, root_name='Root'):
+    """
+    # --------------------------------------------------------------------------
+    # return the root grid and layout of an AGCM rc file as a dict with keys
+    # 'grid_type' ('LatLon' or 'Cubed-Sphere'), 'im', 'jm', 'lm', 'nx', 'ny'.
+    # For cubed-sphere grids jm is 6*im (the faces are stacked along y)
+    # --------------------------------------------------------------------------
+    """
+
+    values = read_rc(agcm_rc)[0]
+    get = lambda label, default=None: clean_value(values.get(label, default))
+    grid = {}
+    grid['grid_type'] = get(root_name+'.GRID_TYPE', 'LatLon')
+    grid['im'] = int(get(root_name+'.IM_WORLD'))
+    if grid['grid_type'] == 'Cubed-Sphere':
+        grid['jm'] = 6*grid['im']
+    else:
+        grid['jm'] = int(get(root_name+'.JM_WORLD'))
+    grid['lm'] = int(get(root_name+'.LM', '1'))
+    grid['nx'] = int(get('NX', '1'))
+    grid['ny'] = int(get('NY', '1'))
+    return grid
+
+
+def is_valid_layout(grid, nx, ny, min_points=2):
+    """
+    # --------------------------------------------------------------------------
+    # True if an NX x NY layout can decompose grid (see get_grid)
+    # with at least min_points points per rank in each direction. For
+    # cubed-sphere grids NY must be a multiple of 6 (NY/6 ranks per face)
+    # --------------------------------------------------------------------------
+    """
+
+    if nx < 1 or ny < 1: return False
+    if grid['grid_type'] == 'Cubed-Sphere':
+        if ny % 6: return False
+        return grid['im']//nx >= min_points and grid['im']//(ny//6) >= min_points
+    return grid['im']//nx >= min_points and grid['jm']//ny >= min_points
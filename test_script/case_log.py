@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Case logs written compressed. A CaseLog is passed as stdout/stderr of the
+# driver like a plain log file, but what is written to it goes through a pipe
+# to a thread that gzips it into <log>.gz and keeps the last lines in a ring
+# buffer, written uncompressed to <log>.tail (every TAIL_FLUSH s and on close)
+# for a quick look at a running or failed case. The log parsers of utils read
+# both (see utils.open_log).
+#
+#      CaseLog
+#      open_case_log
+#      write_summary
+#      remove_log
+# ------------------------------------------------------------------------------
+"""
+
+import os
+import time
+import gzip
+import fcntl
+import threading
+from collections import deque
+
+import utils
+
+# lines kept in <log>.tail
+TAIL_LINES = 200
+# seconds between rewrites of <log>.tail while the case runs
+TAIL_FLUSH = 5.0
+# zlib level, logs compress well at low levels and the writer stays cheap
+COMPRESS_LEVEL = 3
+
+
+def _default_tail():
+
+    return int(os.environ.get('EXTDATA_LOG_TAIL') or TAIL_LINES)
+
+
+class CaseLog(object):
+
+    def __init__(self, path, tail_lines=None):
+
+        self.path = os.path.abspath(path)
+        self.name = self.path + '.gz'
+        self.tail_file = self.path + '.tail'
+        self.tail = deque(maxlen=tail_lines if tail_lines is not None else _default_tail())
+        self.gz = gzip.open(self.name, 'wb', COMPRESS_LEVEL)
+        self.rfd, self.wfd = os.pipe()
+        # only the driver (through its stdout/stderr) may hold the pipe open
+        for fd in [self.rfd, self.wfd]:
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.closed = False
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+
+        partial = b''
+        flushed = time.time()
+        while True:
+            data = os.read(self.rfd, 65536)
+            if not data: break
+            self.gz.write(data)
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+            self.tail.extend(lines)
+            if time.time() - flushed > TAIL_FLUSH:
+                self._write_tail(partial)
+                flushed = time.time()
+        if partial: self.tail.append(partial)
+        os.close(self.rfd)
+        self.gz.close()
+        self._write_tail(b'')
+
+    def _write_tail(self, partial):
+
+        if not self.tail.maxlen: return
+        fout = open(self.tail_file + '.tmp', 'wb')
+        fout.write(b'\n'.join(list(self.tail) + [partial]))
+        fout.close()
+        os.rename(self.tail_file + '.tmp', self.tail_file)
+
+    def fileno(self):
+
+        return self.wfd
+
+    def write(self, str2write):
+
+        if not isinstance(str2write, bytes): str2write = str2write.encode()
+        while str2write:
+            str2write = str2write[os.write(self.wfd, str2write):]
+
+    def flush(self):
+
+        pass
+
+    def close(self):
+        """
+        # ----------------------------------------------------------------------
+        # wait for the writer to drain the pipe and close <log>.gz. Anything
+        # still holding the pipe (e.g. a leftover driver process) keeps the
+        # log open, so this waits on it
+        # ----------------------------------------------------------------------
+        """
+
+        if self.closed: return
+        self.closed = True
+        os.close(self.wfd)
+        self.reader.join()
+
+
+def open_case_log(path, compress=True, tail_lines=None):
+    """
+    # --------------------------------------------------------------------------
+    # a CaseLog for path (compress=True) or the plain file path; either way
+    # the name attribute is the path of the full log
+    # --------------------------------------------------------------------------
+    """
+
+    if compress:
+        return CaseLog(path, tail_lines)
+    return open(path, 'w')
+
+
+def write_summary(log_name, summary_file, result=None, nlines=20):
+    """
+    # --------------------------------------------------------------------------
+    # write a short text summary of a case log to summary_file: the harness
+    # phase times and status (from result, as kept by compare_script), the
+    # EXTDATA timer block, the memory high water mark and the last nlines
+    # lines of the log
+    # --------------------------------------------------------------------------
+    """
+
+    fout = open(summary_file, 'w')
+    if result:
+        fout.write('status: %s\n' % result.get('status'))
+        for phase, seconds in (result.get('phase_times') or {}).items():
+            fout.write('%s: %.2f s\n' % (phase, seconds))
+    for entry, seconds in utils.get_mapl_timer_block(log_name, 'EXTDATA').items():
+        fout.write('EXTDATA %s: %.3f s\n' % (entry, seconds))
+    cap_mems = utils.get_mapl_memusage(log_name, ['EXTDATA'])[0]
+    if cap_mems:
+        fout.write('high water mark: %.1f MB\n' % max(cap_mems['high water mark']))
+    fin = utils.open_log(log_name)
+    last = deque(fin, maxlen=nlines)
+    fin.close()
+    fout.write('--- last %d lines ---\n' % len(last))
+    fout.writelines(last)
+    fout.close()
+
+
+def remove_log(log_name):
+    """
+    # --------------------------------------------------------------------------
+    # remove a case log and its tail file
+    # --------------------------------------------------------------------------
+    """
+
+    for path in [log_name, log_name[:-3] + '.tail' if log_name.endswith('.gz') else None]:
+        if path and os.path.exists(path):
+            os.remove(path)
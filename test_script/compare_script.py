@@ -2,7 +2,23 @@
   
 import argparse, sys, os
 import subprocess as sp
+import shutil
+import json
+import time
+import signal
+from collections import OrderedDict
 from run_case import ExtDataCase
+from validate_case import validate_case
+import benchmark
+import utils
+import file_watch
+import pipeline
+import disk_budget
+import case_log
+import io_events
+
+# reported per case when comparing two builds
+AB_METRICS = ['extdata_init', 'extdata_run', 'execute', 'hwm']
 
 def parse_comm_args():
 
@@ -13,7 +29,24 @@ def parse_comm_args():
     p.add_argument("--builddir",  dest="build_dir",help='src directory for build')
     p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
     p.add_argument("--cases",  dest="cases",help='list of cases')
-    p.add_argument("--savelog",dest="save_log",default="false",help='save the log files for all')
+    p.add_argument("--savelog",dest="save_log",default="false",help='save the log files for all (true), only a <case>.summary for passed cases (summary)')
+    p.add_argument("--compress-log",dest="compress_log",default="true",help='write <case>.log.gz plus an uncompressed <case>.log.tail instead of <case>.log')
+    p.add_argument("--log-tail",dest="log_tail",type=int,help='lines kept in <case>.log.tail (default: $EXTDATA_LOG_TAIL or 200)')
+    p.add_argument("--validate",dest="validate",default="true",help='check cases before running them')
+    p.add_argument("--scratch-dir",dest="scratch_dir",help='where cases run (default: ExtData_scratch)')
+    p.add_argument("--result-file",dest="result_file",help='json file with the status and phase times of each case')
+    p.add_argument("--watch",dest="watch",action="store_true",help='rerun the cases affected by changes to their files or to ExtDataDriver.x')
+    p.add_argument("--pipeline",dest="pipeline",action="store_true",help='stage the next case and clean up finished ones while a case runs')
+    p.add_argument("--io-baseline",dest="io_baseline",help='run cases with DEBUG_LEVEL 20 and check their ExtData I/O against this baseline file')
+    p.add_argument("--update-io-baseline",dest="update_io_baseline",action="store_true",help='store the I/O of the cases in --io-baseline')
+    p.add_argument("--space-check",dest="space_check",default="true",help='only start cases whose estimated output fits in the free scratch space')
+
+    # comparison of two builds
+    # ------------------------
+    p.add_argument("--candidate-builddir",  dest="candidate_build_dir",help='build to compare against --builddir')
+    p.add_argument("--nrep",  dest="nrep",type=int,default=1,help='runs of each case per build')
+    p.add_argument("--tolerance",  dest="tolerance",type=float,help='absolute tolerance of the output comparison (nccmp)')
+    p.add_argument("--logdir",  dest="log_dir",default=".",help='where the logs of the build comparison are written')
 
 
     args = vars(p.parse_args()) # vars converts to dict
@@ -24,12 +57,188 @@ def parse_comm_args():
         raise Exception('build_dir [%s] does not exist' % args['bas'])
     if not os.path.isdir(args['case_dir']):
         raise Exception('case_dir [%s] does not exist' % args['bas'])
+    if args['candidate_build_dir'] and not os.path.isdir(args['candidate_build_dir']):
+        raise Exception('candidate_build_dir [%s] does not exist' % args['candidate_build_dir'])
 
     # return opts
     # -----------
     return args
 
 
+def run_ab(comm_opts, cases):
+    """
+    # --------------------------------------------------------------------------
+    # run every case with the baseline (--builddir) and the candidate
+    # (--candidate-builddir) build, interleaved and --nrep times, check that
+    # their outputs agree and report how the candidate changes the EXTDATA
+    # times and the memory high water mark
+    #
+    # Output:
+    #     list of cases that failed or whose outputs differ
+    # --------------------------------------------------------------------------
+    """
+
+    save_log = comm_opts['save_log'].lower() != "false"
+    bad = []
+    summary = []
+    for case in cases:
+       variants = OrderedDict()
+       for label, build_dir in [('baseline', comm_opts['build_dir']),
+                                ('candidate', comm_opts['candidate_build_dir'])]:
+          variants[label] = dict(comm_opts)
+          variants[label]['build_dir'] = build_dir
+          variants[label]['output_dir'] = os.path.join(comm_opts['log_dir'], case+'.'+label+'.out')
+       print "running ",case,"with both builds"
+       try:
+          samples = benchmark.run_interleaved(case, variants, comm_opts['nrep'], 0, comm_opts['log_dir'], save_log)
+       except Exception as exc:
+          print case,"failed:",exc
+          bad.append(case)
+          continue
+
+       diffs = benchmark.compare_outputs(variants['baseline']['output_dir'], variants['candidate']['output_dir'],
+                                         comm_opts['tolerance'])
+       if not save_log:
+          for label in variants:
+             shutil.rmtree(variants[label]['output_dir'])
+
+       rows = benchmark.compare_variants(benchmark.summarize(samples['candidate']),
+                                         benchmark.summarize(samples['baseline']), AB_METRICS)
+       benchmark.write_variant_comparison(case+', candidate vs baseline', 'candidate', 'baseline', rows)
+       if diffs:
+          print " Outputs differ:"
+          for relpath, reason, detail in diffs:
+             print "  ",relpath,reason,detail
+          bad.append(case)
+       else:
+          print " Outputs agree"
+       summary.append((case, dict([(row[0], row[4]) for row in rows]), not diffs))
+
+    print ""
+    print " %-24s %12s %12s %12s %8s" % ('case', 'extdata_run', 'execute', 'hwm', 'outputs')
+    for case, changes, same in summary:
+       cols = ['%11.1f%%' % (100.0*changes[m]) if changes.get(m) is not None else '%12s' % '-'
+               for m in ['extdata_run', 'execute', 'hwm']]
+       print " %-24s %s %8s" % (case, ' '.join(cols), 'agree' if same else 'DIFFER')
+    return bad
+
+
+def _start_case(comm_opts, case, work_dir):
+
+    case_file = os.path.join(work_dir, case+'.txt')
+    fcase = open(case_file,'w')
+    fcase.write(case+'\n')
+    fcase.close()
+    cmd = [sys.executable, os.path.abspath(__file__),
+           '--builddir', comm_opts['build_dir'], '--casedir', comm_opts['case_dir'],
+           '--cases', case_file, '--scratch-dir', os.path.join(work_dir, 'scratch', case),
+           '--savelog', comm_opts['save_log'], '--validate', comm_opts['validate'],
+           '--compress-log', comm_opts['compress_log'], '--space-check', comm_opts['space_check']]
+    if comm_opts['log_tail'] is not None:
+        cmd += ['--log-tail', str(comm_opts['log_tail'])]
+    if comm_opts['pipeline']:
+        cmd += ['--pipeline']
+    # the cases run one at a time, so each run updates the baseline in turn
+    if comm_opts['io_baseline']:
+        cmd += ['--io-baseline', os.path.abspath(comm_opts['io_baseline'])]
+        if comm_opts['update_io_baseline']:
+            cmd += ['--update-io-baseline']
+    # own process group, which mpirun and the driver stay in (see
+    # ExtDataCase.execute), so that they go with it
+    env = dict(os.environ)
+    env['EXTDATA_CASE_GROUP'] = '1'
+    return sp.Popen(cmd, preexec_fn=os.setsid, env=env)
+
+
+def _group_alive(pgid):
+
+    # True while a process of group pgid other than a zombie is left
+    if not os.path.isdir('/proc'):
+       try:
+          os.killpg(pgid, 0)
+       except OSError:
+          return False
+       return True
+    for pid in os.listdir('/proc'):
+       if not pid.isdigit(): continue
+       try:
+          fin = open('/proc/%s/stat' % pid, 'r'); fields = fin.read().rsplit(')', 1)[1].split(); fin.close()
+       except (IOError, OSError, IndexError):
+          continue
+       if int(fields[2]) == pgid and fields[0] != 'Z':
+          return True
+    return False
+
+
+def _stop_case(run, sig=signal.SIGTERM, timeout=30):
+    """
+    # --------------------------------------------------------------------------
+    # send sig to the process group of a case started by _start_case and wait
+    # until all its processes (mpirun and the driver included) are gone, so
+    # that its scratch dir can be staged again; SIGKILL after timeout s
+    # --------------------------------------------------------------------------
+    """
+
+    try:
+       os.killpg(run.pid, sig)
+    except OSError:
+       pass
+    run.wait()
+    sTart = time.time()
+    while _group_alive(run.pid):
+       if time.time() - sTart > timeout and sig != signal.SIGKILL:
+          sig = signal.SIGKILL
+          try:
+             os.killpg(run.pid, sig)
+          except OSError:
+             pass
+       time.sleep(0.1)
+
+
+def run_watch(comm_opts, cases):
+    """
+    # --------------------------------------------------------------------------
+    # run the cases, then watch their case dirs and the build dir and rerun
+    # the cases affected by each change (see file_watch.affected_cases). A
+    # case that changes again while it runs is killed, with its MPI job, and
+    # queued again; it is restaged only once all its processes are gone.
+    # Runs until interrupted
+    # --------------------------------------------------------------------------
+    """
+
+    work_dir = os.path.abspath('ExtData_watch')
+    utils.mkdir_p(work_dir)
+    dirs = [os.path.join(comm_opts['case_dir'], case) for case in cases] + [comm_opts['build_dir']]
+    watcher = file_watch.make_watcher(dirs, sys.stdout)
+    pending = list(cases)
+    running = None # [case, process]
+    try:
+       while True:
+          if running is None and pending:
+             case = pending.pop(0)
+             running = [case, _start_case(comm_opts, case, work_dir)]
+          changed = watcher.wait(0.5 if running else None)
+          if changed:
+             for case in file_watch.affected_cases(changed, comm_opts['case_dir'], cases, comm_opts['build_dir']):
+                if running and running[0] == case:
+                   print case,"changed, cancelling its run"
+                   _stop_case(running[1])
+                   running = None
+                if case not in pending:
+                   pending.append(case)
+          if running and running[1].poll() is not None:
+             # driver processes the case left behind
+             _stop_case(running[1], signal.SIGKILL)
+             running = None
+             if not pending:
+                print "watching for changes (ctrl-c to stop)"
+    except KeyboardInterrupt:
+       if running:
+          _stop_case(running[1])
+    finally:
+       watcher.close()
+
+
 if __name__ == "__main__":
 
     comm_opts = parse_comm_args()
@@ -39,17 +248,90 @@ if __name__ == "__main__":
     case_file = open(case_path,'r')
     lines =case_file.readlines()
     case_file.close()
+    results = OrderedDict()
+    cases = []
     for case in lines:
-       print "running ",case.rstrip()
-       this_case = ExtDataCase(case,comm_opts)
-       logfile=case.rstrip()+".log"
-       log = open(logfile,'w')
-       success = this_case.run(log)
-       log.close()
-       if success:
-          print case.rstrip(),"passed"
-          if comm_opts['save_log'].lower() == "false":
-             os.remove(logfile)
-       else:
-          print case.rstrip(),"failed"
+       if comm_opts['validate'].lower() != "false":
+          problems = validate_case(case_dir+"/"+case.rstrip())
+          if problems:
+             for problem in problems:
+                print "  ",problem
+             print case.rstrip(),"failed validation"
+             results[case.rstrip()] = {'status': 'invalid', 'problems': problems}
+             continue
+       cases.append(case.rstrip())
+
+    if comm_opts['candidate_build_dir']:
+       sys.exit(1 if run_ab(comm_opts, cases) else 0)
+
+    if comm_opts['watch']:
+       run_watch(comm_opts, cases)
+       sys.exit(0)
+
+    save_log = comm_opts['save_log'].lower()
+    save_log = 'summary' if save_log == "summary" else save_log != "false"
+    compress_log = comm_opts['compress_log'].lower() != "false"
+
+    io_baseline = None
+    if comm_opts['io_baseline']:
+       io_baseline = benchmark.read_baseline(comm_opts['io_baseline'])
+       comm_opts = benchmark.with_overrides(comm_opts, {'ExtData.rc': {'DEBUG_LEVEL': '20'}})
+
+    def check_io(case, this_case, success, logfile):
+       if not success: return None
+       io = io_events.check_log(case, logfile, io_baseline, comm_opts['update_io_baseline'])
+       for flag in io['flags']:
+          print "%s I/O: %s" % (case,flag)
+       return io
+
+    budget = None
+    if comm_opts['space_check'].lower() != "false":
+       budget = disk_budget.SpaceBudget(comm_opts['scratch_dir'] or "ExtData_scratch")
+
+    if comm_opts['pipeline']:
+       for case, result in pipeline.run_pipelined(cases, comm_opts,
+                                                  save_log=save_log, budget=budget,
+                                                  compress_log=compress_log,
+                                                  tail_lines=comm_opts['log_tail'],
+                                                  postprocess=check_io if io_baseline is not None else None).items():
+          results[case] = result
+          if 'post' in result: result['io'] = result.pop('post')
+          print case,result['status']
+    else:
+       for case in cases:
+          this_case = ExtDataCase(case,comm_opts)
+          if budget:
+             nbytes = disk_budget.estimate_case_bytes(case_dir+"/"+case)
+             if not budget.reserve(case,nbytes,this_case.scratch_dir):
+                print case,"needs %.1f MB of scratch, %.1f MB free: not run" % (nbytes/1.e6,budget.free_bytes()/1.e6)
+                results[case] = {'status': 'no_space', 'bytes': nbytes}
+                continue
+          print "running ",case
+          log = case_log.open_case_log(case+".log",compress_log,comm_opts['log_tail'])
+          logfile = log.name
+          success = this_case.run(log)
+          log.close()
+          if budget: budget.release(case)
+          results[case] = {'status': 'passed' if success else 'failed',
+                           'phase_times': this_case.phase_times,
+                           'log': os.path.abspath(logfile)}
+          if success:
+             print case,"passed"
+             if io_baseline is not None:
+                results[case]['io'] = check_io(case,this_case,success,logfile)
+             if save_log is not True:
+                if save_log == "summary":
+                   results[case]['summary'] = os.path.abspath(case+".summary")
+                   case_log.write_summary(logfile,results[case]['summary'],results[case])
+                case_log.remove_log(logfile)
+                results[case]['log'] = None
+          else:
+             print case,"failed, see",logfile
+
+    if io_baseline is not None and comm_opts['update_io_baseline']:
+       benchmark.write_baseline(comm_opts['io_baseline'],io_baseline)
 
+    if comm_opts['result_file']:
+       fres = open(comm_opts['result_file'],'w')
+       json.dump(results,fres,indent=2)
+       fres.close()
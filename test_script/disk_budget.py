@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Estimate how much a case writes to its scratch dir, from its HISTORY
+# collections (fields, frequency, grid), the AGCM grid and export dims and the
+# CAP run length (RUN_TIMES or JOB_SGMT), and keep cases from starting when
+# their output would not fit in the free space of the scratch file system
+# (e.g. a tmpfs), counting what running cases have still to write.
+#
+#      estimate_case_bytes
+#      SpaceBudget
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import time
+import threading
+
+import case_config
+
+# netcdf values are written as 4 byte floats
+BYTES_PER_VALUE = 4
+# netcdf header, coordinates and metadata per record, and staged rc files/logs
+RECORD_OVERHEAD = 64*1024
+CASE_OVERHEAD = 1024*1024
+# the estimate is multiplied by this before it is compared to the free space
+SAFETY_FACTOR = 1.25
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Estimate the scratch space ExtData cases need')
+
+    p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
+    p.add_argument("--cases",  dest="cases",help='file with list of cases')
+    p.add_argument("--scratch-dir",dest="scratch_dir",default="ExtData_scratch",help='scratch dir whose file system is checked')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if not args['case_dir'] or not os.path.isdir(args['case_dir']):
+        raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+    if not args['cases'] or not os.path.isfile(args['cases']):
+        raise Exception('case file [%s] does not exist' % args['cases'])
+
+    return args
+
+
+def _seconds(hhmmss):
+
+    hhmmss = '%06d' % int(hhmmss)
+    return 3600*int(hhmmss[:-4]) + 60*int(hhmmss[-4:-2]) + int(hhmmss[-2:])
+
+
+def _run_seconds(values):
+
+    # JOB_SGMT is YYYYMMDD HHMMSS, months are taken as 30.4375 days
+    sgmt = case_config.clean_value(values.get('JOB_SGMT', '00000001 000000')).split()
+    ymd = sgmt[0].rjust(8, '0')
+    days = 365.25*int(ymd[:4]) + 30.4375*int(ymd[4:6]) + int(ymd[6:8])
+    return 86400*days + (_seconds(sgmt[1]) if len(sgmt) > 1 else 0)
+
+
+def _grid_points(values, label):
+
+    get = lambda key, default=None: case_config.clean_value(values.get(label+'.'+key, default))
+    im = int(get('IM_WORLD'))
+    jm = 6*im if get('GRID_TYPE', 'LatLon') == 'Cubed-Sphere' else int(get('JM_WORLD'))
+    return [im*jm, int(get('LM', '1'))]
+
+
+def estimate_case_bytes(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # estimated bytes a run of the case leaves in its scratch dir
+    #
+    # Each HISTORY collection writes one record per RUN_TIMES entry (or per
+    # frequency over JOB_SGMT) holding its fields on its grid (grid_label, or
+    # the root grid): xy fields on one level, xyz fields on LM levels (LM+1
+    # for edge fields)
+    # --------------------------------------------------------------------------
+    """
+
+    total = CASE_OVERHEAD
+    for cap_file in case_config.get_cap_cases(case_path):
+        values, tables = case_config.read_rc(os.path.join(case_path, cap_file))
+        root_name = case_config.clean_value(values.get('ROOT_NAME', 'Root'))
+        agcm_rc = os.path.join(case_path, case_config.clean_value(values['ROOT_CF']))
+        agcm_values, agcm_tables = case_config.read_rc(agcm_rc)
+        hist_values = case_config.read_rc(os.path.join(case_path, case_config.clean_value(values['HIST_CF'])))[0]
+
+        # levels of each export: 1 (xy), LM (xyz, center) or LM+1 (xyz, edge)
+        dims = {}
+        for row in agcm_tables.get('EXPORT_STATE', []):
+            cols = [col.strip() for col in row.split(',')]
+            if len(cols) < 4: continue
+            dims[cols[0]] = 'xy' if cols[3] == 'xy' else ('xyze' if len(cols) > 4 and cols[4] == 'e' else 'xyz')
+
+        run_times = tables.get('RUN_TIMES')
+        run_seconds = _run_seconds(values)
+
+        for coll in case_config.clean_value(hist_values.get('COLLECTIONS', '')).split():
+            coll = case_config.clean_value(coll)
+            grid_label = case_config.clean_value(hist_values.get(coll+'.grid_label', ''))
+            if grid_label:
+                points, lm = _grid_points(hist_values, grid_label)
+            else:
+                points, lm = _grid_points(agcm_values, root_name)
+            tokens = [case_config.clean_value(t) for t in hist_values.get(coll+'.fields', '').split(',')]
+            fields = [t for i, t in enumerate(tokens[:-1]) if tokens[i+1] == root_name]
+            levels = sum([{'xy': 1, 'xyz': lm, 'xyze': lm+1}[dims.get(field, 'xyz')] for field in fields])
+
+            if run_times:
+                records = len(run_times)
+            else:
+                frequency = _seconds(case_config.clean_value(hist_values.get(coll+'.frequency', '060000')))
+                records = int(run_seconds // max(frequency, 1)) + 1
+            total += records*(points*levels*BYTES_PER_VALUE + RECORD_OVERHEAD)
+    return total
+
+
+def _tree_bytes(path):
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class SpaceBudget(object):
+    """
+    # --------------------------------------------------------------------------
+    # space of the scratch file system promised to cases. A case reserves its
+    # estimate (times SAFETY_FACTOR) before it is staged and releases it once
+    # its scratch dir is gone; what a reserved case has already written is
+    # part of the used space, so only the rest of its estimate is counted
+    # against the free space
+    # --------------------------------------------------------------------------
+    """
+
+    def __init__(self, scratch_root, safety_factor=SAFETY_FACTOR):
+
+        self.scratch_root = os.path.abspath(scratch_root)
+        self.safety_factor = safety_factor
+        self.reserved = {}
+        self.cond = threading.Condition()
+
+    def _statvfs(self):
+
+        path = self.scratch_root
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return os.statvfs(path)
+
+    def free_bytes(self):
+
+        st = self._statvfs()
+        return st.f_bavail*st.f_frsize
+
+    def total_bytes(self):
+
+        st = self._statvfs()
+        return st.f_blocks*st.f_frsize
+
+    def _outstanding(self):
+
+        return sum([max(0, nbytes - _tree_bytes(scratch_dir))
+                    for scratch_dir, nbytes in self.reserved.values()])
+
+    def fits(self, nbytes):
+
+        return nbytes*self.safety_factor + self._outstanding() <= self.free_bytes()
+
+    def reserve(self, case, nbytes, scratch_dir, wait=True, timeout=60):
+        """
+        # ----------------------------------------------------------------------
+        # reserve nbytes for case (running in scratch_dir). If it does not fit,
+        # wait for other cases to release their space (wait=True); give up and
+        # return False if it is larger than the file system, if it does not fit
+        # and no other case holds space (after timeout s, to let background
+        # deletes free space) or if wait=False
+        # ----------------------------------------------------------------------
+        """
+
+        if nbytes*self.safety_factor > self.total_bytes(): return False
+        sTart = time.time()
+        with self.cond:
+            while not self.fits(nbytes):
+                if not wait: return False
+                if not self.reserved and time.time() - sTart > timeout: return False
+                self.cond.wait(1.0)
+            self.reserved[case] = (scratch_dir, nbytes*self.safety_factor)
+            return True
+
+    def release(self, case):
+
+        with self.cond:
+            self.reserved.pop(case, None)
+            self.cond.notify_all()
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    budget = SpaceBudget(comm_opts['scratch_dir'])
+    fin = open(comm_opts['cases'], 'r')
+    cases = [line.strip() for line in fin if line.strip()]
+    fin.close()
+
+    free = budget.free_bytes()
+    print(' %-24s %12s  (%.1f MB free)' % ('case', 'MB', free/1.e6))
+    for case in cases:
+        nbytes = estimate_case_bytes(os.path.join(comm_opts['case_dir'], case))
+        print(' %-24s %12.1f%s' % (case, nbytes/1.e6, '' if budget.fits(nbytes) else '  does not fit'))
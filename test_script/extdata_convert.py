@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Convert a legacy ExtData.rc (PrimaryExports%% and DerivedExports%% tables)
+# into the extdata.yaml (data_sets/rules) read by ExtData2G. Conversions are
+# cached by the sha1 of their input, in memory and on disk, so staging a case
+# twice does not convert it twice.
+#
+#      read_extdata_rc
+#      read_extdata_yaml
+#      iso_duration
+#      get_data_years
+#      convert
+#      convert_file
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import re
+import hashlib
+import tempfile
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import utils
+import case_config
+
+# bump when the output of convert changes, so stale cache entries are not used
+CONVERTER_VERSION = '2'
+
+_CACHE = {}
+
+_YEAR_RE = re.compile(r'(?<!\d)((?:19|20)\d\d)(?!\d)')
+_PERIOD_RE = re.compile(r'^P(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+)$')
+_OFFSET_RE = re.compile(r'^(.*?)([+-]P[0-9YMDTHS]+)$')
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Convert ExtData.rc to extdata.yaml')
+
+    p.add_argument("rc_file",help='ExtData.rc to convert')
+    p.add_argument("yaml_file",help='extdata.yaml to write')
+    p.add_argument("--casedir",  dest="case_path",help='case the rc file belongs to (for the data years)')
+    p.add_argument("--cachedir",  dest="cache_dir",help='conversion cache (default: $EXTDATA_CONVERT_CACHE or ~/.cache/extdata_convert)')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if not os.path.isfile(args['rc_file']):
+        raise Exception('rc file [%s] does not exist' % args['rc_file'])
+
+    return args
+
+
+def _read_lines(rc_file):
+
+    fin = open(rc_file, 'r')
+    lines = [line.strip() for line in fin]
+    fin.close()
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def read_extdata_rc(rc_file):
+    """
+    # --------------------------------------------------------------------------
+    # parse a legacy ExtData.rc
+    #
+    # Inputs:
+    #     rc_file: path to ExtData.rc
+    # Output:
+    #     a list of three elements
+    #      values: OrderedDict of the 'label: value' lines (see case_config)
+    #     primary: list of PrimaryExports%% rows, each split into columns
+    #     derived: list of DerivedExports%% rows, each split into columns
+    # --------------------------------------------------------------------------
+    """
+
+    values = case_config.read_rc(rc_file)[0]
+    tables = {'PrimaryExports': [], 'DerivedExports': []}
+
+    table = None
+    for line in _read_lines(rc_file):
+        if line.endswith('%%') and line[:-2] in tables:
+            table = line[:-2]
+        elif line == '%%':
+            table = None
+        elif table:
+            tables[table].append(line.split())
+
+    return [values, tables['PrimaryExports'], tables['DerivedExports']]
+
+
+def _split_flow(text):
+
+    # split at the commas that are not inside brackets or quotes
+    parts, depth, quote, cur = [], 0, None, ''
+    for ch in text:
+        if quote:
+            if ch == quote: quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch in '[{':
+            depth += 1
+        elif ch in ']}':
+            depth -= 1
+        elif ch == ',' and depth == 0:
+            parts.append(cur)
+            cur = ''
+            continue
+        cur += ch
+    if cur.strip(): parts.append(cur)
+    return [part.strip() for part in parts]
+
+
+def _flow_value(text):
+
+    text = text.strip()
+    if text.startswith('{') and text.endswith('}'):
+        entries = OrderedDict()
+        for part in _split_flow(text[1:-1]):
+            if ':' not in part:
+                raise Exception('entry [%s] of [%s] has no key' % (part, text))
+            key, val = part.split(':', 1)
+            entries[key.strip()] = _flow_value(val)
+        return entries
+    if text.startswith('[') and text.endswith(']'):
+        return [_flow_value(part) for part in _split_flow(text[1:-1])]
+    return text.strip('\'"')
+
+
+def read_extdata_yaml(yaml_file):
+    """
+    # --------------------------------------------------------------------------
+    # parse an extdata.yaml in the layout the test cases (and convert) use:
+    # top-level sections (data_sets, rules, derived) of one-line flow
+    # mappings, and top-level scalars
+    #
+    # Inputs:
+    #     yaml_file: path to extdata.yaml
+    # Output:
+    #     OrderedDict with section (or scalar) name as key and an OrderedDict
+    #     of entry name to dict of settings (or the scalar string) as val.
+    #     Lists become lists of strings, quotes are stripped
+    # --------------------------------------------------------------------------
+    """
+
+    config = OrderedDict()
+    section = None
+    for line in open(yaml_file, 'r'):
+        line = line.split(' #')[0].rstrip()
+        if not line.strip() or line.lstrip().startswith('#'): continue
+        key, val = line.split(':', 1)
+        if not line[0].isspace():
+            section = key.strip()
+            config[section] = _flow_value(val) if val.strip() else OrderedDict()
+        elif section is None or not isinstance(config[section], OrderedDict) or not val.strip():
+            raise Exception('%s: line [%s] not supported' % (yaml_file, line.strip()))
+        else:
+            config[section][key.strip()] = _flow_value(val)
+    return config
+
+
+def iso_duration(period):
+    """
+    # --------------------------------------------------------------------------
+    # convert an ExtData.rc period (PYYYY-MM-DDThh:mm:ss) to an ISO 8601
+    # duration, e.g. P0000-00-00T03:00:00 -> PT3H
+    # --------------------------------------------------------------------------
+    """
+
+    m = _PERIOD_RE.match(period)
+    if not m:
+        raise Exception('period [%s] not recognized' % period)
+    years, months, days, hours, minutes, seconds = [int(n) for n in m.groups()]
+    date = ''.join(['%d%s' % (n, u) for n, u in zip([years, months, days], 'YMD') if n])
+    time = ''.join(['%d%s' % (n, u) for n, u in zip([hours, minutes, seconds], 'HMS') if n])
+    if not date and not time: time = '0S'
+    return 'P' + date + ('T' + time if time else '')
+
+
+def get_data_years(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # return [first, last] year of the data CAP1 writes for a case: the years
+    # of its RUN_TIMES or, without RUN_TIMES, of BEG_DATE to BEG_DATE+JOB_SGMT.
+    # None if CAP1.rc cannot be read
+    # --------------------------------------------------------------------------
+    """
+
+    cap1_rc = os.path.join(case_path, 'CAP1.rc')
+    if not os.path.isfile(cap1_rc): return None
+    values, tables = case_config.read_rc(cap1_rc)
+
+    run_times = tables.get('RUN_TIMES')
+    if run_times:
+        years = [int(row.split()[0][:4]) for row in run_times]
+        return [min(years), max(years)]
+
+    if 'BEG_DATE' not in values or 'JOB_SGMT' not in values: return None
+    beg = datetime.strptime(case_config.clean_value(values['BEG_DATE']), '%Y%m%d %H%M%S')
+    sgmt = case_config.clean_value(values['JOB_SGMT']).split()[0]
+    months = 12*int(sgmt[:4]) + int(sgmt[4:6])
+    end_month = beg.month - 1 + months
+    end = beg.replace(year=beg.year + end_month//12, month=end_month%12 + 1) + \
+        timedelta(days=int(sgmt[6:8]))
+    return [beg.year, (end - timedelta(seconds=1)).year]
+
+
+def _refresh_keys(refresh):
+    """
+    # --------------------------------------------------------------------------
+    # the rule keys for the refresh column of an ExtData.rc row:
+    #    0: interpolate in time (default, no keys)
+    #    -: read once
+    #   F*: no time interpolation, rest as below
+    #     : template (e.g. %y4-%m2-%d2t12:00:00) with an optional offset
+    #       appended (e.g. %y4-%m2-%d2t12:00:00-PT3H)
+    # --------------------------------------------------------------------------
+    """
+
+    keys = OrderedDict()
+    if refresh == '-':
+        keys['update_frequency'] = '"-"'
+        return keys
+    if refresh.startswith('F'):
+        keys['time_interpolation'] = 'false'
+        refresh = refresh[1:]
+    if refresh in ['', '0']:
+        return keys
+
+    m = _OFFSET_RE.match(refresh)
+    if m:
+        refresh, offset = m.groups()
+    else:
+        offset = None
+
+    # the finest time token left in the template gives the update frequency
+    for token, frequency in [('%n2', 'PT1M'), ('%h2', 'PT1H'), ('%d2', 'P1D'), ('%m2', 'P1M'), ('%y4', 'P1Y')]:
+        if token in refresh:
+            keys['update_frequency'] = '"%s"' % frequency
+            break
+    else:
+        raise Exception('refresh template [%s] not recognized' % refresh)
+
+    # the literal time of day of the template is the reference time
+    time_part = refresh.lower().split('t')[-1] if 't' in refresh.lower() else ''
+    if time_part and '%' not in time_part:
+        keys['update_reference_time'] = '"%s"' % time_part
+    else:
+        keys['update_reference_time'] = '"0"'
+    if offset:
+        keys['update_offset'] = '"%s"' % offset
+    return keys
+
+
+def _flow(entries):
+
+    return '{%s}' % ', '.join(['%s: %s' % (key, val) for key, val in entries.items()])
+
+
+def convert(rc_file, data_years=None):
+    """
+    # --------------------------------------------------------------------------
+    # convert a legacy ExtData.rc to extdata.yaml
+    #
+    # Inputs:
+    #        rc_file: path to ExtData.rc
+    #     data_years: [first, last] year of the data the case reads (see
+    #                 get_data_years), used for the valid_range of
+    #                 climatologies and of non-climatologies with a time
+    #                 template (the years of the files ExtData 1G finds)
+    # Output:
+    #     the extdata.yaml text
+    # --------------------------------------------------------------------------
+    """
+
+    values, primary, derived = read_extdata_rc(rc_file)
+    allow_extrap = case_config.clean_value(values.get('Ext_AllowExtrap', '.false.')).lower() in ['.true.', 'true', 'yes']
+
+    data_sets = OrderedDict()
+    rules = OrderedDict()
+    for row in primary:
+        if len(row) < 9:
+            raise Exception('PrimaryExports row [%s] has too few columns' % ' '.join(row))
+        name, units, clim, conserv, refresh, offset, scale, file_var, template = row[:9]
+
+        # one data set per file template (and reference time/frequency)
+        data_set = OrderedDict([('file_template', '"%s"' % template)])
+        if len(row) > 9:
+            ref_time, period = row[9].split('P', 1)
+            data_set['file_reference_time'] = '"%s"' % ref_time
+            data_set['file_frequency'] = '"%s"' % iso_duration('P' + period)
+
+        rule = OrderedDict([('file_var', file_var)])
+        if clim not in ['N', 'n']:
+            # climatology: 'Y' (year from the template) or the year to use
+            if clim.isdigit():
+                year = int(clim)
+            else:
+                m = _YEAR_RE.search(template)
+                year = int(m.group(1)) if m else (data_years or [None])[0]
+            if year:
+                data_set['valid_range'] = '[%d, %d]' % (year, year)
+                rule['source_time'] = '[%d, %d]' % (year, year)
+            rule['cycling'] = 'true'
+        elif data_years and '%' in template:
+            data_set['valid_range'] = '[%d, %d]' % tuple(data_years)
+            if allow_extrap: rule['cycling'] = 'true'
+        if conserv in ['Y', 'y']:
+            rule['regrid'] = 'CONSERVE'
+        rule.update(_refresh_keys(refresh))
+        if offset != 'none' or scale != 'none':
+            rule['linear_transformation'] = '[%s, %s]' % (offset if offset != 'none' else '0.0',
+                                                          scale if scale != 'none' else '1.0')
+
+        set_key = tuple(data_set.items())
+        for key in data_sets:
+            if tuple(data_sets[key].items()) == set_key:
+                break
+        else:
+            key = 'fstream%d' % (len(data_sets)+1)
+            data_sets[key] = data_set
+        rules[name] = OrderedDict([('file_var', rule.pop('file_var')),
+                                   ('file_template_key', key)] + list(rule.items()))
+
+    lines = ['data_sets:']
+    lines += ['   %s: %s' % (key, _flow(data_set)) for key, data_set in data_sets.items()]
+    lines += ['rules:']
+    lines += ['   %s: %s' % (name, _flow(rule)) for name, rule in rules.items()]
+
+    if derived:
+        lines += ['derived:']
+        for row in derived:
+            if len(row) < 3:
+                raise Exception('DerivedExports row [%s] has too few columns' % ' '.join(row))
+            name, expression, refresh = row[0], ' '.join(row[1:-1]), row[-1]
+            rule = OrderedDict([('function', '"%s"' % expression)])
+            rule.update(_refresh_keys(refresh))
+            lines += ['   %s: %s' % (name, _flow(rule))]
+
+    return '\n'.join(lines) + '\n'
+
+
+def _cache_dir(cache_dir=None):
+
+    if cache_dir: return cache_dir
+    return os.environ.get('EXTDATA_CONVERT_CACHE') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'extdata_convert')
+
+
+def convert_file(rc_file, yaml_file, data_years=None, cache_dir=None):
+    """
+    # --------------------------------------------------------------------------
+    # write the conversion of rc_file to yaml_file, reusing a cached
+    # conversion of the same input if there is one
+    #
+    # Inputs:
+    #        rc_file: path to ExtData.rc
+    #      yaml_file: path to the extdata.yaml to write
+    #     data_years: see convert
+    #      cache_dir: on-disk cache (default: $EXTDATA_CONVERT_CACHE or
+    #                 ~/.cache/extdata_convert); an unwritable cache is skipped
+    # Output:
+    #     True if the conversion came from the cache
+    # --------------------------------------------------------------------------
+    """
+
+    fin = open(rc_file, 'rb'); content = fin.read(); fin.close()
+    key = hashlib.sha1(content + ('%s %s' % (CONVERTER_VERSION, data_years)).encode()).hexdigest()
+    cache_file = os.path.join(_cache_dir(cache_dir), key + '.yaml')
+
+    cached = key in _CACHE
+    if not cached and os.path.isfile(cache_file):
+        fin = open(cache_file, 'r'); _CACHE[key] = fin.read(); fin.close()
+        cached = True
+    if not cached:
+        _CACHE[key] = convert(rc_file, data_years)
+        try:
+            utils.mkdir_p(os.path.dirname(cache_file))
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+            os.write(fd, _CACHE[key].encode())
+            os.close(fd)
+            os.rename(tmp_file, cache_file)
+        except (OSError, IOError):
+            pass
+
+    fout = open(yaml_file, 'w'); fout.write(_CACHE[key]); fout.close()
+    return cached
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    data_years = get_data_years(comm_opts['case_path']) if comm_opts['case_path'] else None
+    convert_file(comm_opts['rc_file'], comm_opts['yaml_file'], data_years, comm_opts['cache_dir'])
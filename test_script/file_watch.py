@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Wait for files to change in a set of directories (not recursive). Uses
+# inotify (through ctypes, linux only) and falls back to comparing the
+# mtime/size of the files every POLL_INTERVAL seconds.
+#
+#      InotifyWatcher
+#      PollingWatcher
+#      make_watcher
+#      affected_cases
+# ------------------------------------------------------------------------------
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+POLL_INTERVAL = 1.0 # seconds
+# changes arriving within SETTLE seconds of each other are reported together
+SETTLE = 0.2
+
+# inotify(7)
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _ignored(name):
+
+    # editor swap and backup files
+    return name.startswith('.') or name.endswith('~') or name.endswith('.swp')
+
+
+class InotifyWatcher(object):
+
+    def __init__(self, dirs):
+
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name or not sys.platform.startswith('linux'):
+            raise OSError('inotify not available')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for d in dirs:
+            wd = self.libc.inotify_add_watch(self.fd, os.path.abspath(d).encode(), _WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch [%s] failed' % d)
+            self.dirs[wd] = os.path.abspath(d)
+
+    def _read(self, timeout):
+
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN: return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset+length].rstrip(b'\0').decode()
+            offset += length
+            if wd in self.dirs and name and not _ignored(name):
+                changed.add(os.path.join(self.dirs[wd], name))
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        # ----------------------------------------------------------------------
+        # block up to timeout (s, None: forever) for changes and return the
+        # set of changed paths (empty on timeout)
+        # ----------------------------------------------------------------------
+        """
+
+        changed = self._read(timeout)
+        while changed:
+            more = self._read(SETTLE)
+            if not more: break
+            changed |= more
+        return changed
+
+    def close(self):
+
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+
+    def __init__(self, dirs, interval=POLL_INTERVAL):
+
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+
+        snapshot = {}
+        for d in self.dirs:
+            if not os.path.isdir(d): continue
+            for name in os.listdir(d):
+                if _ignored(name): continue
+                path = os.path.join(d, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+
+        sTart = time.time()
+        while True:
+            snapshot = self._snapshot()
+            changed = set([path for path in set(snapshot) | set(self.snapshot)
+                           if snapshot.get(path) != self.snapshot.get(path)])
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if timeout is not None and time.time() - sTart >= timeout:
+                return changed
+            time.sleep(self.interval if timeout is None else
+                       max(0.0, min(self.interval, timeout - (time.time() - sTart))))
+
+    def close(self):
+
+        pass
+
+
+def make_watcher(dirs, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # InotifyWatcher for dirs, or PollingWatcher if inotify is not available
+    # --------------------------------------------------------------------------
+    """
+
+    try:
+        return InotifyWatcher(dirs)
+    except (OSError, AttributeError):
+        if fout: fout.write(' inotify not available, polling every %.1f s\n' % POLL_INTERVAL)
+        return PollingWatcher(dirs)
+
+
+def affected_cases(changed, case_dir, cases, build_dir):
+    """
+    # --------------------------------------------------------------------------
+    # cases that have to rerun after the files in changed have changed: all
+    # of them for a new ExtDataDriver.x or g5_modules in build_dir, else those
+    # whose case dir holds a changed file
+    # --------------------------------------------------------------------------
+    """
+
+    build_dir = os.path.abspath(build_dir)
+    case_dir = os.path.abspath(case_dir)
+    for path in changed:
+        if os.path.dirname(path) == build_dir and \
+           os.path.basename(path) in ['ExtDataDriver.x', 'g5_modules']:
+            return list(cases)
+    changed_dirs = set([os.path.dirname(path) for path in changed])
+    return [case for case in cases if os.path.join(case_dir, case) in changed_dirs]
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Generate ExtData stress cases from a compact spec (grid, number of 2D/3D
+# variables, file template granularity, history frequency and time span).
+# The generated case has the same layout as the hand written ones: CAP1
+# generates the data with History, CAP2 reads it back through ExtData and
+# compares the imports with the expected values.
+#
+#      parse_grid
+#      parse_span
+#      generate_case
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import shutil
+from datetime import datetime, timedelta
+
+import utils
+import case_config
+
+# history/ExtData file templates by granularity
+TEMPLATES = {'year':  '%y4.nc4',
+             'month': '%y4%m2.nc4',
+             'day':   '%y4%m2%d2.nc4',
+             'step':  '%y4%m2%d2_%h2%n2.nc4'}
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Generate an ExtData stress case')
+
+    p.add_argument("--name",  dest="name",required=True,help='name of the case to create')
+    p.add_argument("--casedir",  dest="case_dir",required=True,help='where cases are located')
+    p.add_argument("--grid",  dest="grid",default="90x45",help='cNNN (cubed-sphere) or IMxJM (lat-lon)')
+    p.add_argument("--lm",  dest="lm",type=int,default=72,help='number of levels')
+    p.add_argument("--n2d",  dest="n2d",type=int,default=1,help='number of 2D variables')
+    p.add_argument("--n3d",  dest="n3d",type=int,default=1,help='number of 3D variables')
+    p.add_argument("--collections",  dest="collections",type=int,default=1,help='spread variables over this many files')
+    p.add_argument("--granularity",  dest="granularity",default="year",choices=sorted(TEMPLATES),
+                   help='one file per year/month/day/output step')
+    p.add_argument("--frequency",  dest="frequency",default="060000",help='history frequency (HHMMSS)')
+    p.add_argument("--start",  dest="start",default="20040101",help='start date (YYYYMMDD)')
+    p.add_argument("--span",  dest="span",default="2d",help='time span, e.g. 2d, 3m, 1y')
+    p.add_argument("--ncompare",  dest="ncompare",type=int,default=4,help='number of CAP2 run times')
+    p.add_argument("--layout",  dest="layout",help='NXxNY (default 1x1, or 1x6 for cubed-sphere)')
+    p.add_argument("--force",  dest="force",action="store_true",help='overwrite an existing case')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if not os.path.isdir(args['case_dir']):
+        raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+
+    return args
+
+
+def parse_grid(grid_spec, lm):
+    """
+    # --------------------------------------------------------------------------
+    # turn 'c180' or '360x181' into a grid dict (see case_config.get_grid)
+    # --------------------------------------------------------------------------
+    """
+
+    grid_spec = grid_spec.lower()
+    if grid_spec.startswith('c'):
+        im = int(grid_spec[1:])
+        return {'grid_type': 'Cubed-Sphere', 'im': im, 'jm': 6*im, 'lm': lm}
+    im, jm = [int(n) for n in grid_spec.split('x')]
+    return {'grid_type': 'LatLon', 'im': im, 'jm': jm, 'lm': lm}
+
+
+def parse_span(span):
+    """
+    # --------------------------------------------------------------------------
+    # turn '2d', '3m' or '1y' into (JOB_SGMT string, number of months, days)
+    # --------------------------------------------------------------------------
+    """
+
+    count, unit = int(span[:-1]), span[-1].lower()
+    if unit == 'y':
+        return ['%04d0000 000000' % count, 12*count, 0]
+    if unit == 'm':
+        return ['%04d%02d00 000000' % (count//12, count%12), count, 0]
+    if unit == 'd' and count < 100:
+        return ['000000%02d 000000' % count, 0, count]
+    raise Exception('span [%s] not recognized (use <n>d with n<100, <n>m or <n>y)' % span)
+
+
+def _add_months(date, months):
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month//12, month=month%12 + 1)
+
+
+def _grid_lines(grid, nx, ny):
+    lines = ['NX: %d' % nx, 'NY: %d' % ny, '']
+    if grid['grid_type'] == 'Cubed-Sphere':
+        lines += ['Root.GRID_TYPE: Cubed-Sphere',
+                  'Root.GRIDNAME: PE%dx%d-CF' % (grid['im'], grid['jm']),
+                  'Root.LM: %d' % grid['lm'],
+                  'Root.IM_WORLD: %d' % grid['im'],
+                  'Root.NF: 6']
+    else:
+        lines += ['Root.GRID_TYPE: LatLon',
+                  'Root.GRIDNAME: DC%dx%d-PC' % (grid['im'], grid['jm']),
+                  'Root.LM: %d' % grid['lm'],
+                  'Root.IM_WORLD: %d' % grid['im'],
+                  'Root.JM_WORLD: %d' % grid['jm'],
+                  "Root.POLE: 'PC'",
+                  "Root.DATELINE: 'DC'"]
+    return lines + ['']
+
+
+def _write(case_path, name, lines):
+    fout = open(os.path.join(case_path, name), 'w')
+    fout.write('\n'.join(lines) + '\n')
+    fout.close()
+
+
+def generate_case(case_path, spec, force=False):
+    """
+    # --------------------------------------------------------------------------
+    # write a complete test case (CAP, AGCM, HISTORY, ExtData.rc, extdata.yaml,
+    # nproc.rc, README) to case_path
+    #
+    # Inputs:
+    #     case_path: directory of the new case
+    #          spec: dict with keys grid (dict, see parse_grid), n2d, n3d,
+    #                collections, granularity, frequency (HHMMSS), start
+    #                (YYYYMMDD), span, ncompare and layout ((NX, NY) or None)
+    #         force: overwrite an existing case_path
+    # Output:
+    #     list of variable names in the case
+    # --------------------------------------------------------------------------
+    """
+
+    grid = spec['grid']
+    if spec.get('layout'):
+        nx, ny = spec['layout']
+    elif grid['grid_type'] == 'Cubed-Sphere':
+        nx, ny = 1, 6
+    else:
+        nx, ny = 1, 1
+    if not case_config.is_valid_layout(grid, nx, ny):
+        raise Exception('layout %dx%d is not valid for this grid' % (nx, ny))
+    if spec['granularity'] not in TEMPLATES:
+        raise Exception('granularity [%s] not recognized' % spec['granularity'])
+
+    if os.path.isdir(case_path):
+        if not force: raise Exception('case [%s] already exists' % case_path)
+        shutil.rmtree(case_path)
+    utils.mkdir_p(case_path)
+
+    # times
+    # -----
+    freq = spec['frequency']
+    freq_sec = int(freq[:-4])*3600 + int(freq[-4:-2])*60 + int(freq[-2:])
+    job_sgmt, nmonths, ndays = parse_span(spec['span'])
+    start = datetime.strptime(spec['start'], '%Y%m%d')
+    end = _add_months(start, nmonths) + timedelta(days=ndays)
+    nsteps = int((end-start).total_seconds())//freq_sec
+    if nsteps < 2:
+        raise Exception('span [%s] holds less than 2 history outputs' % spec['span'])
+    ncompare = max(1, min(spec['ncompare'], nsteps-1))
+    run_times = []
+    for k in range(ncompare):
+        step = (k*(nsteps-1))//ncompare
+        run_times.append(start + timedelta(seconds=(step+0.5)*freq_sec))
+    heartbeat2 = freq_sec//2 if freq_sec % 2 == 0 else freq_sec
+    last_year = (start + timedelta(seconds=(nsteps-1)*freq_sec)).year
+
+    # variables and collections
+    # -------------------------
+    variables = ['VAR2D_%03d' % i for i in range(1, spec['n2d']+1)] + \
+                ['VAR3D_%03d' % i for i in range(1, spec['n3d']+1)]
+    if not variables: raise Exception('case needs at least one variable')
+    ncoll = max(1, min(spec['collections'], len(variables)))
+    collections = ['stress%02d' % i for i in range(1, ncoll+1)]
+    coll_of = dict([(var, collections[i % ncoll]) for i, var in enumerate(variables)])
+    state = ['%s , time , days , %s , c' % (var, 'xy' if var.startswith('VAR2D') else 'xyz')
+             for var in variables]
+    template = TEMPLATES[spec['granularity']]
+
+    # CAP
+    # ---
+    _write(case_path, 'CAP.rc', ['CASES::', 'CAP1.rc', 'CAP2.rc', '::'])
+    for icap, heartbeat, times in [(1, freq_sec, []), (2, heartbeat2, run_times)]:
+        lines = ['ROOT_NAME: Root', 'ROOT_CF: AGCM%d.rc' % icap, 'HIST_CF: HISTORY%d.rc' % icap, '',
+                 'BEG_DATE:     %s' % start.strftime('%Y%m%d %H%M%S'), '',
+                 'JOB_SGMT:     %s' % job_sgmt, 'HEARTBEAT_DT:   %d' % heartbeat, '']
+        if times:
+            lines += ['RUN_TIMES::'] + [t.strftime('%Y%m%d %H%M%S') for t in times] + ['::']
+        _write(case_path, 'CAP%d.rc' % icap, lines)
+
+    # AGCM
+    # ----
+    fill_def = ['FILL_DEF::'] + ['%s time' % var for var in variables] + ['::', '']
+    ref_time = ['REF_TIME: %s' % start.strftime('%Y%m%d %H%M%S')]
+    _write(case_path, 'AGCM1.rc', _grid_lines(grid, nx, ny) +
+           ['RUN_MODE: GenerateExports', '', 'EXPORT_STATE::'] + state + ['::', ''] + fill_def + ref_time)
+    _write(case_path, 'AGCM2.rc', _grid_lines(grid, nx, ny) +
+           ['RUN_MODE: CompareImports', '', 'IMPORT_STATE::'] + state + ['::', '',
+            'EXPORT_STATE::'] + state + ['::', ''] + fill_def + ref_time)
+    _write(case_path, 'nproc.rc', ['%d' % (nx*ny)])
+
+    # HISTORY
+    # -------
+    duration = freq if spec['granularity'] == 'step' else '000000'
+    lines = ['GRID_LABELS:', '::', '', 'COLLECTIONS: ' + collections[0]] + \
+            ['             %s' % coll for coll in collections[1:]] + ['::', '']
+    for coll in collections:
+        fields = ["'%s', 'Root'," % var for var in variables if coll_of[var] == coll]
+        lines += ["  %s.template:  '%s'," % (coll, template),
+                  "  %s.format:    'CFIO'," % coll,
+                  "  %s.frequency:  %s," % (coll, freq),
+                  "  %s.duration: %s" % (coll, duration),
+                  "  %s.fields: %s" % (coll, fields[0])] + \
+                 ['                %s' % field for field in fields[1:]] + \
+                 ['                          ::', '']
+    _write(case_path, 'HISTORY1.rc', lines)
+    _write(case_path, 'HISTORY2.rc', ['GRID_LABELS:', '::', '', 'COLLECTIONS:', '::'])
+
+    # ExtData.rc and extdata.yaml
+    # ---------------------------
+    lines = ['#CASE_SENSITIVE_VARIABLE_NAMES: .false.', 'Ext_AllowExtrap: .false.',
+             'Prefetch: .true.', '#DEBUG_LEVEL: 20', '', 'PrimaryExports%%']
+    lines += ['%s NA  N N 0   none     none %s %s.%s' % (var, var, coll_of[var], template)
+              for var in variables]
+    lines += ['%%', '', '', 'DerivedExports%%', '%%']
+    _write(case_path, 'ExtData.rc', lines)
+
+    lines = ['data_sets:']
+    for icoll, coll in enumerate(collections):
+        lines.append('   fstream%d: {file_template: "%s.%s", valid_range: [%d, %d] }' %
+                     (icoll+1, coll, template, start.year, last_year))
+    lines.append('rules:')
+    for var in variables:
+        lines.append('   %s: {file_var: %s, file_template_key: fstream%d}' %
+                     (var, var, collections.index(coll_of[var])+1))
+    _write(case_path, 'extdata.yaml', lines)
+
+    _write(case_path, 'README', [
+        'Generated stress case: %s grid %dx%d, LM %d, %d 2D + %d 3D variables in %d collection(s),' %
+        (grid['grid_type'], grid['im'], grid['jm'], grid['lm'], spec['n2d'], spec['n3d'], ncoll),
+        '%s files, history every %s from %s for %s, layout %dx%d' %
+        (spec['granularity'], freq, spec['start'], spec['span'], nx, ny)])
+
+    return variables
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    spec = dict(comm_opts)
+    spec['grid'] = parse_grid(comm_opts['grid'], comm_opts['lm'])
+    if comm_opts['layout']:
+        spec['layout'] = [int(n) for n in comm_opts['layout'].lower().split('x')]
+    case_path = os.path.join(comm_opts['case_dir'], comm_opts['name'])
+    variables = generate_case(case_path, spec, comm_opts['force'])
+    utils.writemsg(' Created %s with %d variables\n' % (case_path, len(variables)))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Turn the ExtData debug output of a case log (DEBUG_LEVEL: 20 in ExtData.rc)
+# into a stream of I/O events and check the I/O behaviour of a case against
+# a stored baseline. Each event has the model time (from the AGCM Date lines
+# of the cap), the action (step, update, read, open, prefetch), the variable,
+# the file, the bracket side (L/R) and the time index read.
+#
+# The debug messages differ between MAPL versions; EVENT_PATTERNS holds the
+# forms recognized (ExtData 1G bracket updates followed by a file line, the
+# ExtData2G 'updated L bracket with' messages, READ_LOOP and prefetch
+# messages, and file opens), and lines that match none are ignored.
+#
+#     io_events.py events --log case1.log.gz
+#     io_events.py check --cases list --baseline io_baseline.json
+#
+#      parse_events
+#      write_events
+#      summarize_io
+#      compare_io
+#      check_log
+#      find_log
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import re
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+import utils
+import benchmark
+
+# (action, regex) in order, the first match wins. Named groups: var, side,
+# file, index, date, time
+EVENT_PATTERNS = [
+    ('step',     re.compile(r'AGCM Date:\s*(?P<date>\S+)\s+Time:\s*(?P<time>\S+)')),
+    ('read',     re.compile(r'(?P<var>\S+)\s+updated\s+(?P<side>[LR])\s+bracket\s+with:?\s*(?P<file>\S+)'
+                            r'(?:\s+at\s+time\s+index\s+(?P<index>\d+))?')),
+    ('update',   re.compile(r'[Uu]pdating\s+(?P<side>[LR])\s+bracket\s+for\s+(?P<var>\S+)')),
+    ('read',     re.compile(r'^\s*file:\s*(?P<file>\S+)(?:\s+at\s+time\s+index\s+(?P<index>\d+))?')),
+    ('update',   re.compile(r'READ_LOOP:\s*variable\s+\d+\s+of\s+\d+\s*:?\s*(?P<var>\S+)')),
+    ('prefetch', re.compile(r'(?i)(?:Run_:\s*PREFETCH|prefetch(?:ing)?\s+(?:of\s+|for\s+)?(?P<var>[A-Za-z_]\w*)\b(?!:))')),
+    ('open',     re.compile(r'(?i)\bopen(?:ing|ed)?\b(?:\s+file)?:?\s+(?P<file>\S+\.nc4?)\b')),
+]
+
+# fraction of the steps a file has to be read in to count as read every step
+EVERY_STEP = 0.9
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='ExtData debug log I/O events')
+
+    p.add_argument("action",  choices=['events', 'check'],help='print the events of logs or check cases against the baseline')
+    p.add_argument("--log",  dest="logs",nargs='+',default=[],help='case logs (plain or .gz)')
+    p.add_argument("--cases",  dest="cases",help='file with list of cases, whose logs are <logdir>/<case>.log[.gz]')
+    p.add_argument("--logdir",  dest="log_dir",default=".",help='where the case logs are')
+    p.add_argument("--json",  dest="json",action="store_true",help='print events as json, one per line')
+    p.add_argument("--baseline",  dest="baseline",default="io_baseline.json",help='baseline file')
+    p.add_argument("--update-baseline",  dest="update_baseline",action="store_true",help='store the summaries as new baseline')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if args['action'] == 'check' and not args['cases']:
+        raise Exception('check needs --cases')
+    if args['cases'] and not os.path.isfile(args['cases']):
+        raise Exception('case file [%s] does not exist' % args['cases'])
+
+    return args
+
+
+def parse_events(logfile):
+    """
+    # --------------------------------------------------------------------------
+    # parse the ExtData debug output of a case log
+    #
+    # Inputs:
+    #     logfile: case log (plain or .gz)
+    # Output:
+    #      events: list of OrderedDicts with keys time (model time of the
+    #              last AGCM Date line, None before the first step), action,
+    #              var, side, file and index (None where the message does not
+    #              say). A 1G file line takes the var and side of the bracket
+    #              update before it
+    # --------------------------------------------------------------------------
+    """
+
+    events = []
+    now = None
+    last_update = {}
+    fin = utils.open_log(logfile)
+    for line in fin:
+        for action, pattern in EVENT_PATTERNS:
+            m = pattern.search(line)
+            if not m: continue
+            found = dict([(key, val) for key, val in m.groupdict().items() if val is not None])
+            if action == 'step':
+                now = '%s %s' % (found['date'], found['time'])
+            if action == 'read' and 'var' not in found:
+                found['var'] = last_update.get('var')
+                found['side'] = last_update.get('side')
+            event = OrderedDict([('time', now), ('action', action),
+                                 ('var', found.get('var')), ('side', found.get('side')),
+                                 ('file', found.get('file')),
+                                 ('index', int(found['index']) if 'index' in found else None)])
+            if action == 'update': last_update = event
+            events.append(event)
+            break
+    fin.close()
+    return events
+
+
+def write_events(events, fout=None, as_json=False):
+    """
+    # --------------------------------------------------------------------------
+    # print events one per line: time, action, side, var, file[index] (or as
+    # json objects)
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+    for event in events:
+        if as_json:
+            fout.write(json.dumps(event) + '\n')
+            continue
+        if event['action'] == 'step': continue
+        fout.write('%-20s %-8s %1s %-16s %s%s\n' % (event['time'] or 'init', event['action'],
+                                                     event['side'] or '-', event['var'] or '-',
+                                                     event['file'] or '-',
+                                                     '' if event['index'] is None else '[%d]' % event['index']))
+
+
+def summarize_io(events):
+    """
+    # --------------------------------------------------------------------------
+    # I/O counts of a case from its events
+    #
+    # Output:
+    #     OrderedDict with
+    #                steps: model time steps
+    #              updates: bracket updates
+    #                reads: bracket reads
+    #                opens: file opens (the reads if the log has no open
+    #                       messages: ExtData 1G opens the file for each read)
+    #              rereads: reads of a (var, file, index) read before
+    #     opens_per_update: opens/updates
+    #             prefetch: prefetch messages
+    #     every_step_files: files read in at least EVERY_STEP of the steps
+    # --------------------------------------------------------------------------
+    """
+
+    steps = set()
+    nupdate = 0; nread = 0; nopen = 0; nreread = 0; nprefetch = 0
+    seen = set()
+    file_steps = {}
+    for event in events:
+        action = event['action']
+        if action == 'step':
+            steps.add(event['time'])
+        elif action == 'update':
+            nupdate += 1
+        elif action == 'open':
+            nopen += 1
+        elif action == 'prefetch':
+            nprefetch += 1
+        elif action == 'read':
+            nread += 1
+            key = (event['var'], event['file'], event['index'])
+            if key in seen: nreread += 1
+            seen.add(key)
+            if event['file'] and event['time']:
+                file_steps.setdefault(event['file'], set()).add(event['time'])
+    if not nopen: nopen = nread
+    nsteps = len(steps)
+
+    summary = OrderedDict()
+    summary['steps'] = nsteps
+    summary['updates'] = nupdate
+    summary['reads'] = nread
+    summary['opens'] = nopen
+    summary['rereads'] = nreread
+    summary['opens_per_update'] = float(nopen)/nupdate if nupdate else float(nopen)
+    summary['prefetch'] = nprefetch
+    summary['every_step_files'] = sorted([f for f in file_steps
+                                          if nsteps > 2 and len(file_steps[f]) >= EVERY_STEP*nsteps])
+    return summary
+
+
+def compare_io(base, cur, tolerance=0.1):
+    """
+    # --------------------------------------------------------------------------
+    # compare two summaries (see summarize_io) and return the list of I/O
+    # regressions as strings: files now read every step, more rereads, more
+    # opens per update (by more than tolerance, relative) and lost prefetch
+    # --------------------------------------------------------------------------
+    """
+
+    flags = []
+    for f in cur['every_step_files']:
+        if f not in base['every_step_files']:
+            flags.append('%s is read every step' % f)
+    if cur['rereads'] > base['rereads']:
+        flags.append('rereads %d -> %d' % (base['rereads'], cur['rereads']))
+    if cur['opens_per_update'] > base['opens_per_update']*(1.0+tolerance):
+        flags.append('opens per update %.2f -> %.2f' % (base['opens_per_update'], cur['opens_per_update']))
+    if base['prefetch'] and not cur['prefetch']:
+        flags.append('prefetch lost (%d -> 0 prefetch messages)' % base['prefetch'])
+    return flags
+
+
+def check_log(case, logfile, baseline, update=False):
+    """
+    # --------------------------------------------------------------------------
+    # summarize the I/O of a case log, compare it with the baseline entry of
+    # the case and, if update, store it in baseline (the dict is edited in
+    # place; write it with benchmark.write_baseline)
+    #
+    # Output:
+    #     OrderedDict with summary, flags (see compare_io) and has_baseline
+    # --------------------------------------------------------------------------
+    """
+
+    summary = summarize_io(parse_events(logfile))
+    result = OrderedDict([('summary', summary), ('flags', []), ('has_baseline', case in baseline)])
+    if case in baseline:
+        result['flags'] = compare_io(baseline[case]['io'], summary)
+    if update:
+        baseline[case] = OrderedDict([('date', datetime.now().strftime('%Y/%m/%d, %H:%M:%S')),
+                                      ('io', summary)])
+    return result
+
+
+def find_log(log_dir, case):
+
+    for name in [case+'.log.gz', case+'.log']:
+        if os.path.isfile(os.path.join(log_dir, name)):
+            return os.path.join(log_dir, name)
+    raise Exception('no log of case [%s] in [%s]' % (case, log_dir))
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    logs = list(comm_opts['logs'])
+    cases = benchmark.read_case_list(comm_opts['cases']) if comm_opts['cases'] else []
+
+    if comm_opts['action'] == 'events':
+        for logfile in logs + [find_log(comm_opts['log_dir'], case) for case in cases]:
+            if not comm_opts['json']: utils.writemsg('# %s\n' % logfile)
+            write_events(parse_events(logfile), as_json=comm_opts['json'])
+        sys.exit(0)
+
+    baseline = benchmark.read_baseline(comm_opts['baseline'])
+    nflagged = 0
+    for case in cases:
+        result = check_log(case, find_log(comm_opts['log_dir'], case), baseline, comm_opts['update_baseline'])
+        if not result['has_baseline']:
+            utils.writemsg(' %s: no baseline entry\n' % case)
+        for flag in result['flags']:
+            utils.writemsg(' %s: %s\n' % (case, flag))
+        if result['flags']: nflagged += 1
+    if comm_opts['update_baseline']:
+        benchmark.write_baseline(comm_opts['baseline'], baseline)
+    sys.exit(1 if nflagged else 0)
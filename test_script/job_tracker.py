@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Track many scheduler jobs at once. All outstanding job ids are queried in a
+# single sacct (SLURM), qstat (PBS) or local_sched (LOCAL) call per poll, the
+# interval between polls grows from MIN_INTERVAL to MAX_INTERVAL, and a
+# callback is run for each job when it leaves the queue.
+#
+#      query_states
+#      JobTracker
+# ------------------------------------------------------------------------------
+"""
+
+import sys
+import time
+import subprocess as sp
+from collections import OrderedDict
+
+import utils
+import local_sched
+
+# poll interval (s): starts at MIN_INTERVAL, grows by BACKOFF per poll
+MIN_INTERVAL = 5
+MAX_INTERVAL = 60
+BACKOFF = 1.5
+# local job records are cheap to read
+LOCAL_MIN_INTERVAL = 0.5
+
+# slurm states after which a job no longer runs
+SLURM_DONE_STATES = ['COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY',
+                     'NODE_FAIL', 'PREEMPTED', 'BOOT_FAIL', 'DEADLINE']
+
+# states reported as failures by job_completed/submit_job
+FAILED_STATES = ['FAILED', 'CANCELLED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL', 'BOOT_FAIL']
+
+
+def _base_id(JOB_ID):
+
+    # 1234_5 (slurm array task) -> 1234, 1234.pbspl1.nas.nasa.gov -> 1234
+    return JOB_ID.split('_')[0].split('.')[0]
+
+
+def _sacct_states(JOB_IDS):
+
+    cmd = ['sacct', '-n', '-X', '-P', '--format', 'JobID,State', '-j', ','.join(JOB_IDS)]
+    run = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    output = run.communicate()
+    if run.returncode != 0:
+        print('0:'); print(output[0]); print('1:'); print(output[1])
+        raise Exception('run (%s) failed' % ' '.join(cmd))
+
+    # an array job has one row per task: it is done once every task is
+    rows = OrderedDict()
+    for line in output[0].decode().splitlines():
+        if '|' not in line: continue
+        jobid, state = line.split('|')[0:2]
+        rows.setdefault(_base_id(jobid), []).append(state.split()[0] if state.strip() else 'PENDING')
+
+    states = OrderedDict()
+    for JOB_ID in JOB_IDS:
+        task_states = rows.get(_base_id(JOB_ID))
+        if not task_states or not all([s in SLURM_DONE_STATES for s in task_states]):
+            states[JOB_ID] = None
+        else:
+            failed = [s for s in task_states if s != 'COMPLETED']
+            states[JOB_ID] = failed[0] if failed else 'COMPLETED'
+    return states
+
+
+def _qstat_states(JOB_IDS):
+
+    cmd = ['qstat', '-x', '-f'] + list(JOB_IDS)
+    run = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    output = run.communicate()
+    # qstat exits non-zero if any one id is unknown, the others are still listed
+    if run.returncode != 0 and not output[0].strip():
+        print('0:'); print(output[0]); print('1:'); print(output[1])
+        raise Exception('run (%s) failed' % ' '.join(cmd))
+
+    found = {}
+    exit_status = {}
+    jobid = None
+    for line in output[0].decode().splitlines():
+        if line.startswith('Job Id:'):
+            jobid = _base_id(line.split(':', 1)[1].strip())
+        elif '=' in line and jobid:
+            key, val = [part.strip() for part in line.split('=', 1)]
+            if key == 'job_state': found[jobid] = val
+            if key == 'Exit_status': exit_status[jobid] = val
+
+    # a finished job without Exit_status was deleted before it ran; an array
+    # job exits 0 only if all its subjobs did
+    states = OrderedDict()
+    for JOB_ID in JOB_IDS:
+        jobid = _base_id(JOB_ID)
+        if found.get(jobid) != 'F':
+            states[JOB_ID] = None
+        elif jobid not in exit_status:
+            states[JOB_ID] = 'CANCELLED'
+        else:
+            states[JOB_ID] = 'COMPLETED' if exit_status[jobid] == '0' else 'FAILED'
+    return states
+
+
+def query_states(JOB_IDS, SCHED=None):
+    """
+    # --------------------------------------------------------------------------
+    # state of each of JOB_IDS with one scheduler call
+    #
+    # Inputs:
+    #     JOB_IDS: list of job ids (slurm array jobs/PBS 1234[] included)
+    #       SCHED: SLURM, PBS or LOCAL, if None see get_scheduler
+    # Output:
+    #     OrderedDict with job id as key and, as val, None while the job is
+    #     queued or running, else its final state (COMPLETED, FAILED, ...).
+    #     Finished PBS jobs are COMPLETED or FAILED by their Exit_status
+    # --------------------------------------------------------------------------
+    """
+
+    if not JOB_IDS: return OrderedDict()
+    if not SCHED: SCHED = utils.get_scheduler()
+
+    if SCHED == 'SLURM':
+        return _sacct_states(JOB_IDS)
+    elif SCHED == 'PBS':
+        return _qstat_states(JOB_IDS)
+    elif SCHED == 'LOCAL':
+        return local_sched.query_states(JOB_IDS)
+    else:
+        raise Exception('scheduler [%s] not recognized' % SCHED)
+
+
+class JobTracker(object):
+    """
+    # --------------------------------------------------------------------------
+    # tracker = JobTracker()
+    # tracker.add(JOB_ID, callback)   # callback(JOB_ID, state) when done
+    # states = tracker.wait()         # blocks until all jobs are done
+    # --------------------------------------------------------------------------
+    """
+
+    def __init__(self, SCHED=None, min_interval=None, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, fout=None):
+
+        self.SCHED = SCHED or utils.get_scheduler()
+        self.min_interval = min_interval or \
+            (LOCAL_MIN_INTERVAL if self.SCHED == 'LOCAL' else MIN_INTERVAL)
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.fout = fout or sys.stdout
+        self.pending = OrderedDict()
+        self.states = OrderedDict()
+
+    def add(self, JOB_ID, callback=None):
+
+        self.pending[JOB_ID] = callback
+        self.states[JOB_ID] = None
+
+    def poll(self):
+        """
+        # ----------------------------------------------------------------------
+        # query all pending jobs once, run the callbacks of those that are done
+        # and return their ids
+        # ----------------------------------------------------------------------
+        """
+
+        done = []
+        for JOB_ID, state in query_states(list(self.pending.keys()), self.SCHED).items():
+            if state is None: continue
+            callback = self.pending.pop(JOB_ID)
+            self.states[JOB_ID] = state
+            done.append(JOB_ID)
+            if callback: callback(JOB_ID, state)
+        return done
+
+    def wait(self, JOB_IDS=None, timeout=None):
+        """
+        # ----------------------------------------------------------------------
+        # poll until JOB_IDS (default: all jobs added) are done, or until
+        # timeout (s) has passed. Returns the states of JOB_IDS, None for the
+        # jobs that are still running
+        # ----------------------------------------------------------------------
+        """
+
+        if JOB_IDS is None: JOB_IDS = list(self.states.keys())
+        sTart = time.time()
+        interval = self.min_interval
+        while True:
+            if any([JOB_ID in self.pending for JOB_ID in JOB_IDS]):
+                self.poll()
+            if not any([JOB_ID in self.pending for JOB_ID in JOB_IDS]):
+                break
+            if timeout is not None and time.time() - sTart + interval > timeout:
+                break
+            time.sleep(interval)
+            interval = min(interval*self.backoff, self.max_interval)
+        return OrderedDict([(JOB_ID, self.states.get(JOB_ID)) for JOB_ID in JOB_IDS])
+
+
+def wait_for_job(JOB_ID, SCHED=None, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # block until JOB_ID is done, raise if it failed or was cancelled
+    # --------------------------------------------------------------------------
+    """
+
+    tracker = JobTracker(SCHED, fout=fout)
+    tracker.add(JOB_ID)
+    state = tracker.wait()[JOB_ID]
+    if state in FAILED_STATES:
+        raise Exception('Job %s %s' % (JOB_ID, state))
+    return state
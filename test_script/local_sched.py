@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Local stand-in for the batch scheduler: job scripts run on this node, at
+# most SLOTS cores at a time, and states are answered from the job records
+# without any queue latency. Used when get_scheduler returns LOCAL (any host
+# but DISCOVER/PLEIADES, or EXTDATA_SCHEDULER=LOCAL).
+#
+# The same backend can also pose as slurm or PBS: the scripts in fake_sched/
+# (sbatch, sacct, qsub, qstat) call this module with the command line of the
+# real tool and print what it would. Putting fake_sched/ first on PATH with
+# EXTDATA_SCHEDULER=SLURM (or PBS) runs the scheduler code paths of the
+# harness on a plain Linux box.
+#
+# Job records are json files in $EXTDATA_LOCAL_SCHED_DIR (default
+# ~/.cache/extdata_local_sched), one per job, written by the detached runner
+# process of the job; <id>.pid holds the pid of that runner, and a job whose
+# runner is gone while tasks are still pending or running is marked FAILED.
+# Tasks run as threads of the runner on this node, so a task must never kill
+# processes it did not start (see ExtDataCase.execute). $EXTDATA_LOCAL_SLOTS
+# sets the slot limit (default: the number of cores).
+#
+#      submit
+#      query_states
+# ------------------------------------------------------------------------------
+"""
+
+import sys
+import os
+import re
+import errno
+import json
+import time
+import fcntl
+import tempfile
+import threading
+import multiprocessing
+import subprocess as sp
+from collections import OrderedDict
+
+# states of the job records (slurm names)
+DONE_STATES = ['COMPLETED', 'FAILED', 'CANCELLED']
+
+
+def state_dir():
+
+    sdir = os.environ.get('EXTDATA_LOCAL_SCHED_DIR') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'extdata_local_sched')
+    if not os.path.isdir(os.path.join(sdir, 'slots')):
+        try:
+            os.makedirs(os.path.join(sdir, 'slots'))
+        except OSError:
+            if not os.path.isdir(os.path.join(sdir, 'slots')): raise
+    return sdir
+
+
+def get_slots():
+
+    return max(1, int(os.environ.get('EXTDATA_LOCAL_SLOTS') or multiprocessing.cpu_count()))
+
+
+def _record_file(JOB_ID):
+
+    return os.path.join(state_dir(), '%s.json' % JOB_ID)
+
+
+def _read_record(JOB_ID):
+
+    fname = _record_file(JOB_ID)
+    if not os.path.isfile(fname): return None
+    fin = open(fname, 'r'); record = json.load(fin); fin.close()
+    return record
+
+
+def _runner_alive(JOB_ID):
+
+    # a runner that has not written its pid file yet counts as alive
+    fname = os.path.join(state_dir(), '%s.pid' % JOB_ID)
+    if not os.path.isfile(fname): return True
+    fin = open(fname, 'r'); pid, start = (fin.read().split() + [None])[:2]; fin.close()
+    stat = _proc_stat(int(pid))
+    if stat is None:
+        try:
+            os.kill(int(pid), 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return not os.path.isdir('/proc')
+    # zombie (not reaped by the submitting process yet) or a reused pid
+    return stat[0] != 'Z' and (start is None or stat[1] == start)
+
+
+def _proc_stat(pid):
+
+    # [state, start time] of pid from /proc, None if not available
+    try:
+        fin = open('/proc/%d/stat' % pid, 'r'); fields = fin.read().rsplit(')', 1)[1].split(); fin.close()
+    except (IOError, OSError, IndexError):
+        return None
+    return [fields[0], fields[19]]
+
+
+def _checked_record(JOB_ID):
+
+    # the record of JOB_ID, with the unfinished tasks of a dead runner FAILED
+    unfinished = lambda record: not all([s in DONE_STATES for s in record['tasks'].values()])
+    record = _read_record(JOB_ID)
+    if record and unfinished(record) and not _runner_alive(record['id']):
+        # the runner may have written its last record just before it exited
+        record = _read_record(JOB_ID)
+        if unfinished(record):
+            for task, state in record['tasks'].items():
+                if state not in DONE_STATES: record['tasks'][task] = 'FAILED'
+            _write_record(record)
+    return record
+
+
+def _write_record(record):
+
+    # rename, so readers never see a half written record; the runner and the
+    # processes that mark a dead runner's tasks FAILED both write records
+    fname = _record_file(record['id'])
+    fd, tmp_file = tempfile.mkstemp(dir=state_dir(), prefix='%s.' % record['id'], suffix='.tmp')
+    fout = os.fdopen(fd, 'w'); json.dump(record, fout); fout.close()
+    os.rename(tmp_file, fname)
+
+
+def _next_id():
+
+    flock = open(os.path.join(state_dir(), 'lock'), 'a')
+    fcntl.flock(flock, fcntl.LOCK_EX)
+    try:
+        counter = os.path.join(state_dir(), 'next_id')
+        JOB_ID = int(open(counter).read()) if os.path.isfile(counter) else 1
+        fout = open(counter, 'w'); fout.write('%d\n' % (JOB_ID+1)); fout.close()
+    finally:
+        fcntl.flock(flock, fcntl.LOCK_UN)
+        flock.close()
+    return str(JOB_ID)
+
+
+def parse_job_script(job_script):
+    """
+    # --------------------------------------------------------------------------
+    # return [array, ntasks, output, pbs_name] from the #SBATCH or #PBS lines
+    # of job_script. array is the number of array tasks (None for a plain
+    # job), pbs_name the PBS job name (-N, default the script name) if the
+    # script has #PBS lines and no #SBATCH ones, else None
+    # --------------------------------------------------------------------------
+    """
+
+    array = None; ntasks = 1; output = None
+    sbatch = False; pbs_name = None
+    for line in open(job_script, 'r'):
+        if line.startswith('#SBATCH'):
+            sbatch = True
+            opt = line.split(None, 1)[1].strip()
+            if opt.startswith('--array='): array = int(opt.split('-')[-1])
+            elif opt.startswith('--ntasks='): ntasks = int(opt.split('=')[1])
+            elif opt.startswith('--output='): output = opt.split('=', 1)[1]
+        elif line.startswith('#PBS'):
+            opt = line.split(None, 1)[1].strip()
+            if not pbs_name: pbs_name = os.path.basename(job_script)
+            if opt.startswith('-J '): array = int(opt.split('-')[-1])
+            elif opt.startswith('-o '): output = opt.split(None, 1)[1]
+            elif opt.startswith('-N '): pbs_name = opt.split(None, 1)[1]
+            elif opt.startswith('-l select='):
+                match = re.search(r'ncpus=(\d+)', opt)
+                if match: ntasks = int(match.group(1))
+    return [array, ntasks, output, None if sbatch else pbs_name]
+
+
+def submit(job_script, depend=None):
+    """
+    # --------------------------------------------------------------------------
+    # queue job_script (run from its dir by a detached runner) and return the
+    # job id
+    #
+    # Inputs:
+    #     job_script: job script with #SBATCH or #PBS lines (array, ntasks,
+    #                 output are honored, everything else is ignored)
+    #         depend: (afterok|afterany, job id) or None
+    # --------------------------------------------------------------------------
+    """
+
+    job_script = os.path.abspath(job_script)
+    array, ntasks, output, pbs_name = parse_job_script(job_script)
+    JOB_ID = _next_id()
+    tasks = [str(i) for i in range(1, array+1)] if array else ['0']
+    record = {'id': JOB_ID, 'script': job_script, 'cwd': os.path.dirname(job_script),
+              'array': array, 'ntasks': ntasks, 'output': output, 'pbs_name': pbs_name,
+              'depend': list(depend) if depend else None,
+              'tasks': OrderedDict([(task, 'PENDING') for task in tasks]),
+              'rc': {}}
+    _write_record(record)
+
+    devnull = open(os.devnull, 'w')
+    runner = sp.Popen([sys.executable, os.path.abspath(__file__), 'run', JOB_ID],
+                      stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                      preexec_fn=os.setsid)
+    devnull.close()
+    stat = _proc_stat(runner.pid)
+    fname = os.path.join(state_dir(), '%s.pid' % JOB_ID)
+    fout = open(fname + '.tmp', 'w'); fout.write('%d %s\n' % (runner.pid, stat[1] if stat else '')); fout.close()
+    os.rename(fname + '.tmp', fname)
+    return JOB_ID
+
+
+def query_states(JOB_IDS):
+    """
+    # --------------------------------------------------------------------------
+    # same as job_tracker.query_states: None while a job (any of its array
+    # tasks) is pending or running, else COMPLETED or the failed state
+    # (FAILED for the unfinished tasks of a runner that died)
+    # --------------------------------------------------------------------------
+    """
+
+    states = OrderedDict()
+    for JOB_ID in JOB_IDS:
+        record = _checked_record(JOB_ID.split('.')[0].split('[')[0])
+        task_states = list(record['tasks'].values()) if record else []
+        if not task_states or not all([s in DONE_STATES for s in task_states]):
+            states[JOB_ID] = None
+        else:
+            failed = [s for s in task_states if s != 'COMPLETED']
+            states[JOB_ID] = failed[0] if failed else 'COMPLETED'
+    return states
+
+
+# ------------------------------------------------------------------------------
+# runner (python local_sched.py run JOB_ID)
+# ------------------------------------------------------------------------------
+
+def _acquire_slots(nslots):
+
+    # one lock file per core, a task holds nslots of them while it runs
+    nslots = min(nslots, get_slots())
+    while True:
+        held = []
+        for i in range(get_slots()):
+            fslot = open(os.path.join(state_dir(), 'slots', '%d' % i), 'a')
+            try:
+                fcntl.flock(fslot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                fslot.close()
+                continue
+            held.append(fslot)
+            if len(held) == nslots: return held
+        for fslot in held: fslot.close()
+        time.sleep(0.5)
+
+
+def _output_file(record, task):
+
+    # default names of slurm (slurm-<id>.out) or PBS (<name>.o<id>)
+    output = record['output']
+    pbs_name = record.get('pbs_name')
+    if pbs_name:
+        default = pbs_name + '.o%j' + ('.%a' if record['array'] else '')
+    else:
+        default = 'slurm-%A_%a.out' if record['array'] else 'slurm-%j.out'
+    if not output:
+        output = default
+    elif output.endswith('/'):
+        output = os.path.join(output, default if pbs_name else 'local.o%j' + ('.%a' if record['array'] else ''))
+    output = output.replace('%A', record['id']).replace('%j', record['id']).replace('%a', task)
+    return os.path.join(record['cwd'], output)
+
+
+def _run_task(record, task, lock):
+
+    slots = _acquire_slots(record['ntasks'])
+    try:
+        with lock:
+            record['tasks'][task] = 'RUNNING'; _write_record(record)
+        env = dict(os.environ)
+        env['SLURM_JOB_ID'] = env['PBS_JOBID'] = record['id']
+        if record['array']:
+            env['SLURM_ARRAY_TASK_ID'] = env['PBS_ARRAY_INDEX'] = task
+        fout = open(_output_file(record, task), 'w')
+        rc = sp.call(['bash', record['script']], stdout=fout, stderr=sp.STDOUT, cwd=record['cwd'], env=env)
+        fout.close()
+    except Exception:
+        rc = 1
+    finally:
+        for fslot in slots: fslot.close()
+    with lock:
+        record['tasks'][task] = 'COMPLETED' if rc == 0 else 'FAILED'
+        record.setdefault('rc', {})[task] = rc
+        _write_record(record)
+
+
+def run_job(JOB_ID):
+
+    record = _read_record(JOB_ID)
+    record['tasks'] = OrderedDict(sorted(record['tasks'].items(), key=lambda t: int(t[0])))
+
+    if record['depend']:
+        kind, dep_id = record['depend']
+        while True:
+            state = query_states([dep_id])[dep_id]
+            if state is not None: break
+            time.sleep(1)
+        if kind == 'afterok' and state != 'COMPLETED':
+            for task in record['tasks']: record['tasks'][task] = 'CANCELLED'
+            _write_record(record)
+            return
+
+    lock = threading.Lock()
+    threads = [threading.Thread(target=_run_task, args=(record, task, lock)) for task in record['tasks']]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+
+# ------------------------------------------------------------------------------
+# command lines of the real tools (see fake_sched/)
+# ------------------------------------------------------------------------------
+
+def _sbatch(args):
+
+    depend = None
+    for arg in args[:-1]:
+        if arg.startswith('--dependency='):
+            depend = tuple(arg.split('=', 1)[1].split(':')[0:2])
+    print('Submitted batch job %s' % submit(args[-1], depend))
+
+
+def _qsub(args):
+
+    depend = None
+    for i, arg in enumerate(args[:-1]):
+        if arg == '-W' and args[i+1].startswith('depend='):
+            depend = tuple(args[i+1].split('=', 1)[1].split(':')[0:2])
+    JOB_ID = submit(args[-1], depend)
+    print('%s%s.local' % (JOB_ID, '[]' if _read_record(JOB_ID)['array'] else ''))
+
+
+def _sacct(args):
+
+    # prints JobID|State rows whatever --format asks for
+    JOB_IDS = args[args.index('-j')+1].split(',')
+    for JOB_ID in JOB_IDS:
+        record = _checked_record(JOB_ID.split('.')[0].split('_')[0])
+        if not record: continue
+        for task, state in sorted(record['tasks'].items(), key=lambda t: int(t[0])):
+            print('%s|%s' % (record['id'] + ('_' + task if record['array'] else ''), state))
+
+
+def _qstat(args):
+
+    pbs_state = {'PENDING': 'Q', 'RUNNING': 'R'}
+    rc = 0
+    for JOB_ID in [arg for arg in args if not arg.startswith('-')]:
+        record = _checked_record(JOB_ID.split('.')[0].split('[')[0])
+        if not record:
+            sys.stderr.write('qstat: Unknown Job Id %s\n' % JOB_ID); rc = 153; continue
+        states = list(record['tasks'].values())
+        running = [pbs_state[s] for s in states if s in pbs_state]
+        print('Job Id: %s%s.local' % (record['id'], '[]' if record['array'] else ''))
+        print('    job_state = %s' % (('B' if record['array'] else running[0]) if running else 'F'))
+        # no Exit_status for jobs that never ran (dependency not met); an
+        # array job exits 0 if all its subjobs did, else 1 (2 if some never
+        # ran); a task failed by a dead runner has no return code, 1 is used
+        if not running and not all([s == 'CANCELLED' for s in states]):
+            if record['array']:
+                exit_status = 2 if 'CANCELLED' in states else (0 if states == ['COMPLETED']*len(states) else 1)
+            else:
+                task = list(record['tasks'].keys())[0]
+                exit_status = record.get('rc', {}).get(task, 0 if states[0] == 'COMPLETED' else 1)
+            print('    Exit_status = %d' % exit_status)
+        print('')
+    sys.exit(rc)
+
+
+if __name__ == "__main__":
+
+    commands = {'run': lambda args: run_job(args[0]),
+                'sbatch': _sbatch, 'qsub': _qsub, 'sacct': _sacct, 'qstat': _qstat}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        sys.exit('usage: local_sched.py {%s} args' % ','.join(sorted(commands)))
+    commands[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Bisect a range of MAPL commits for an ExtData slowdown: build
+# ExtDataDriver.x at the good endpoint and at commits chosen by binary
+# search, benchmark a case with each build and report the first commit whose
+# timer exceeds the good endpoint by more than the threshold.
+#
+# Every commit is checked out and built in its own directory under --workdir
+# and measured results are kept in bisect.json there, so a rerun (e.g. with
+# another threshold) neither rebuilds nor remeasures a commit. A commit that
+# does not build is skipped (as git bisect skip does) and a neighbour is
+# measured instead; if skipped commits are left at the end, all commits that
+# could be the first slow one are reported.
+#
+#      git_rev_list
+#      build_commit
+#      measure_commit
+#      bisect
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import subprocess as sp
+import json
+from collections import OrderedDict
+
+import utils
+import benchmark
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Bisect MAPL commits for an ExtData slowdown')
+
+    p.add_argument("--repo",  dest="repo",required=True,help='MAPL git repository (url or path)')
+    p.add_argument("--good",  dest="good",required=True,help='last commit known to be fast')
+    p.add_argument("--bad",  dest="bad",required=True,help='first commit known to be slow')
+    p.add_argument("--workdir",  dest="work_dir",default="bisect_work",help='where commits are built and results kept')
+    p.add_argument("--casedir",  dest="case_dir",required=True,help='where cases are located')
+    p.add_argument("--case",  dest="case",required=True,help='case to benchmark')
+    p.add_argument("--metric",  dest="metric",default="extdata_run",help='metric to bisect on (see benchmark.get_run_metrics)')
+    p.add_argument("--threshold",  dest="threshold",type=float,default=0.10,help='relative increase over good that counts as slow')
+    p.add_argument("--nrep",  dest="nrep",type=int,default=3,help='measured runs per commit')
+    p.add_argument("--warmup",  dest="warmup",type=int,default=1,help='unmeasured runs per commit')
+    p.add_argument("--debug",  dest="debug",action="store_true",help='build with debugging')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if not os.path.isdir(os.path.join(args['case_dir'], args['case'])):
+        raise Exception('case [%s] does not exist in [%s]' % (args['case'], args['case_dir']))
+    args['work_dir'] = os.path.abspath(args['work_dir'])
+    args['case_dir'] = os.path.abspath(args['case_dir'])
+
+    return args
+
+
+def _git(args, cwd):
+
+    return sp.check_output(['git'] + args, cwd=cwd).decode().strip()
+
+
+def git_rev_list(src_dir, good, bad):
+    """
+    # --------------------------------------------------------------------------
+    # return the full hashes of the first-parent commits after good up to and
+    # including bad, oldest first
+    # --------------------------------------------------------------------------
+    """
+
+    commits = _git(['rev-list', '--first-parent', '--reverse', '%s..%s' % (good, bad)], src_dir).split()
+    if not commits:
+        raise Exception('no commits between [%s] and [%s]' % (good, bad))
+    return commits
+
+
+def build_commit(mirror, commit, work_dir, debug=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # check out commit (a local clone of mirror) in work_dir/<commit> and build
+    # it, unless that build already exists. Return the directory with
+    # ExtDataDriver.x and g5_modules (as ExtDataCase expects), None if the
+    # commit does not build
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    src_dir = os.path.join(work_dir, commit)
+    bin_dir = os.path.join(src_dir, 'install-%s' % ('Debug' if debug else 'Release'), 'bin')
+    with open(os.devnull, 'w') as devnull:
+        built = utils.check_bld(src_dir, 'MAPL', DEBUG=debug, fout=devnull)
+    if built:
+        utils.writemsg(' Reusing build of %s\n' % commit[:12], fout)
+        return bin_dir
+
+    if not os.path.isdir(src_dir):
+        utils.git_clone(mirror, src_dir, fout=fout)
+        _git(['checkout', '-q', commit], src_dir)
+    try:
+        utils.build_cmake_github(src_dir, DEBUG=debug, fout=fout)
+        if not utils.check_bld(src_dir, 'MAPL', DEBUG=debug, fout=fout):
+            raise Exception('build has no ExtDataDriver.x')
+    except Exception as e:
+        utils.writemsg(' Build of %s failed (%s), skipping it\n' % (commit[:12], e), fout)
+        return None
+    if not os.path.exists(os.path.join(bin_dir, 'g5_modules')):
+        utils.create_link(os.path.join(src_dir, '@env', 'g5_modules'), bin_dir, 'g5_modules')
+    return bin_dir
+
+
+def measure_commit(commit, bin_dir, comm_opts, results, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # benchmark the case with the build of commit and return the median of
+    # the metric. Results are stored in (and reused from) results
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    key = '%s %s %s' % (comm_opts['case'], comm_opts['metric'], commit)
+    if key in results:
+        return results[key]
+
+    opts = dict(comm_opts)
+    opts['build_dir'] = bin_dir
+    opts['scratch_dir'] = os.path.join(comm_opts['work_dir'], 'scratch')
+    utils.writemsg(' Benchmarking %s...' % commit[:12], fout)
+    samples = benchmark.run_samples(comm_opts['case'], opts, comm_opts['nrep'], comm_opts['warmup'],
+                                    comm_opts['work_dir'], tag=commit[:12])
+    summary = benchmark.summarize(samples)
+    if comm_opts['metric'] not in summary:
+        raise Exception('metric [%s] not found in the logs of [%s]' % (comm_opts['metric'], commit))
+    results[key] = summary[comm_opts['metric']]['median']
+    utils.writemsg('done. %s = %.4f\n' % (comm_opts['metric'], results[key]), fout)
+    return results[key]
+
+
+def bisect(comm_opts, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # binary search for the first commit after --good whose metric exceeds
+    # that of --good by more than --threshold
+    #
+    # Output:
+    #     a list of three elements
+    #        commit: the first slow commit
+    #       history: list of (commit, value, slow) in the order measured,
+    #                value and slow are None for commits that do not build
+    #    candidates: the commits that can be the first slow one, more than
+    #                [commit] if commits before it were skipped
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    work_dir = comm_opts['work_dir']
+    utils.mkdir_p(work_dir)
+    mirror = os.path.join(work_dir, 'mirror')
+    if not os.path.isdir(mirror):
+        utils.git_clone(comm_opts['repo'], mirror, fout=fout)
+    else:
+        _git(['fetch', '-q', 'origin'], mirror)
+    good = _git(['rev-parse', comm_opts['good']], mirror)
+    commits = git_rev_list(mirror, good, comm_opts['bad'])
+
+    results_file = os.path.join(work_dir, 'bisect.json')
+    results = json.load(open(results_file)) if os.path.isfile(results_file) else {}
+
+    def measure(commit):
+        bin_dir = build_commit(mirror, commit, work_dir, comm_opts['debug'], fout)
+        if not bin_dir: return None
+        value = measure_commit(commit, bin_dir, comm_opts, results, fout)
+        fres = open(results_file, 'w'); json.dump(results, fres, indent=2, sort_keys=True); fres.close()
+        return value
+
+    base = measure(good)
+    if base is None:
+        raise Exception('good commit [%s] does not build' % comm_opts['good'])
+    history = [(good, base, False)]
+
+    # True/False, None if the commit does not build
+    def is_slow(commit):
+        value = measure(commit)
+        slow = None if value is None else value > base*(1.0 + comm_opts['threshold'])
+        history.append((commit, value, slow))
+        return slow
+
+    # commits[lo] is fast (lo = -1 is good), commits[hi] is slow or, if the
+    # newest commits do not build, the last of them
+    lo, hi = -1, len(commits)-1
+    skipped = set()
+    newest = hi
+    slow = is_slow(commits[newest])
+    while slow is None:
+        skipped.add(newest)
+        newest -= 1
+        if newest < 0:
+            raise Exception('no commit after [%s] up to [%s] builds' % (comm_opts['good'], comm_opts['bad']))
+        slow = is_slow(commits[newest])
+    if slow:
+        hi = newest
+    elif newest == hi:
+        raise Exception('[%s] is not slower than [%s] by more than %.0f%%' %
+                        (comm_opts['bad'], comm_opts['good'], 100.0*comm_opts['threshold']))
+    else:
+        lo = newest
+    while True:
+        untested = [i for i in range(lo+1, hi) if i not in skipped]
+        if not untested: break
+        utils.writemsg(' %d commits left to bisect\n' % len(untested), fout)
+        # the commit closest to the middle, skipped commits shift it
+        mid = (lo + hi)//2
+        i = min(untested, key=lambda i: (abs(i - mid), i))
+        slow = is_slow(commits[i])
+        if slow is None:
+            skipped.add(i)
+        elif slow:
+            hi = i
+        else:
+            lo = i
+
+    return [commits[hi], history, commits[lo+1:hi+1]]
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    commit, history, candidates = bisect(comm_opts)
+
+    utils.writemsg('\n %-12s %14s %6s\n' % ('commit', comm_opts['metric'], 'slow'))
+    for sha, value, slow in history:
+        if value is None:
+            utils.writemsg(' %-12s %14s %6s\n' % (sha[:12], 'no build', 'skip'))
+            continue
+        utils.writemsg(' %-12s %14.4f %6s\n' % (sha[:12], value, 'yes' if slow else 'no'))
+    if len(candidates) == 1:
+        utils.writemsg('\n First slow commit: %s\n' % commit)
+    else:
+        utils.writemsg('\n Commits that do not build are left, the first slow commit is one of:\n')
+        for sha in candidates:
+            utils.writemsg('   %s\n' % sha)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Run cases as a pipeline instead of one after the other: a stager thread
+# copies the next case into its own scratch dir while the current case runs,
+# and finished cases are handed to a pool of workers for the log parsing,
+# output copy/comparison and scratch deletion. Only load_modules and execute
+# (mpirun) run in the calling thread, so the MPI ranks go from one case to
+# the next without waiting on the file system. With a SpaceBudget, a case is
+# only staged once its estimated output fits in the free scratch space.
+#
+#      run_pipelined
+# ------------------------------------------------------------------------------
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import utils
+import benchmark
+import disk_budget
+import case_log
+from run_case import ExtDataCase
+
+
+def _finish(case, this_case, success, log, logfile, save_log, postprocess, budget):
+
+    log.close()
+    result = OrderedDict([('status', 'passed' if success else 'failed'),
+                          ('phase_times', this_case.phase_times),
+                          ('log', os.path.abspath(logfile))])
+    # a failing step is recorded in the result, the rest of the case (and
+    # the scratch cleanup) still runs
+    try:
+        if success:
+            result['metrics'] = benchmark.get_run_metrics(this_case, logfile)
+        if this_case.output_dir and os.path.isdir(this_case.scratch_dir):
+            this_case.save_outputs(None)
+        if postprocess:
+            result['post'] = postprocess(case, this_case, success, logfile)
+    except Exception as e:
+        result['error'] = 'post-processing failed: %s' % e
+    if os.path.isdir(this_case.scratch_dir):
+        this_case.timed('cleanup', None)
+    if budget: budget.release(case)
+    if success and save_log is not True:
+        if save_log == 'summary':
+            result['summary'] = os.path.abspath(os.path.join(os.path.dirname(logfile), case+'.summary'))
+            case_log.write_summary(logfile, result['summary'], result)
+        case_log.remove_log(logfile)
+        result['log'] = None
+    return result
+
+
+def run_pipelined(cases, comm_opts, log_dir='.', save_log=False, lookahead=1, nworkers=2,
+                  postprocess=None, budget=None, compress_log=True, tail_lines=None, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # run cases with staging and post-processing overlapped with execution
+    #
+    # Inputs:
+    #          cases: case names, run in this order
+    #      comm_opts: options dict as passed to ExtDataCase; case i runs in
+    #                 <scratch_dir>/<case i>
+    #        log_dir: where the <case>.log files are written
+    #       save_log: keep the logs of passing cases (True), only a
+    #                 <case>.summary of them ('summary') or nothing (False)
+    #      lookahead: cases staged ahead of the running one
+    #       nworkers: post-processing workers
+    #    postprocess: callable(case, this_case, success, logfile) run by a
+    #                 worker before the scratch dir is deleted (e.g. an
+    #                 output comparison); its return value is kept as 'post'
+    #         budget: disk_budget.SpaceBudget of the scratch file system; a
+    #                 case waits until its estimated output fits, and is not
+    #                 run (status 'no_space') if it never fits
+    #   compress_log: write <case>.log.gz and <case>.log.tail (see
+    #                 case_log.CaseLog) instead of <case>.log
+    #     tail_lines: lines kept in <case>.log.tail
+    # Output:
+    #     OrderedDict with case as key and, as val, a dict with status,
+    #     phase_times, log (None if deleted), metrics (see get_run_metrics,
+    #     passing cases only), post and error (what failed, if a step of the
+    #     harness itself did)
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    scratch_root = os.path.abspath(comm_opts.get('scratch_dir') or 'ExtData_scratch')
+    staged = queue.Queue()
+    ahead = threading.Semaphore(lookahead)
+
+    def stager():
+        # every case is queued, with the error that kept it from being staged
+        # if any, and the end marker always follows
+        try:
+            for case in cases:
+                ahead.acquire()
+                this_case = None; log = None; logfile = None
+                try:
+                    opts = dict(comm_opts)
+                    opts['scratch_dir'] = os.path.join(scratch_root, case)
+                    if budget:
+                        nbytes = disk_budget.estimate_case_bytes(os.path.join(comm_opts['case_dir'], case))
+                        if not budget.reserve(case, nbytes, opts['scratch_dir']):
+                            staged.put((case, None, None, None, None, nbytes))
+                            continue
+                    this_case = ExtDataCase(case, opts)
+                    log = case_log.open_case_log(os.path.join(log_dir, case+'.log'), compress_log, tail_lines)
+                    logfile = log.name
+                    this_case.timed('stage', log)
+                    staged.put((case, this_case, log, logfile, None, None))
+                except Exception as e:
+                    if budget and log is None: budget.release(case)
+                    staged.put((case, this_case, log, logfile, e, None))
+        finally:
+            staged.put(None)
+
+    thread = threading.Thread(target=stager)
+    thread.daemon = True
+    thread.start()
+
+    pool = ThreadPool(nworkers)
+    finishing = []
+    while True:
+        item = staged.get()
+        if item is None: break
+        ahead.release()
+        case, this_case, log, logfile, error, nbytes = item
+        if nbytes is not None:
+            utils.writemsg(' %s needs %.1f MB of scratch, %.1f MB free: not run\n'
+                           % (case, nbytes/1.e6, budget.free_bytes()/1.e6), fout)
+            finishing.append((case, pool.apply_async(dict, (), {'status': 'no_space', 'bytes': nbytes})))
+            continue
+        if log is None:
+            utils.writemsg(' %s could not be set up: %s\n' % (case, error), fout)
+            finishing.append((case, pool.apply_async(dict, (), {'status': 'failed', 'error': str(error)})))
+            continue
+        if error:
+            log.write('staging %s failed: %s\n' % (case, error))
+            success = False
+        else:
+            utils.writemsg(' running %s\n' % case, fout)
+            try:
+                this_case.timed('load_modules', log)
+                success = this_case.timed('execute', log)
+            except Exception as e:
+                log.write('running %s failed: %s\n' % (case, e))
+                success = False
+        finishing.append((case, pool.apply_async(_finish, (case, this_case, success, log, logfile,
+                                                           save_log, postprocess, budget))))
+    pool.close()
+    pool.join()
+    thread.join()
+
+    results = OrderedDict()
+    for case, result in finishing:
+        try:
+            results[case] = result.get()
+        except Exception as e:
+            results[case] = {'status': 'failed', 'error': str(e)}
+    return results
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
-  
+
 import argparse, sys, os
 import subprocess as sp
 import glob
 import shutil
+import time
+import fnmatch
+import signal
 import utils
+import case_config
+import extdata_convert
+import trash
+from collections import OrderedDict
 
 class ExtDataCase():
     """
@@ -12,52 +19,117 @@ class ExtDataCase():
 
     def __init__(self, case_name, comm_line_args):
 
-        self.build_dir = comm_line_args['build_dir']
+        self.build_dir = os.path.abspath(comm_line_args['build_dir'])
         self.case_dir = comm_line_args['case_dir']
         self.case_name = case_name
         self.case_path = self.case_dir+"/"+self.case_name.rstrip()
+        self.scratch_dir = os.path.abspath(comm_line_args.get('scratch_dir') or "ExtData_scratch")
+        # {rc file pattern: {label: value}} applied to the staged rc files
+        self.rc_overrides = comm_line_args.get('rc_overrides') or {}
+        # overrides the rank count of nproc.rc
+        self.nproc = comm_line_args.get('nproc')
+        # if set, the netcdf files of the run are copied here before cleanup
+        self.output_dir = comm_line_args.get('output_dir')
+        self.phase_times = OrderedDict()
+        # environment of the driver, set by load_modules
+        self.env = None
 
-    def run(self,logfile):
-        
-        scrdir="ExtData_scratch"
-        orig_dir = os.getcwd()
+    def stage(self,logfile):
+
+        scrdir = self.scratch_dir
         if os.path.isdir(scrdir):
-           shutil.rmtree(scrdir)
-        os.mkdir(scrdir)
+           trash.discard(scrdir)
+        utils.mkdir_p(scrdir)
         rc_files = glob.glob(self.case_path+"/*.rc")
         for rc_file in rc_files:
             shutil.copy(rc_file,scrdir)
         yaml_files = glob.glob(self.case_path+"/*.yaml")
         for yaml_file in yaml_files:
             shutil.copy(yaml_file,scrdir)
-        os.chdir(scrdir)
+
+        # cases without an extdata.yaml get one converted from ExtData.rc
+        if not os.path.isfile(os.path.join(scrdir,'extdata.yaml')) and \
+           os.path.isfile(os.path.join(scrdir,'ExtData.rc')):
+           extdata_convert.convert_file(os.path.join(scrdir,'ExtData.rc'),os.path.join(scrdir,'extdata.yaml'),
+                                        extdata_convert.get_data_years(self.case_path))
+
+        for pattern in self.rc_overrides:
+            for rc_file in sorted(os.listdir(scrdir)):
+                if fnmatch.fnmatch(rc_file,pattern):
+                   case_config.set_rc_values(os.path.join(scrdir,rc_file),self.rc_overrides[pattern])
+        if self.nproc:
+           fproc = open(os.path.join(scrdir,'nproc.rc'),"w")
+           fproc.write("%s\n" % self.nproc)
+           fproc.close()
+
+    def load_modules(self,logfile):
 
         g5_mod_path = self.build_dir+"/g5_modules"
-        utils.source_g5_modules(g5_mod_path)
-        success = os.path.isfile('nproc.rc')
-        if success:
-           fproc = open('nproc.rc',"r")
+        self.env = utils.source_g5_modules(g5_mod_path)
+
+    def execute(self,logfile):
+
+        nproc_file = os.path.join(self.scratch_dir,'nproc.rc')
+        if os.path.isfile(nproc_file):
+           fproc = open(nproc_file,"r")
            nproc = fproc.readline()
            nproc = nproc.rstrip()
            fproc.close()
         else:
            nproc = "1"
 
-        #if not os.path.isfile('extdata.yaml'):
-           #exec_path = "/gpfsm/dswdev/bmauer/packages/erc/erc ExtData.rc extdata.yaml" 
-           #sp.call(exec_path,stdout=logfile,stderr=logfile,shell=True)
         #exec_path = self.build_dir+"/esma_mpirun -np "+nproc+" "+self.build_dir+"/ExtDataDriver.x "
         exec_path = "mpirun -np "+nproc+" "+self.build_dir+"/ExtDataDriver.x "
-        sp.call(exec_path,stdout=logfile,stderr=logfile,shell=True)
-        sp.call("~/bin/Killall ExtDataDriver.x",stdout=logfile,stderr=logfile,shell=True)
+        # driver processes mpirun leaves behind are killed with its process
+        # group only, not node-wide, since other cases (e.g. job array tasks)
+        # may run drivers on the same node. If the caller kills the group it
+        # runs in once the case is done or cancelled (EXTDATA_CASE_GROUP, see
+        # compare_script.run_watch), mpirun stays in that group; otherwise it
+        # gets a group of its own that is killed here
+        own_group = not os.environ.get('EXTDATA_CASE_GROUP')
+        run = sp.Popen(exec_path,stdout=logfile,stderr=logfile,shell=True,cwd=self.scratch_dir,
+                       env=self.env,preexec_fn=os.setsid if own_group else None)
+        run.wait()
+        if own_group:
+           try:
+              os.killpg(run.pid,signal.SIGKILL)
+           except OSError:
+              pass
 
         print "finished exec of ",self.case_name.rstrip()
-        success = os.path.isfile('egress')
-        os.chdir(orig_dir)
-        shutil.rmtree(scrdir)
+        return os.path.isfile(os.path.join(self.scratch_dir,'egress'))
+
+    def save_outputs(self,logfile):
+
+        if os.path.isdir(self.output_dir):
+           shutil.rmtree(self.output_dir)
+        utils.mkdir_p(self.output_dir)
+        for nc_file in glob.glob(self.scratch_dir+"/*.nc4"):
+            shutil.copy(nc_file,self.output_dir)
+
+    def cleanup(self,logfile):
+
+        trash.discard(self.scratch_dir)
+
+    def timed(self,phase,logfile):
+
+        sTart = time.time()
+        rc = getattr(self,phase)(logfile)
+        self.phase_times[phase] = time.time()-sTart
+        return rc
+
+    def run(self,logfile):
+
+        self.phase_times = OrderedDict()
+        self.timed('stage',logfile)
+        self.timed('load_modules',logfile)
+        success = self.timed('execute',logfile)
+        if self.output_dir:
+           self.save_outputs(logfile)
+        self.timed('cleanup',logfile)
 
         if success:
            return True
         else:
            return False
-        
+
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Long-lived case runner. The server pays the python startup, the g5_modules
+# sourcing (see source_g5_modules, once per build) and the case checks (once
+# per case edit) a single time, then runs cases on request from a local Unix
+# socket and streams the progress back:
+#
+#     runner_daemon.py serve                                 # start server
+#     runner_daemon.py run --builddir B --casedir C --cases case1
+#     runner_daemon.py run --builddir B --casedir C --filter 'case1*'
+#     runner_daemon.py stop
+#
+# Requests and events are json objects, one per line. The socket is
+# $EXTDATA_RUNNER_SOCKET (default ~/.cache/extdata_runner.sock).
+#
+#      CaseCache
+#      serve
+#      send_request
+#      start_server
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import socket
+import json
+import time
+import fnmatch
+import subprocess as sp
+
+import utils
+import benchmark
+from run_case import ExtDataCase
+from validate_case import validate_case
+
+
+def socket_path():
+
+    return os.environ.get('EXTDATA_RUNNER_SOCKET') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'extdata_runner.sock')
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Persistent ExtData case runner')
+
+    p.add_argument("action",  choices=['serve', 'run', 'ping', 'stop'],help='start the server or send it a request')
+    p.add_argument("--socket",  dest="socket",default=socket_path(),help='socket of the server')
+    p.add_argument("--builddir",  dest="build_dir",help='dir with ExtDataDriver.x and g5_modules')
+    p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
+    p.add_argument("--cases",  dest="cases",nargs='+',default=[],help='cases to run (default: all cases in --casedir)')
+    p.add_argument("--casefile",  dest="case_file",help='file with list of cases')
+    p.add_argument("--filter",  dest="filter",help='only run the cases matching this pattern')
+    p.add_argument("--savelog",dest="save_log",default="false",help='keep the logs of passing cases')
+    p.add_argument("--validate",dest="validate",default="true",help='check cases before running them')
+    p.add_argument("--scratch-dir",dest="scratch_dir",help='where the server runs cases (default: ExtData_scratch in its dir)')
+    p.add_argument("--start",  dest="start",action="store_true",help='start the server if it is not running')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if args['action'] == 'run':
+        if not args['build_dir'] or not os.path.isdir(args['build_dir']):
+            raise Exception('build_dir [%s] does not exist' % args['build_dir'])
+        if not args['case_dir'] or not os.path.isdir(args['case_dir']):
+            raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+        args['build_dir'] = os.path.abspath(args['build_dir'])
+        args['case_dir'] = os.path.abspath(args['case_dir'])
+
+    return args
+
+
+class CaseCache(object):
+    """
+    # --------------------------------------------------------------------------
+    # validation results of cases, kept until a file of the case changes
+    # --------------------------------------------------------------------------
+    """
+
+    def __init__(self):
+
+        self.checked = {}
+
+    def _signature(self, case_path):
+
+        return tuple(sorted([(f, os.path.getmtime(os.path.join(case_path, f)))
+                             for f in os.listdir(case_path)]))
+
+    def problems(self, case_path):
+
+        signature = self._signature(case_path)
+        if case_path not in self.checked or self.checked[case_path][0] != signature:
+            self.checked[case_path] = (signature, validate_case(case_path))
+        return self.checked[case_path][1]
+
+    def discover(self, case_dir):
+
+        return sorted([case for case in os.listdir(case_dir)
+                       if os.path.isfile(os.path.join(case_dir, case, 'CAP.rc'))])
+
+
+def _send(conn, event):
+
+    conn.sendall((json.dumps(event) + '\n').encode())
+
+
+def _run_cases(conn, request, cache, scratch_dir):
+
+    comm_opts = {'build_dir': request['build_dir'],
+                 'case_dir': request['case_dir'],
+                 'scratch_dir': request.get('scratch_dir') or scratch_dir,
+                 'rc_overrides': request.get('rc_overrides')}
+    cases = request.get('cases') or cache.discover(request['case_dir'])
+    if request.get('filter'):
+        cases = [case for case in cases if fnmatch.fnmatch(case, request['filter'])]
+    log_dir = request.get('log_dir') or os.getcwd()
+
+    npass = 0; nfail = 0
+    for case in cases:
+        case_path = os.path.join(request['case_dir'], case)
+        if request.get('validate', True):
+            problems = cache.problems(case_path)
+            if problems:
+                _send(conn, {'event': 'done', 'case': case, 'status': 'invalid', 'problems': problems})
+                nfail += 1
+                continue
+        _send(conn, {'event': 'start', 'case': case})
+        logfile = os.path.join(log_dir, case + '.log')
+        log = open(logfile, 'w')
+        this_case = ExtDataCase(case, comm_opts)
+        success = this_case.run(log)
+        log.close()
+        if success and not request.get('save_log'):
+            os.remove(logfile)
+            logfile = None
+        if success: npass += 1
+        else: nfail += 1
+        _send(conn, {'event': 'done', 'case': case, 'status': 'passed' if success else 'failed',
+                     'phase_times': this_case.phase_times, 'log': logfile})
+    _send(conn, {'event': 'end', 'passed': npass, 'failed': nfail})
+
+
+def serve(sock_path, scratch_dir=None, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # accept requests on sock_path until a stop request. Requests are handled
+    # one at a time (the cases share the scratch dir); a client that goes
+    # away stops its run after the current case
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+    scratch_dir = os.path.abspath(scratch_dir or 'ExtData_scratch')
+
+    if os.path.exists(sock_path):
+        try:
+            list(send_request(sock_path, {'action': 'ping'}))
+            raise Exception('a runner is already serving [%s]' % sock_path)
+        except socket.error:
+            os.remove(sock_path) # left behind by a server that died
+    utils.mkdir_p(os.path.dirname(sock_path))
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock_path)
+    server.listen(5)
+    utils.writemsg(' Runner serving on %s\n' % sock_path, fout)
+
+    cache = CaseCache()
+    try:
+        while True:
+            conn = server.accept()[0]
+            try:
+                request = json.loads(conn.makefile('r').readline())
+                if request['action'] == 'stop':
+                    _send(conn, {'event': 'end'})
+                    conn.close()
+                    break
+                elif request['action'] == 'ping':
+                    _send(conn, {'event': 'end', 'pid': os.getpid()})
+                elif request['action'] == 'run':
+                    utils.writemsg(' Running %s\n' % ' '.join(request.get('cases') or ['all cases']), fout)
+                    _run_cases(conn, request, cache, scratch_dir)
+            except socket.error:
+                utils.writemsg(' Client went away\n', fout)
+            except Exception as e:
+                try:
+                    _send(conn, {'event': 'error', 'message': str(e)})
+                except socket.error:
+                    pass
+            conn.close()
+    finally:
+        server.close()
+        os.remove(sock_path)
+
+
+def send_request(sock_path, request):
+    """
+    # --------------------------------------------------------------------------
+    # send request to the server and yield its events up to the end event
+    # --------------------------------------------------------------------------
+    """
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(sock_path)
+    try:
+        conn.sendall((json.dumps(request) + '\n').encode())
+        for line in conn.makefile('r'):
+            event = json.loads(line)
+            yield event
+            if event['event'] in ['end', 'error']: break
+    finally:
+        conn.close()
+
+
+def start_server(sock_path, scratch_dir=None, timeout=30):
+    """
+    # --------------------------------------------------------------------------
+    # start a detached server (output in <socket>.log) and wait until it
+    # answers
+    # --------------------------------------------------------------------------
+    """
+
+    utils.mkdir_p(os.path.dirname(sock_path))
+    cmd = [sys.executable, os.path.abspath(__file__), 'serve', '--socket', sock_path]
+    if scratch_dir: cmd += ['--scratch-dir', scratch_dir]
+    log = open(sock_path + '.log', 'a')
+    sp.Popen(cmd, stdin=open(os.devnull, 'r'), stdout=log, stderr=log, close_fds=True, preexec_fn=os.setsid)
+    log.close()
+
+    sTart = time.time()
+    while time.time() - sTart < timeout:
+        try:
+            list(send_request(sock_path, {'action': 'ping'}))
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise Exception('runner did not start, see [%s.log]' % sock_path)
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    sock_path = comm_opts['socket']
+
+    if comm_opts['action'] == 'serve':
+        serve(sock_path, comm_opts['scratch_dir'])
+        sys.exit(0)
+
+    if comm_opts['start'] and comm_opts['action'] != 'stop':
+        try:
+            list(send_request(sock_path, {'action': 'ping'}))
+        except socket.error:
+            start_server(sock_path, comm_opts['scratch_dir'])
+
+    request = {'action': comm_opts['action']}
+    if comm_opts['action'] == 'run':
+        cases = list(comm_opts['cases'])
+        if comm_opts['case_file']: cases += benchmark.read_case_list(comm_opts['case_file'])
+        request.update({'build_dir': comm_opts['build_dir'],
+                        'case_dir': comm_opts['case_dir'],
+                        'cases': cases,
+                        'filter': comm_opts['filter'],
+                        'save_log': comm_opts['save_log'].lower() != 'false',
+                        'validate': comm_opts['validate'].lower() != 'false',
+                        'scratch_dir': os.path.abspath(comm_opts['scratch_dir']) if comm_opts['scratch_dir'] else None,
+                        'log_dir': os.getcwd()})
+
+    failed = 0
+    for event in send_request(sock_path, request):
+        if event['event'] == 'start':
+            utils.writemsg(' running %s...' % event['case'])
+        elif event['event'] == 'done':
+            if event['status'] == 'invalid':
+                for problem in event['problems']:
+                    utils.writemsg('   %s\n' % problem)
+                utils.writemsg(' %s failed validation\n' % event['case'])
+            else:
+                utils.writemsg('%s (%.1f s)\n' % (event['status'], event['phase_times'].get('execute', 0.0)))
+        elif event['event'] == 'end' and 'pid' in event:
+            utils.writemsg(' runner is up (pid %d)\n' % event['pid'])
+        elif event['event'] == 'end' and 'passed' in event:
+            failed = event['failed']
+            utils.writemsg(' %d passed, %d failed\n' % (event['passed'], event['failed']))
+        elif event['event'] == 'error':
+            utils.writemsg(' runner error: %s\n' % event['message'])
+            failed = 1
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Run a suite of ExtData cases on the cluster as a single job array (slurm
+# or PBS, see get_scheduler) instead of one job per case. Task i runs the
+# i-th case through compare_script.py with its own scratch dir and writes its
+# own result file; the results are collected when the array has finished.
+#
+# With --chain the whole pipeline (build -> case array -> report) is queued
+# at once, each stage depending on the previous one (afterok/afterany), and
+# no client process waits for it. The report ends up in logs/report.out.
+#
+# Layout of the work dir:
+#     tasks/<i>.txt      case of task i
+#     scratch/<i>/       scratch dir of task i
+#     results/<i>.json   result of task i (see compare_script --result-file)
+#     logs/              scheduler output and case logs
+#     job_ids            ids of the submitted jobs, one stage per line
+#
+#      build_source
+#      write_job_script
+#      write_array_script
+#      submit_script
+#      submit_pipeline
+#      collect_results
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import subprocess as sp
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+import utils
+import benchmark
+import job_tracker
+import local_sched
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Run ExtData cases as a job array')
+
+    p.add_argument("--builddir",  dest="build_dir",help='dir with ExtDataDriver.x and g5_modules')
+    p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
+    p.add_argument("--cases",  dest="cases",help='file with list of cases')
+    p.add_argument("--workdir",  dest="work_dir",default="ExtData_suite",help='dir for task files, scratch dirs, results and logs')
+    p.add_argument("--time",  dest="time",default="1:00:00",help='wall time per task')
+    p.add_argument("--ntasks",  dest="ntasks",type=int,help='MPI tasks per array task (default: largest nproc.rc of the cases)')
+    p.add_argument("--account",  dest="account",help='account (slurm) or group_list (PBS) to charge')
+    p.add_argument("--qos",  dest="qos",help='qos (slurm) or queue (PBS)')
+    p.add_argument("--savelog",dest="save_log",default="false",help='keep the logs of passing cases')
+    p.add_argument("--nowait",  dest="nowait",action="store_true",help='submit and return; collect later with --collect')
+    p.add_argument("--collect",  dest="collect",action="store_true",help='only collect the results in --workdir')
+
+    # build and pipeline
+    # ------------------
+    p.add_argument("--build-src",  dest="build_src",help='MAPL source to build first (replaces --builddir)')
+    p.add_argument("--debug",  dest="debug",action="store_true",help='Debug instead of Release build of --build-src')
+    p.add_argument("--build-time",  dest="build_time",default="2:00:00",help='wall time of the build job')
+    p.add_argument("--build-ntasks",  dest="build_ntasks",type=int,default=12,help='cores of the build job')
+    p.add_argument("--chain",  dest="chain",action="store_true",help='queue build, case array and report as dependent jobs and return')
+    p.add_argument("--build-only",  dest="build_only",action="store_true",help=argparse.SUPPRESS)
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    args['work_dir'] = os.path.abspath(args['work_dir'])
+    if args['collect']:
+        return args
+    if args['build_src']:
+        if not os.path.isdir(args['build_src']):
+            raise Exception('build_src [%s] does not exist' % args['build_src'])
+        args['build_src'] = os.path.abspath(args['build_src'])
+        args['build_dir'] = os.path.join(args['build_src'], 'install-%s' % ('Debug' if args['debug'] else 'Release'), 'bin')
+        if args['build_only']:
+            return args
+    elif not args['build_dir'] or not os.path.isdir(args['build_dir']):
+        raise Exception('build_dir [%s] does not exist' % args['build_dir'])
+    if not args['case_dir'] or not os.path.isdir(args['case_dir']):
+        raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+    if not args['cases'] or not os.path.isfile(args['cases']):
+        raise Exception('case file [%s] does not exist' % args['cases'])
+    args['build_dir'] = os.path.abspath(args['build_dir'])
+    args['case_dir'] = os.path.abspath(args['case_dir'])
+
+    return args
+
+
+def _case_nproc(case_path):
+
+    nproc_file = os.path.join(case_path, 'nproc.rc')
+    if not os.path.isfile(nproc_file): return 1
+    fin = open(nproc_file, 'r'); nproc = int(fin.readline().strip() or 1); fin.close()
+    return nproc
+
+
+def build_source(src_dir, debug=False, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # build src_dir (unless already built) and return the directory with
+    # ExtDataDriver.x and g5_modules (as ExtDataCase expects)
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    bin_dir = os.path.join(src_dir, 'install-%s' % ('Debug' if debug else 'Release'), 'bin')
+    with open(os.devnull, 'w') as devnull:
+        built = utils.check_bld(src_dir, 'MAPL', DEBUG=debug, fout=devnull)
+    if not built:
+        utils.build_cmake_github(src_dir, DEBUG=debug, fout=fout)
+        if not utils.check_bld(src_dir, 'MAPL', DEBUG=debug, fout=fout):
+            raise Exception('build of [%s] has no ExtDataDriver.x' % src_dir)
+    if not os.path.exists(os.path.join(bin_dir, 'g5_modules')):
+        utils.create_link(os.path.join(src_dir, '@env', 'g5_modules'), bin_dir, 'g5_modules')
+    return bin_dir
+
+
+def write_job_script(job_script, name, commands, comm_opts, ntasks=1, time=None,
+                     array=None, output=None, SCHED=None):
+    """
+    # --------------------------------------------------------------------------
+    # write a batch job script
+    #
+    # Inputs:
+    #     job_script: path of the script
+    #           name: job name
+    #       commands: list of shell lines of the job body. In an array job
+    #                 $ID is the task index
+    #      comm_opts: options (time, account, qos)
+    #         ntasks: MPI tasks
+    #           time: wall time, if None comm_opts['time']
+    #          array: number of array tasks, None for a plain job
+    #         output: scheduler output file (slurm, may contain %a) or dir
+    #                 (PBS arrays)
+    #          SCHED: SLURM, PBS or LOCAL, if None see get_scheduler
+    # --------------------------------------------------------------------------
+    """
+
+    if not SCHED: SCHED = utils.get_scheduler()
+    if not time: time = comm_opts['time']
+
+    # local_sched reads the slurm lines
+    if SCHED in ['SLURM', 'LOCAL']:
+        header = ['#SBATCH --job-name=%s' % name]
+        if array: header.append('#SBATCH --array=1-%d' % array)
+        header += ['#SBATCH --ntasks=%d' % ntasks,
+                   '#SBATCH --time=%s' % time]
+        if output: header.append('#SBATCH --output=%s' % output)
+        if comm_opts.get('account'): header.append('#SBATCH --account=%s' % comm_opts['account'])
+        if comm_opts.get('qos'): header.append('#SBATCH --qos=%s' % comm_opts['qos'])
+        task_id = '${SLURM_ARRAY_TASK_ID}'
+    elif SCHED == 'PBS':
+        header = ['#PBS -N %s' % name]
+        if array: header.append('#PBS -J 1-%d' % array)
+        header += ['#PBS -l select=1:ncpus=%d:mpiprocs=%d' % (ntasks, ntasks),
+                   '#PBS -l walltime=%s' % time,
+                   '#PBS -j oe']
+        if output: header.append('#PBS -o %s' % output)
+        if comm_opts.get('account'): header.append('#PBS -W group_list=%s' % comm_opts['account'])
+        if comm_opts.get('qos'): header.append('#PBS -q %s' % comm_opts['qos'])
+        task_id = '${PBS_ARRAY_INDEX}'
+    else:
+        raise Exception('scheduler [%s] not recognized' % SCHED)
+
+    body = ['']
+    if array: body.append('ID=%s' % task_id)
+    fout = open(job_script, 'w')
+    fout.write('\n'.join(['#!/bin/bash'] + header + body + commands) + '\n')
+    fout.close()
+    return job_script
+
+
+def write_array_script(work_dir, cases, comm_opts, SCHED=None):
+    """
+    # --------------------------------------------------------------------------
+    # write the task files and the job array script for cases to work_dir
+    #
+    # Inputs:
+    #      work_dir: work dir (see above), created if needed
+    #         cases: list of case names, task i runs cases[i-1]
+    #     comm_opts: options (build_dir, case_dir, time, ntasks, account,
+    #                qos, save_log)
+    #         SCHED: SLURM, PBS or LOCAL, if None see get_scheduler
+    # Output:
+    #     path of the job script
+    # --------------------------------------------------------------------------
+    """
+
+    if not SCHED: SCHED = utils.get_scheduler()
+
+    for subdir in ['tasks', 'scratch', 'results', 'logs']:
+        utils.mkdir_p(os.path.join(work_dir, subdir))
+    for i, case in enumerate(cases):
+        ftask = open(os.path.join(work_dir, 'tasks', '%d.txt' % (i+1)), 'w')
+        ftask.write(case + '\n')
+        ftask.close()
+        result_file = os.path.join(work_dir, 'results', '%d.json' % (i+1))
+        if os.path.isfile(result_file): os.remove(result_file)
+
+    ntasks = comm_opts.get('ntasks') or \
+        max([_case_nproc(os.path.join(comm_opts['case_dir'], case)) for case in cases])
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    commands = ['cd %s/logs' % work_dir,
+                ' '.join([sys.executable, os.path.join(script_dir, 'compare_script.py'),
+                          '--builddir', comm_opts['build_dir'],
+                          '--casedir', comm_opts['case_dir'],
+                          '--cases', '%s/tasks/$ID.txt' % work_dir,
+                          '--scratch-dir', '%s/scratch/$ID' % work_dir,
+                          '--result-file', '%s/results/$ID.json' % work_dir,
+                          '--savelog', comm_opts.get('save_log') or 'false'])]
+    output = '%s/logs/task_%%a.out' % work_dir if SCHED != 'PBS' else '%s/logs/' % work_dir
+
+    return write_job_script(os.path.join(work_dir, 'suite.j'), 'ExtDataSuite', commands, comm_opts,
+                            ntasks=ntasks, array=len(cases), output=output, SCHED=SCHED)
+
+
+def submit_script(job_script, depend=None, fout=None, SCHED=None):
+    """
+    # --------------------------------------------------------------------------
+    # submit job_script and return the job id
+    #
+    # Inputs:
+    #     job_script: job script, submitted from its dir
+    #         depend: (type, job id) the job waits for, type is afterok
+    #                 (start if it succeeded) or afterany (start once it
+    #                 ended). None for no dependency
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+    if not SCHED: SCHED = utils.get_scheduler()
+
+    if SCHED == 'SLURM':
+        cmd = ['sbatch']
+        if depend: cmd.append('--dependency=%s:%s' % depend)
+    elif SCHED == 'PBS':
+        cmd = ['qsub']
+        if depend: cmd += ['-W', 'depend=%s:%s' % depend]
+    elif SCHED != 'LOCAL':
+        raise Exception('scheduler [%s] not recognized' % SCHED)
+
+    utils.writemsg(' Submitting %s...' % os.path.basename(job_script), fout)
+    if SCHED == 'LOCAL':
+        JOB_ID = local_sched.submit(job_script, depend)
+    else:
+        cmd.append(job_script)
+        run = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, cwd=os.path.dirname(job_script))
+        output = run.communicate()
+        if run.returncode != 0:
+            print('0:'); print(output[0]); print('1:'); print(output[1])
+            raise Exception('%s [%s] failed' % (cmd[0], job_script))
+        JOB_ID = output[0].decode().split()[-1].strip()
+    utils.writemsg('done. [%s, %s]\n' % (JOB_ID, datetime.now().strftime('%Y/%m/%d, %H:%M:%S')), fout)
+    return JOB_ID
+
+
+def submit_pipeline(comm_opts, cases, fout=None, SCHED=None):
+    """
+    # --------------------------------------------------------------------------
+    # queue the build of comm_opts['build_src'] (if set), the case array
+    # (after the build succeeded) and the report (after the array ended,
+    # whatever its outcome) and return the job ids as OrderedDict by stage
+    # --------------------------------------------------------------------------
+    """
+
+    if not SCHED: SCHED = utils.get_scheduler()
+
+    work_dir = comm_opts['work_dir']
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    suite_job = os.path.join(script_dir, 'suite_job.py')
+    job_ids = OrderedDict()
+
+    array_script = write_array_script(work_dir, cases, comm_opts, SCHED)
+
+    depend = None
+    if comm_opts.get('build_src'):
+        commands = ['cd %s/logs' % work_dir,
+                    ' '.join([sys.executable, suite_job, '--build-only',
+                              '--build-src', comm_opts['build_src']] +
+                             (['--debug'] if comm_opts.get('debug') else []))]
+        build_script = write_job_script(os.path.join(work_dir, 'build.j'), 'ExtDataBuild', commands, comm_opts,
+                                        ntasks=comm_opts.get('build_ntasks') or 1, time=comm_opts.get('build_time'),
+                                        output='%s/logs/build.out' % work_dir, SCHED=SCHED)
+        job_ids['build'] = submit_script(build_script, None, fout, SCHED)
+        depend = ('afterok', job_ids['build'])
+
+    job_ids['cases'] = submit_script(array_script, depend, fout, SCHED)
+
+    commands = ['cd %s/logs' % work_dir,
+                ' '.join([sys.executable, suite_job, '--collect', '--workdir', work_dir])]
+    report_script = write_job_script(os.path.join(work_dir, 'report.j'), 'ExtDataReport', commands, comm_opts,
+                                     time='0:10:00', output='%s/logs/report.out' % work_dir, SCHED=SCHED)
+    job_ids['report'] = submit_script(report_script, ('afterany', job_ids['cases']), fout, SCHED)
+
+    fjob = open(os.path.join(work_dir, 'job_ids'), 'w')
+    for stage in job_ids:
+        fjob.write('%s %s\n' % (stage, job_ids[stage]))
+    fjob.close()
+    return job_ids
+
+
+def collect_results(work_dir):
+    """
+    # --------------------------------------------------------------------------
+    # read the task results in work_dir
+    #
+    # Output:
+    #     OrderedDict with case as key and result dict (status, phase_times,
+    #     log, or problems) as val, in task order. Tasks without a result
+    #     file (killed, timed out, never ran) get status 'missing'
+    # --------------------------------------------------------------------------
+    """
+
+    results = OrderedDict()
+    task_dir = os.path.join(work_dir, 'tasks')
+    ids = sorted([int(f.split('.')[0]) for f in os.listdir(task_dir) if f.endswith('.txt')])
+    for i in ids:
+        fin = open(os.path.join(task_dir, '%d.txt' % i), 'r'); case = fin.readline().strip(); fin.close()
+        result_file = os.path.join(work_dir, 'results', '%d.json' % i)
+        if os.path.isfile(result_file):
+            fin = open(result_file, 'r'); task_results = json.load(fin); fin.close()
+            results[case] = task_results.get(case, {'status': 'missing'})
+        else:
+            results[case] = {'status': 'missing'}
+    return results
+
+
+def write_results(results, fout=None):
+
+    if not fout: fout = sys.stdout
+
+    utils.writemsg('\n %-24s %-8s %10s\n' % ('case', 'status', 'execute (s)'), fout)
+    for case in results:
+        execute = (results[case].get('phase_times') or {}).get('execute')
+        utils.writemsg(' %-24s %-8s %10s\n' % (case, results[case]['status'],
+                                                '%.1f' % execute if execute is not None else '-'), fout)
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+
+    if comm_opts['build_only']:
+        build_source(comm_opts['build_src'], comm_opts['debug'])
+        sys.exit(0)
+
+    if not comm_opts['collect']:
+        cases = benchmark.read_case_list(comm_opts['cases'])
+        if comm_opts['chain']:
+            submit_pipeline(comm_opts, cases)
+            sys.exit(0)
+        if comm_opts['build_src']:
+            build_source(comm_opts['build_src'], comm_opts['debug'])
+        job_script = write_array_script(comm_opts['work_dir'], cases, comm_opts)
+        JOB_ID = submit_script(job_script)
+        fjob = open(os.path.join(comm_opts['work_dir'], 'job_ids'), 'w'); fjob.write('cases %s\n' % JOB_ID); fjob.close()
+        if comm_opts['nowait']:
+            sys.exit(0)
+        utils.writemsg(' Waiting for job array to complete...')
+        tracker = job_tracker.JobTracker()
+        tracker.add(JOB_ID)
+        state = tracker.wait()[JOB_ID]
+        utils.writemsg('%s. [%s]\n' % (state.lower(), datetime.now().strftime('%Y/%m/%d, %H:%M:%S')))
+
+    results = collect_results(comm_opts['work_dir'])
+    write_results(results)
+    sys.exit(0 if all([r['status'] == 'passed' for r in results.values()]) else 1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Asynchronous deletion of scratch dirs. discard() renames a dir into the
+# trash dir next to it (.ExtData_trash, same file system, so the rename is
+# instant) and returns; a few background threads remove the trash trees.
+# Trash left by a run that crashed is reclaimed when the trash dir is next
+# used, and trash still queued at exit is handed to a detached process
+# (python trash.py <trash dir>) instead of holding up the exit.
+#
+#      TrashCan
+#      get_trash
+#      discard
+# ------------------------------------------------------------------------------
+"""
+
+import os
+import sys
+import errno
+import shutil
+import atexit
+import threading
+import itertools
+import subprocess as sp
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+TRASH_NAME = '.ExtData_trash'
+
+
+def _default_workers():
+
+    # trees removed at the same time, per trash dir
+    return max(1, int(os.environ.get('EXTDATA_TRASH_WORKERS') or 2))
+
+
+class TrashCan(object):
+
+    def __init__(self, trash_dir, nworkers=None):
+
+        self.trash_dir = os.path.abspath(trash_dir)
+        if not os.path.isdir(self.trash_dir):
+            try:
+                os.makedirs(self.trash_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST: raise
+        self.todo = queue.Queue()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+
+        # leftovers of earlier (crashed) runs
+        for name in os.listdir(self.trash_dir):
+            self._queue(os.path.join(self.trash_dir, name))
+
+        for i in range(nworkers or _default_workers()):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def _queue(self, path):
+
+        with self.lock:
+            self.pending += 1
+        self.todo.put(path)
+
+    def _work(self):
+
+        while True:
+            path = self.todo.get()
+            shutil.rmtree(path, ignore_errors=True)
+            with self.lock:
+                self.pending -= 1
+
+    def discard(self, path):
+        """
+        # ----------------------------------------------------------------------
+        # move path into the trash and queue its removal. Falls back to a
+        # plain rmtree if path is on another file system
+        # ----------------------------------------------------------------------
+        """
+
+        if not os.path.lexists(path): return
+        target = os.path.join(self.trash_dir, '%s.%d.%d' % (os.path.basename(os.path.normpath(path)),
+                                                             os.getpid(), next(self.counter)))
+        try:
+            os.rename(path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+            shutil.rmtree(path)
+            return
+        self._queue(target)
+
+    def handoff(self):
+
+        # queued trees are removed by a detached process, so exit need not wait
+        if self.pending:
+            devnull = open(os.devnull, 'w')
+            sp.Popen([sys.executable, os.path.abspath(__file__), self.trash_dir],
+                     stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                     preexec_fn=os.setsid)
+            devnull.close()
+
+
+_TRASH_CANS = {}
+_TRASH_LOCK = threading.Lock()
+
+
+def get_trash(path):
+    """
+    # --------------------------------------------------------------------------
+    # the TrashCan (one per process) for the trash dir next to path
+    # --------------------------------------------------------------------------
+    """
+
+    trash_dir = os.path.join(os.path.dirname(os.path.abspath(os.path.normpath(path))), TRASH_NAME)
+    with _TRASH_LOCK:
+        if trash_dir not in _TRASH_CANS:
+            _TRASH_CANS[trash_dir] = TrashCan(trash_dir)
+        return _TRASH_CANS[trash_dir]
+
+
+def discard(path):
+    """
+    # --------------------------------------------------------------------------
+    # delete the dir path in the background (see TrashCan.discard)
+    # --------------------------------------------------------------------------
+    """
+
+    get_trash(path).discard(path)
+
+
+@atexit.register
+def _handoff_all():
+
+    for trash_can in list(_TRASH_CANS.values()):
+        trash_can.handoff()
+
+
+if __name__ == "__main__":
+
+    # empty the given trash dir(s)
+    for trash_dir in sys.argv[1:]:
+        for name in os.listdir(trash_dir):
+            shutil.rmtree(os.path.join(trash_dir, name), ignore_errors=True)
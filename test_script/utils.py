@@ -5,11 +5,15 @@
 # collection of useful functions:
 #
 #      get_mapl_times
+#      get_mapl_timer_block
 #      get_mapl_memusage
 #      get_wall_cpu_times
+#      open_log
 #      find_files
+#      iter_files
 #      writemsg
 #      get_hostname
+#      get_scheduler
 #      mkdir_p
 #      create_link
 #      cvs_setenv
@@ -24,6 +28,12 @@
 #      build_serial
 #      build_pinstall
 #      build_cmake_developer
+#      get_build_jobs
+#      build_configs
+#      build_cache_key
+#      fetch_cached_build
+#      store_cached_build
+#      parse_ctest_xml
 #      check_bld
 #      build_doc
 #      check_doc
@@ -48,6 +58,7 @@
 #      useHemco
 #      useOpsGOCART
 #      are_dir_trees_equal
+#      compare_dir_trees
 #      useSingleNode
 #      is_tool
 #      nc4_compare
@@ -71,10 +82,59 @@ import shlex
 import distutils.spawn
 import subprocess
 import re
+import stat
+import hashlib
+import threading
+import multiprocessing
+import json
+import tempfile
+import gzip
+
+from multiprocessing.pool import ThreadPool
 
 from datetime import datetime
 from collections import OrderedDict
 
+import job_tracker
+import local_sched
+
+# serializes source_g5_modules, which edits os.environ, between builds
+_G5_LOCK = threading.Lock()
+
+# environment changes made by source_g5_modules, by (g5_modules, mtime), as
+# ({key: value}, [removed keys]) relative to the environment before any
+# g5_modules was sourced
+_G5_SOURCED = {}
+# that environment ('base', taken at the first sourcing) and the key of the
+# g5_modules applied last ('last')
+_G5_ENV = {}
+# set by the build helpers after sourcing, reset with the g5_modules changes
+# so that they do not carry over to the next build
+_G5_BUILD_KEYS = ['ESMADIR']
+
+
+def _g5_apply(G5_KEY):
+
+    # make os.environ the base plus the changes of G5_KEY (None: no
+    # g5_modules), setting or removing only the keys that the g5_modules
+    # applied last or this one changed (and _G5_BUILD_KEYS) where they differ
+    changed, removed = _G5_SOURCED.get(G5_KEY, ({}, []))
+    last_changed, last_removed = _G5_SOURCED.get(_G5_ENV['last'], ({}, []))
+    base = _G5_ENV['base']
+    for key in set(changed) | set(removed) | set(last_changed) | set(last_removed) | set(_G5_BUILD_KEYS):
+        if key in changed:
+            val = changed[key]
+        elif key in removed:
+            val = None
+        else:
+            val = base.get(key)
+        if val is None:
+            os.environ.pop(key, None)
+        elif os.environ.get(key) != val:
+            os.environ[key] = val
+    _G5_ENV['last'] = G5_KEY
+
+
 def get_mapl_times(PBSOutputFile, GridComps, What2Report='TOTAL'):
     """
     # --------------------------------------------------------------------------
@@ -93,7 +153,7 @@ def get_mapl_times(PBSOutputFile, GridComps, What2Report='TOTAL'):
     assert GridComps, 'empty list passed'
 
     MAPL_Times = OrderedDict()
-    fin = open(PBSOutputFile, 'r')
+    fin = open_log(PBSOutputFile)
     lines = fin.readlines()
     
     endString = '--GenRefreshMine'
@@ -121,6 +181,44 @@ def get_mapl_times(PBSOutputFile, GridComps, What2Report='TOTAL'):
     return MAPL_Times
 
 
+def get_mapl_timer_block(PBSOutputFile, GridComp):
+    """
+    # --------------------------------------------------------------------------
+    # parse job output file for all entries of one MAPL timer block
+    #
+    # Inputs:
+    #     PBSOutputFile: job output file
+    #          GridComp: GridComp whose timer block we want (e.g. EXTDATA)
+    #
+    # Output:
+    #       MAPL_Timer: an OrderedDict with entry (TOTAL, Initialize, Run,
+    #                   GenInitTot etc.) as key and time as val. Empty if
+    #                   the block was not found
+    # --------------------------------------------------------------------------
+    """
+
+    MAPL_Timer = OrderedDict()
+    startString = 'Times for ' + GridComp
+    endString = '--GenRefreshMine'
+    inBlock = False
+
+    fin = open_log(PBSOutputFile)
+    for line in fin:
+        if startString in line:
+            # only keep the last report (e.g. one per CAP case)
+            inBlock = True
+            MAPL_Timer = OrderedDict()
+            continue
+        if endString in line: inBlock = False
+        if inBlock:
+            spltLine = [x.strip() for x in line.split(':')]
+            if len(spltLine) > 1 and spltLine[1] and isFloat(spltLine[1].split()[-1]):
+                MAPL_Timer[spltLine[0]] = float(spltLine[1].split()[-1])
+    fin.close()
+
+    return MAPL_Timer
+
+
 def get_mapl_memusage(PBSOutputFile, GridComps):
     """
     # --------------------------------------------------------------------------
@@ -151,7 +249,7 @@ def get_mapl_memusage(PBSOutputFile, GridComps):
     mem_used = []
     swap_used = []
 
-    fin = open(PBSOutputFile, 'r')
+    fin = open_log(PBSOutputFile)
     lines = fin.readlines()
     
     for line in lines:        
@@ -208,7 +306,7 @@ def get_wall_cpu_times(PBSOutputFile):
     """
     
     PBS_times = {'wall time': '', 'cpu time': ''}
-    fin = open(PBSOutputFile, 'r')
+    fin = open_log(PBSOutputFile)
     lines = fin.readlines()
 
     for line in lines:
@@ -233,26 +331,161 @@ def get_wall_cpu_times(PBSOutputFile):
     return PBS_times
 
 
-def find_files(srcdir, pattern):
+def open_log(LogFile):
+    """
+    # --------------------------------------------------------------------------
+    # open a job/case log for reading, gzipped if it ends in .gz (e.g. the
+    # compressed case logs of case_log.CaseLog)
+    # --------------------------------------------------------------------------
+    """
+
+    if not LogFile.endswith('.gz'):
+        return open(LogFile, 'r')
+    if sys.version_info[0] > 2:
+        return gzip.open(LogFile, 'rt', errors='replace')
+    return gzip.open(LogFile, 'rb')
+
+
+def find_files(srcdir, pattern, prune=None):
     """
     # --------------------------------------------------------------------------
     # find files under 'srcdir' matching 'pattern'
     #
     # Inputs:
     #       srcdir: look for files under this dir
-    #      pattern: look for files matching this pattern
+    #      pattern: look for files matching this pattern (or list of patterns)
+    #        prune: do not descend into dirs matching these patterns
     # Output:
     #      list of matched files
     # --------------------------------------------------------------------------
     """
 
-    matched_files = []
-    for root, dirs, files in os.walk(srcdir):
-        for basename in files:
-            if fnmatch.fnmatch(basename, pattern):
-                filename = os.path.join(root, basename)
-                matched_files.append(filename)
-    return matched_files
+    return list(iter_files(srcdir, pattern, prune=prune))
+
+
+# str and (python 2) unicode patterns
+try:
+    _STRING_TYPES = (str, unicode)
+except NameError:
+    _STRING_TYPES = (str,)
+
+
+def _compile_patterns(patterns):
+    """
+    # --------------------------------------------------------------------------
+    # compile one or more fnmatch patterns into a single regex (None if empty)
+    # --------------------------------------------------------------------------
+    """
+
+    if not patterns: return None
+    if isinstance(patterns, _STRING_TYPES): patterns = [patterns]
+    return re.compile('|'.join(['(?:%s)' % fnmatch.translate(p) for p in patterns]))
+
+
+def _list_dir(root):
+    """
+    # --------------------------------------------------------------------------
+    # list root as (name, path, kind) tuples, kind is 'dir', 'link' (symlink
+    # to a dir) or 'file'. Raises OSError if root cannot be listed
+    # --------------------------------------------------------------------------
+    """
+
+    entries = []
+    if hasattr(os, 'scandir'):
+        for e in os.scandir(root):
+            if e.is_symlink():
+                kind = 'link' if e.is_dir() else 'file'
+            else:
+                kind = 'dir' if e.is_dir() else 'file'
+            entries.append((e.name, e.path, kind))
+    else:
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                kind = 'link' if os.path.islink(path) else 'dir'
+            else:
+                kind = 'file'
+            entries.append((name, path, kind))
+    return entries
+
+
+def _walk_matches(topdir, file_re, prune_re):
+    """
+    # --------------------------------------------------------------------------
+    # yield files under 'topdir' whose basename matches 'file_re', skipping
+    # dirs matching 'prune_re'. Like os.walk, symlinked dirs are not followed
+    # (nor returned as files) and unreadable dirs are skipped
+    # --------------------------------------------------------------------------
+    """
+
+    stack = [topdir]
+    while stack:
+        root = stack.pop()
+        try:
+            entries = _list_dir(root)
+        except OSError:
+            continue
+        subdirs = []
+        for name, path, kind in entries:
+            if kind == 'dir':
+                if not (prune_re and prune_re.match(name)):
+                    subdirs.append(path)
+            elif kind == 'file' and file_re.match(name):
+                yield path
+        stack.extend(reversed(subdirs))
+
+
+def iter_files(srcdir, patterns, prune=None, nthreads=1):
+    """
+    # --------------------------------------------------------------------------
+    # lazily find files under 'srcdir' matching any of 'patterns'. Patterns
+    # are compiled once, pruned dirs (e.g. '.git', 'BUILD_LOG_DIR') are not
+    # descended into and with nthreads > 1 the top-level subdirs are walked
+    # concurrently (results then come out in subtree completion order)
+    #
+    # Inputs:
+    #       srcdir: look for files under this dir
+    #     patterns: fnmatch pattern or list of patterns for file basenames
+    #        prune: dir basename pattern(s) not to descend into
+    #     nthreads: number of threads used to walk top-level subdirs
+    # Output:
+    #      generator of matched file paths
+    # --------------------------------------------------------------------------
+    """
+
+    file_re = _compile_patterns(patterns)
+    prune_re = _compile_patterns(prune)
+    if not file_re: return
+
+    if nthreads <= 1:
+        for filename in _walk_matches(srcdir, file_re, prune_re):
+            yield filename
+        return
+
+    # match top-level files here, hand top-level subdirs to the pool
+    # (a missing srcdir yields nothing, as in the serial walk)
+    # --------------------------------------------------------------
+    try:
+        entries = sorted(_list_dir(srcdir))
+    except OSError:
+        return
+    subdirs = []
+    for name, path, kind in entries:
+        if kind == 'dir':
+            if not (prune_re and prune_re.match(name)):
+                subdirs.append(path)
+        elif kind == 'file' and file_re.match(name):
+            yield path
+
+    walk_subtree = lambda topdir: list(_walk_matches(topdir, file_re, prune_re))
+    pool = ThreadPool(nthreads)
+    try:
+        for matched_files in pool.imap_unordered(walk_subtree, subdirs):
+            for filename in matched_files:
+                yield filename
+    finally:
+        pool.close()
+        pool.join()
 
 
 
@@ -296,6 +529,26 @@ def get_hostname():
 
 
 
+def get_scheduler():
+    """
+    # --------------------------------------------------------------------------
+    # Return the batch scheduler: SLURM (DISCOVER), PBS (PLEIADES) or LOCAL
+    # (see local_sched.py) anywhere else. $EXTDATA_SCHEDULER overrides it,
+    # e.g. SLURM with the stand-ins of fake_sched/ on PATH
+    # --------------------------------------------------------------------------
+    """
+
+    SCHED = os.environ.get('EXTDATA_SCHEDULER')
+    if SCHED:
+        SCHED = SCHED.upper()
+        if SCHED not in ['SLURM', 'PBS', 'LOCAL']:
+            raise Exception('EXTDATA_SCHEDULER [%s] not recognized' % SCHED)
+        return SCHED
+
+    return {'DISCOVER': 'SLURM', 'PLEIADES': 'PBS'}.get(get_hostname(), 'LOCAL')
+
+
+
 def mkdir_p(path):
     """
     # --------------------------------------------------------------------------
@@ -473,6 +726,9 @@ def source_g5_modules(g5_modules, fout=None):
     # Input:
     #    g5_modules: full path of g5_modules
     #          fout: handle of (open) log file, if None - set to sys.stdout
+    # Output:
+    #    a copy of the resulting environment, to pass to the processes of
+    #    the build (os.environ may be changed by the next call)
     #---------------------------------------------------------------------------
     """
 
@@ -483,6 +739,29 @@ def source_g5_modules(g5_modules, fout=None):
     if not os.path.isfile(g5_modules):
         raise Exception('g5_modules does not exist')
 
+    with _G5_LOCK:
+        if not _G5_ENV: _G5_ENV.update({'base': dict(os.environ), 'last': None})
+
+        # sourced before (and unchanged since): re-apply what it did to the
+        # environment instead of querying csh and loading the modules again.
+        # Either way, what another build's g5_modules set is undone first
+        # -----------------------------------------------------------------
+        G5_KEY = (os.path.realpath(g5_modules), os.path.getmtime(g5_modules))
+        if G5_KEY in _G5_SOURCED:
+            _g5_apply(G5_KEY)
+            writemsg(' %s: Reusing environment\n' % os.path.basename(g5_modules), fout)
+        else:
+            _g5_apply(None)
+            _source_g5_modules(g5_modules, G5_KEY, fout)
+        return dict(os.environ)
+
+
+def _source_g5_modules(g5_modules, G5_KEY, fout):
+
+    # the actual sourcing of source_g5_modules, recording its changes under
+    # G5_KEY
+    ENV_BEFORE = dict(os.environ)
+
 
     # part of the command to run
     # --------------------------
@@ -592,6 +871,10 @@ def source_g5_modules(g5_modules, fout=None):
         os.environ['ESMA_FC'] = 'pgfortran'
         os.environ['PGI_LOCALRC'] = '/discover/swdev/mathomp4/PGILocalRC/linux86-64/17.10/bin/localrc.60300'
         writemsg(' Setting PGI_LOCALRC to %s\n' % os.environ['PGI_LOCALRC'], fout)
+
+    _G5_SOURCED[G5_KEY] = (dict([(key, val) for key, val in os.environ.items() if ENV_BEFORE.get(key) != val]),
+                           [key for key in ENV_BEFORE if key not in os.environ])
+    _G5_ENV['last'] = G5_KEY
         
 
 #     # check to see ESMA_FC is set to pgfortran
@@ -782,8 +1065,7 @@ def build_parallel(SRC_DIR, GPU=False, PGI=False, DEBUG=False, fout=None):
 
     # wait for job to finish
     # ----------------------
-    while (not job_completed(JOB_ID)):
-        time.sleep(30) # seconds
+    job_tracker.wait_for_job(JOB_ID, get_scheduler())
 
     eNd = time.time()
 
@@ -960,7 +1242,7 @@ def build_pinstall(SRC_DIR, GPU=False, DEBUG=False, fout=None):
 
     return True
 
-def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
+def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None, CACHE_DIR=None, JOBS=None, LAUNCHER=None, TAG=None):
     """
     #---------------------------------------------------------------------------
     # def build_cmake_developer(SRC_DIR, fout):
@@ -968,9 +1250,16 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
     # Build model using make with cmake 
     #
     # Inputs:
-    #  SRC_DIR: source dir
-    #    DEBUG: build with debugging
-    #     fout: (open) file handle, if None set to sys.stdout
+    #    SRC_DIR: source dir
+    #      DEBUG: build with debugging
+    #       fout: (open) file handle, if None set to sys.stdout
+    #  CACHE_DIR: build cache (see build_cache_key), if None use
+    #             $EXTDATA_BUILD_CACHE; no caching if neither is set
+    #       JOBS: make jobs, if None see get_build_jobs
+    #   LAUNCHER: compiler launcher (e.g. ccache), if None use
+    #             $EXTDATA_COMPILER_LAUNCHER; skipped if not on PATH
+    #        TAG: suffix of the build/install dir names, so that builds of
+    #             the same type (e.g. GNU and Intel) can run concurrently
     #
     #---------------------------------------------------------------------------
     """
@@ -981,10 +1270,6 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
     # --------------------
     HOST = get_hostname()
 
-    # get current dir
-    # ---------------
-    CWD = os.getcwd()
-
     # Are we running with Debug or Release?
     # -------------------------------------
     if DEBUG:
@@ -993,28 +1278,41 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
         BUILD_TYPE="Release"
     BUILD_DIR_NAME='build-'+BUILD_TYPE
     INSTALL_DIR_NAME='install-'+BUILD_TYPE
+    if TAG:
+        BUILD_DIR_NAME += '-'+TAG
+        INSTALL_DIR_NAME += '-'+TAG
 
     BUILD_DIR = os.path.join(SRC_DIR,BUILD_DIR_NAME)
     print("BUILD_DIR: [%s]" % BUILD_DIR)
     mkdir_p(BUILD_DIR)
-    os.chdir(BUILD_DIR)
     
     INSTALL_DIR = os.path.join(SRC_DIR,INSTALL_DIR_NAME)
     print("INSTALL_DIR: [%s]" % INSTALL_DIR)
 
-    writemsg(' Building model (cmake - %s)...' % BUILD_TYPE, fout)
+    writemsg(' Building model (cmake - %s)...' % (BUILD_DIR_NAME[6:]), fout)
     
     # source g5_modules
     # -----------------
+    # (os.environ is shared by concurrent builds, so each build works
+    # on the snapshot taken right after sourcing)
     G5_MODULES = SRC_DIR + os.sep + '@env' + os.sep + 'g5_modules'
     #print("G5_MODULES: [%s]" % G5_MODULES)
-    source_g5_modules(G5_MODULES)
+    ENV = source_g5_modules(G5_MODULES)
 
     # Get BASEDIR
     # -----------
-    BASEDIR = os.environ['BASEDIR']
+    BASEDIR = ENV['BASEDIR']
     #print(("BASEDIR: [%s]" % BASEDIR))
 
+    # reuse the installed tree of an identical build
+    # ----------------------------------------------
+    CACHE_DIR = CACHE_DIR or ENV.get('EXTDATA_BUILD_CACHE')
+    CACHE_KEY = None
+    if CACHE_DIR:
+        CACHE_KEY = build_cache_key(SRC_DIR, BUILD_TYPE+('-'+TAG if TAG else ''), G5_MODULES, GNU)
+    if CACHE_KEY and fetch_cached_build(CACHE_DIR, CACHE_KEY, INSTALL_DIR, fout):
+        return True
+
     sTart = time.time()
 
     # Run cmake
@@ -1038,10 +1336,20 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
 
     cmd.append('-DCMAKE_BUILD_TYPE=%s' % BUILD_TYPE)
     cmd.append('-DCMAKE_INSTALL_PREFIX=%s' % INSTALL_DIR)
+    if CACHE_KEY:
+        # cached trees are reused under other install prefixes
+        cmd.append('-DCMAKE_INSTALL_RPATH=$ORIGIN/../lib')
+
+    # compiler launcher (ccache passes unsupported compilers through)
+    # ----------------------------------------------------------------
+    LAUNCHER = LAUNCHER or ENV.get('EXTDATA_COMPILER_LAUNCHER')
+    if LAUNCHER and is_tool(LAUNCHER):
+        for LANG in ['C', 'CXX', 'Fortran']:
+            cmd.append('-DCMAKE_%s_COMPILER_LAUNCHER=%s' % (LANG, LAUNCHER))
 
     #print(("CMD: [%s]" % cmd))
 
-    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG)
+    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG, cwd=BUILD_DIR, env=ENV)
     rtrnCode = run.wait()
     if rtrnCode !=0:
         raise Exception('cmake failed')
@@ -1053,18 +1361,19 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
 
     # MAT We can't do this until discover-cron is SP3 or higher as
     #     it doesn't have libraries needed to link with MPT
-    cmd = ['make', '-j6', 'install']
+    if not JOBS: JOBS = get_build_jobs()
+    cmd = ['make', '-j%d' % JOBS, 'install']
 
     #build_line = " 'cd %s; source ../src/g5_modules;  make -j6 install'" % BUILD_DIR
     #command_line = "ssh discover17 -t" + build_line
     #cmd = shlex.split(command_line)
 
-    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG)
+    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG, cwd=BUILD_DIR, env=ENV)
     rtrnCode = run.wait()
     if rtrnCode !=0:
         BLD_LOG2 = open(BUILD_DIR + '/log.makeinstall2', 'w')
 
-        run2 = sp.Popen(cmd, stdout=BLD_LOG2, stderr=BLD_LOG2)
+        run2 = sp.Popen(cmd, stdout=BLD_LOG2, stderr=BLD_LOG2, cwd=BUILD_DIR, env=ENV)
         rtrnCode2 = run2.wait()
         if rtrnCode2 != 0:
             raise Exception('make install failed')
@@ -1073,15 +1382,200 @@ def build_cmake_github(SRC_DIR, DEBUG=False, GNU=False, fout=None):
     
     eNd = time.time()
 
-    writemsg('done. Time taken: %d s.\n\n' % (eNd-sTart), fout)
+    writemsg('done (%s, %d jobs). Time taken: %d s.\n\n' % (BUILD_DIR_NAME[6:], JOBS, eNd-sTart), fout)
 
-    # back to CWD
-    # -----------
-    os.chdir(CWD)
+    if CACHE_KEY:
+        store_cached_build(CACHE_DIR, CACHE_KEY, INSTALL_DIR, fout)
 
     return True
 
-def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
+def get_build_jobs(MEM_PER_JOB=2.0, MAX_JOBS=None):
+    """
+    # --------------------------------------------------------------------------
+    # number of make jobs for this node: one per core available to this
+    # process, but no more than fit in the available memory at MEM_PER_JOB
+    # GB each. $EXTDATA_BUILD_JOBS overrides
+    # --------------------------------------------------------------------------
+    """
+
+    if os.environ.get('EXTDATA_BUILD_JOBS'):
+        return max(1, int(os.environ['EXTDATA_BUILD_JOBS']))
+
+    try:
+        NJOBS = len(os.sched_getaffinity(0))
+    except AttributeError:
+        NJOBS = multiprocessing.cpu_count()
+
+    try:
+        fin = open('/proc/meminfo', 'r')
+        for line in fin:
+            if line.startswith('MemAvailable:'):
+                MEM_GB = int(line.split()[1])/(1024.0*1024.0)
+                NJOBS = min(NJOBS, int(MEM_GB/MEM_PER_JOB))
+                break
+        fin.close()
+    except (IOError, OSError, ValueError):
+        pass
+
+    if MAX_JOBS: NJOBS = min(NJOBS, MAX_JOBS)
+    return max(1, NJOBS)
+
+def build_configs(SRC_DIR, CONFIGS, fout=None, CACHE_DIR=None, LAUNCHER=None):
+    """
+    # --------------------------------------------------------------------------
+    # build several configurations of SRC_DIR concurrently, splitting the
+    # make jobs (see get_build_jobs) between them. Each configuration has its
+    # own build/install dir and logs; they share the build cache and the
+    # compiler launcher's cache
+    #
+    # Inputs:
+    #     SRC_DIR: source dir
+    #     CONFIGS: list of (DEBUG, GNU) pairs, e.g. [(False, False),
+    #              (True, False), (False, True)]
+    # Output:
+    #     OrderedDict with config name (e.g. 'Release-GNU') as key and
+    #     (success, time taken (s)) as val
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    JOBS = max(1, get_build_jobs() // len(CONFIGS))
+
+    def build_one(config):
+        DEBUG, GNU = config
+        NAME = ('Debug' if DEBUG else 'Release') + ('-GNU' if GNU else '')
+        sTart = time.time()
+        try:
+            build_cmake_github(SRC_DIR, DEBUG, GNU, fout, CACHE_DIR, JOBS, LAUNCHER, 'GNU' if GNU else None)
+            SUCCESS = True
+        except Exception as exc:
+            writemsg(' Build %s failed: %s\n' % (NAME, exc), fout)
+            SUCCESS = False
+        return (NAME, (SUCCESS, time.time()-sTart))
+
+    pool = ThreadPool(len(CONFIGS))
+    results = OrderedDict(pool.map(build_one, CONFIGS))
+    pool.close()
+    pool.join()
+
+    writemsg('\n %-14s %8s %10s\n' % ('config', 'status', 'time (s)'), fout)
+    for NAME in results:
+        SUCCESS, TIME = results[NAME]
+        writemsg(' %-14s %8s %10d\n' % (NAME, 'ok' if SUCCESS else 'FAILED', TIME), fout)
+    return results
+
+def _git_clean_head(path):
+
+    # commit of the checkout at path, None if it is no git checkout or has
+    # uncommitted changes
+    run = sp.Popen(['git', 'rev-parse', 'HEAD'], cwd=path, stdout=sp.PIPE, stderr=sp.PIPE)
+    commit = run.communicate()[0].decode().strip()
+    if run.returncode != 0 or not commit: return None
+    run = sp.Popen(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=path,
+                   stdout=sp.PIPE, stderr=sp.PIPE)
+    if run.communicate()[0].strip() or run.returncode != 0: return None
+    return commit
+
+def _mepo_components(SRC_DIR):
+
+    # paths (relative to SRC_DIR) of the sub-repos mepo cloned into SRC_DIR,
+    # from the local: entries of components.yaml. [] if SRC_DIR is no mepo
+    # fixture, None if it is one but its components cannot be read
+    components_yaml = os.path.join(SRC_DIR, 'components.yaml')
+    if not os.path.isfile(components_yaml):
+        return None if os.path.isdir(os.path.join(SRC_DIR, '.mepo')) else []
+    try:
+        fin = open(components_yaml, 'r'); lines = fin.readlines(); fin.close()
+    except (IOError, OSError):
+        return None
+    paths = []
+    for line in lines:
+        m = re.match(r'\s+local:\s*[\'"]?([^\'"#\s]+)', line)
+        if not m: continue
+        path = os.path.normpath(m.group(1))
+        if path != '.': paths.append(path)
+    return sorted(set(paths))
+
+def build_cache_key(SRC_DIR, BUILD_TYPE, G5_MODULES, GNU=False):
+    """
+    # --------------------------------------------------------------------------
+    # key of a build in the build cache: the git commit of SRC_DIR and of each
+    # sub-repo mepo cloned into it, the build type, the compiler (ESMA_FC) and
+    # the sha1 of g5_modules. None (do not cache) if SRC_DIR or one of the
+    # sub-repos is not a git checkout or has uncommitted changes, or if the
+    # sub-repos cannot be determined
+    # --------------------------------------------------------------------------
+    """
+
+    commit = _git_clean_head(SRC_DIR)
+    if not commit: return None
+    components = _mepo_components(SRC_DIR)
+    if components is None: return None
+    sub_commits = []
+    for path in components:
+        if not os.path.isdir(os.path.join(SRC_DIR, path)): return None
+        sub_commit = _git_clean_head(os.path.join(SRC_DIR, path))
+        if not sub_commit: return None
+        sub_commits.append('%s %s' % (path, sub_commit))
+    if sub_commits:
+        commit += '-' + hashlib.sha1('\n'.join(sub_commits).encode()).hexdigest()[:12]
+
+    compiler = os.environ.get('ESMA_FC', 'gfortran' if GNU else 'ifort')
+    g5_hash = 'none'
+    if os.path.isfile(G5_MODULES):
+        fin = open(G5_MODULES, 'rb'); g5_hash = hashlib.sha1(fin.read()).hexdigest(); fin.close()
+    return '-'.join([commit, BUILD_TYPE, compiler, g5_hash[:12]])
+
+def fetch_cached_build(CACHE_DIR, KEY, INSTALL_DIR, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # copy the cached install tree for KEY to INSTALL_DIR. Return False if the
+    # cache has no entry for KEY
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    CACHED = os.path.join(CACHE_DIR, KEY)
+    if not os.path.isdir(CACHED): return False
+
+    writemsg(' Using cached build [%s]...' % KEY, fout)
+    if os.path.isdir(INSTALL_DIR):
+        shutil.rmtree(INSTALL_DIR)
+    shutil.copytree(CACHED, INSTALL_DIR, symlinks=True)
+    writemsg('done.\n', fout)
+    return True
+
+def store_cached_build(CACHE_DIR, KEY, INSTALL_DIR, fout=None):
+    """
+    # --------------------------------------------------------------------------
+    # store INSTALL_DIR in the build cache under KEY. The tree is copied next
+    # to its final place and renamed, so a concurrent reader never sees a
+    # partial entry; if another build stored KEY first, that entry is kept
+    # --------------------------------------------------------------------------
+    """
+
+    if not fout: fout = sys.stdout
+
+    CACHED = os.path.join(CACHE_DIR, KEY)
+    if os.path.isdir(CACHED): return
+
+    writemsg(' Storing build in cache [%s]...' % KEY, fout)
+    mkdir_p(CACHE_DIR)
+    TMP_DIR = tempfile.mkdtemp(prefix='.'+KEY+'.', dir=CACHE_DIR)
+    shutil.copytree(INSTALL_DIR, os.path.join(TMP_DIR, 'install'), symlinks=True)
+    fmeta = open(os.path.join(TMP_DIR, 'install', '.build_cache.json'), 'w')
+    json.dump({'key': KEY, 'stored': datetime.now().isoformat(), 'install_dir': INSTALL_DIR}, fmeta)
+    fmeta.close()
+    try:
+        os.rename(os.path.join(TMP_DIR, 'install'), CACHED)
+    except OSError:
+        pass
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+    writemsg('done.\n', fout)
+
+def build_cmaketests(SRC_DIR, DEBUG=False, fout=None, JOBS=None):
     """
     #---------------------------------------------------------------------------
     # def build_cmaketests(SRC_DIR, fout):
@@ -1091,6 +1585,7 @@ def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # Inputs:
     #  SRC_DIR: source dir
     #     fout: (open) file handle, if None set to sys.stdout
+    #     JOBS: make jobs, if None see get_build_jobs
     #
     #---------------------------------------------------------------------------
     """
@@ -1101,10 +1596,6 @@ def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # --------------------
     HOST = get_hostname()
 
-    # get current dir
-    # ---------------
-    CWD = os.getcwd()
-
     # Are we running with Debug or Release?
     # -------------------------------------
     if DEBUG:
@@ -1117,7 +1608,6 @@ def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # ----------------------------------------------------------------
     BUILD_DIR = os.path.join(SRC_DIR,BUILD_DIR_NAME)
     mkdir_p(BUILD_DIR)
-    os.chdir(BUILD_DIR)
 
     writemsg(' Building cmake tests...', fout)
     
@@ -1140,9 +1630,10 @@ def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # ----------
     BLD_LOG = open(BUILD_DIR + '/log.maketests', 'w')
 
-    cmd = ['make', 'tests']
+    if not JOBS: JOBS = get_build_jobs()
+    cmd = ['make', '-j%d' % JOBS, 'tests']
 
-    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG)
+    run = sp.Popen(cmd, stdout=BLD_LOG, stderr=BLD_LOG, cwd=BUILD_DIR)
     rtrnCode = run.wait()
     if rtrnCode !=0:
         raise Exception('make tests failed')
@@ -1152,22 +1643,26 @@ def build_cmaketests(SRC_DIR, DEBUG=False, fout=None):
 
     writemsg('done. Time taken: %d s.\n\n' % (eNd-sTart), fout)
 
-    # back to CWD
-    # -----------
-    os.chdir(CWD)
-
     return True
 
-def run_cmaketests(SRC_DIR, DEBUG=False, fout=None):
+def run_cmaketests(SRC_DIR, DEBUG=False, fout=None, JOBS=None, TIMEOUT=1500, RESULT_FILE=None):
     """
     #---------------------------------------------------------------------------
     # def run_cmaketests(SRC_DIR, fout):
     #
-    # Run cmake tests
+    # Run cmake tests in parallel. ctest schedules the tests that took
+    # longest in earlier runs (Testing/Temporary/CTestCostData.txt of the
+    # build dir) first. Per-test results are read from the ctest dashboard
+    # xml (see parse_ctest_xml), written as json and summarized to fout;
+    # the full output stays in log.runtests of the build dir
     #
     # Inputs:
-    #  SRC_DIR: source dir
-    #     fout: (open) file handle, if None set to sys.stdout
+    #      SRC_DIR: source dir
+    #         fout: (open) file handle, if None set to sys.stdout
+    #         JOBS: tests run at once, if None see get_build_jobs
+    #      TIMEOUT: per-test timeout (s)
+    #  RESULT_FILE: json file of the results, if None
+    #               BUILD_DIR/ctest_results.json
     #
     #---------------------------------------------------------------------------
     """
@@ -1178,10 +1673,6 @@ def run_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # --------------------
     HOST = get_hostname()
 
-    # get current dir
-    # ---------------
-    CWD = os.getcwd()
-
     # Are we running with Debug or Release?
     # -------------------------------------
     if DEBUG:
@@ -1194,7 +1685,6 @@ def run_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # ----------------------------------------------------------------
     BUILD_DIR = os.path.join(SRC_DIR,BUILD_DIR_NAME)
     mkdir_p(BUILD_DIR)
-    os.chdir(BUILD_DIR)
     
     writemsg(' Running cmake tests...', fout)
     
@@ -1217,32 +1707,75 @@ def run_cmaketests(SRC_DIR, DEBUG=False, fout=None):
     # ---------
     RUN_LOG = open(BUILD_DIR + '/log.runtests', 'w')
 
-    cmd = ['ctest', '-V']
+    if not JOBS: JOBS = get_build_jobs(MEM_PER_JOB=1.0)
+    cmd = ['ctest', '-V', '-j%d' % JOBS, '--timeout', str(TIMEOUT), '-T', 'Test', '--no-compress-output']
 
-    run = sp.Popen(cmd, stdout=RUN_LOG, stderr=RUN_LOG)
+    run = sp.Popen(cmd, stdout=RUN_LOG, stderr=RUN_LOG, cwd=BUILD_DIR)
     rtrnCode = run.wait()
     RUN_LOG.close()
     eNd = time.time()
 
     writemsg('done. Time taken: %d s.\n\n' % (eNd-sTart), fout)
 
-    writemsg('\n',fout)
-
-    with open(BUILD_DIR + '/log.runtests', 'r') as RUN_LOG:
-        for line in RUN_LOG:
-            writemsg("  %s" % line, fout)
-
+    # results
+    # -------
+    RESULTS = parse_ctest_xml(BUILD_DIR)
+    if not RESULT_FILE: RESULT_FILE = os.path.join(BUILD_DIR, 'ctest_results.json')
+    FRES = open(RESULT_FILE, 'w')
+    json.dump({'build_dir': BUILD_DIR, 'jobs': JOBS, 'time': eNd-sTart, 'tests': RESULTS}, FRES, indent=2)
+    FRES.close()
+
+    FAILED = [test for test in RESULTS if test['status'] != 'passed']
+    writemsg(' %d tests, %d failed, results in [%s]\n' % (len(RESULTS), len(FAILED), RESULT_FILE), fout)
+    writemsg(' Slowest tests:\n', fout)
+    for test in sorted(RESULTS, key=lambda test: -test['time'])[:10]:
+        writemsg('  %8.1f s  %-8s %s\n' % (test['time'], test['status'], test['name']), fout)
+    for test in FAILED:
+        writemsg('  FAILED: %s (%s)\n' % (test['name'], test['reason'] or test['status']), fout)
     writemsg('\n',fout)
 
     if rtrnCode !=0:
         raise Exception('ctest failed')
 
-    # back to CWD
-    # -----------
-    os.chdir(CWD)
-
     return True
 
+def parse_ctest_xml(BUILD_DIR):
+    """
+    # --------------------------------------------------------------------------
+    # read the per-test results of the last 'ctest -T Test' run in BUILD_DIR
+    # (Testing/<tag>/Test.xml)
+    #
+    # Output:
+    #     list of dicts with keys name, status ('passed', 'failed',
+    #     'notrun'), time (s) and reason (e.g. 'Timeout', or None), in the
+    #     order ctest lists them. Empty if there is no Test.xml
+    # --------------------------------------------------------------------------
+    """
+
+    import xml.etree.ElementTree as ET
+
+    TAG_FILE = os.path.join(BUILD_DIR, 'Testing', 'TAG')
+    if not os.path.isfile(TAG_FILE): return []
+    fin = open(TAG_FILE, 'r'); TAG = fin.readline().strip(); fin.close()
+    TEST_XML = os.path.join(BUILD_DIR, 'Testing', TAG, 'Test.xml')
+    if not os.path.isfile(TEST_XML): return []
+
+    RESULTS = []
+    for test in ET.parse(TEST_XML).getroot().iter('Test'):
+        if 'Status' not in test.attrib: continue
+        measurements = {}
+        for measurement in test.iter('NamedMeasurement'):
+            measurements[measurement.get('name')] = (measurement.findtext('Value') or '').strip()
+        try:
+            DURATION = float(measurements.get('Execution Time', 0.0))
+        except ValueError:
+            DURATION = 0.0
+        REASON = measurements.get('Exit Code') or measurements.get('Completion Status')
+        if REASON == 'Completed': REASON = None
+        RESULTS.append({'name': test.findtext('Name'), 'status': test.get('Status'),
+                        'time': DURATION, 'reason': REASON})
+    return RESULTS
+
 def check_bld(SRC_DIR, MODTYP, CVS=False, OLDLDAS=False, DEBUG=False, fout=None):
     """
     # --------------------------------------------------------------------------
@@ -1272,6 +1805,8 @@ def check_bld(SRC_DIR, MODTYP, CVS=False, OLDLDAS=False, DEBUG=False, fout=None)
                      BIN_DIR + '/oiqcbufr.x',    BIN_DIR + '/mkiau.x',
                      BIN_DIR + '/GEOSgcmPert.x', BIN_DIR + '/mkiau.x',
                      BIN_DIR + '/g5_modules']
+    elif MODTYP=='MAPL':
+        files2chk = [BIN_DIR + '/ExtDataDriver.x']
     elif MODTYP=='LDAS':
         if OLDLDAS:
            files2chk = [BIN_DIR + '/LDASsa_mpi.x',
@@ -1387,14 +1922,14 @@ def submit_job(JOB_SCRPT, account=None, qdbg=None, fout=None):
 
     #print 'JOB_SCRPT:', JOB_SCRPT
 
-    HOST = get_hostname()
+    SCHED = get_scheduler()
     if not fout: fout = sys.stdout
     if not os.path.isfile(JOB_SCRPT):
         raise Exception('job script [%s] does not exist' % JOB_SCRPT)
 
     _account =''
     if account is not None:
-        if HOST == 'DISCOVER':
+        if SCHED == 'SLURM':
             _account= '--account='+account
 
     # current dir and job dir
@@ -1407,28 +1942,31 @@ def submit_job(JOB_SCRPT, account=None, qdbg=None, fout=None):
     # --------------------------------------------
     os.chdir(JOB_DIR)
     writemsg(' Submitting job...', fout)
-    if HOST == 'DISCOVER':
+    if SCHED == 'SLURM':
         if qdbg:
             cmd = ['sbatch',_account, '--qos=debug', '--time=1:00:00', JOB_SCRPT]
             #cmd = ['sbatch', '--time=1:00:00', JOB_SCRPT]
         else:
             cmd = ['sbatch',_account, JOB_SCRPT]
-    elif HOST=='PLEIADES':
+    elif SCHED=='PBS':
         if qdbg:
             cmd = ['qsub', '-q', 'devel', '-l', 'walltime=1:00:00', JOB_SCRPT]
             #cmd = ['qsub', '-l', 'walltime=2:00:00', JOB_SCRPT]
         else:
             cmd = ['qsub', JOB_SCRPT]
-    else: 
-        raise Exception('HOST [%s] not recognized' % HOST)
+    else:
+        cmd = None
     #print 'cmd:', ' '.join(cmd)
-    run = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
-    output = run.communicate()
-    rtrnCode = run.wait()
-    if rtrnCode !=0:
-        print('0:'); print(output[0]); print('1:'); print(output[1])
-        raise Exception('qsub [%s] failed' % JOB_SCRPT.split(os.sep)[-1])
-    JOB_ID = output[0].split()[-1].strip()
+    if SCHED == 'LOCAL':
+        JOB_ID = local_sched.submit(os.path.join(JOB_DIR, os.path.basename(JOB_SCRPT)))
+    else:
+        run = sp.Popen([c for c in cmd if c], stdout=sp.PIPE, stderr=sp.PIPE)
+        output = run.communicate()
+        rtrnCode = run.wait()
+        if rtrnCode !=0:
+            print('0:'); print(output[0]); print('1:'); print(output[1])
+            raise Exception('qsub [%s] failed' % JOB_SCRPT.split(os.sep)[-1])
+        JOB_ID = output[0].decode().split()[-1].strip()
     tstart = datetime.now().strftime('%Y/%m/%d, %H:%M:%S')
     writemsg('done. [%s, %s]\n' % (JOB_ID, tstart), fout)
     os.chdir(CWD)
@@ -1436,8 +1974,7 @@ def submit_job(JOB_SCRPT, account=None, qdbg=None, fout=None):
     # wait for job to complete
     # ------------------------
     writemsg(' Waiting for job to complete...', fout)
-    while (not job_completed(JOB_ID)):
-        time.sleep(30) # seconds
+    job_tracker.wait_for_job(JOB_ID, SCHED)
     tend = datetime.now().strftime('%Y/%m/%d, %H:%M:%S')
     writemsg('completed. [%s]\n' % tend, fout)
 
@@ -2299,43 +2836,10 @@ def job_completed(JOB_ID, fout=None):
     # ------------------------------------------------------------
     """
 
-    HOST = get_hostname()
-
-    if HOST == 'DISCOVER':
-        # slurm
-        cmd = 'sacct --format state -n -j %s.batch' % JOB_ID
-        run = sp.Popen(cmd.split(), stdout=sp.PIPE, stderr=sp.PIPE)
-        output = run.communicate()
-        rtrnCode = run.wait()
-        if rtrnCode != 0:
-            print('0:'); print(output[0]); print('1:'); print(output[1])
-            raise Exception('run (sacct --format state -n -j %s.batch) failed' % JOB_ID)
-        status = output[0].strip()
-        if status=='CANCELLED': raise Exception('Job was CANCELLED')
-        elif status=='FAILED': raise Exception('Job FAILED')
-        if status=='COMPLETED': return True
-        else: return False
-
+    state = job_tracker.query_states([JOB_ID])[JOB_ID]
+    if state in job_tracker.FAILED_STATES: raise Exception('Job %s' % state)
+    return state is not None
 
-    elif HOST=='PLEIADES':
-        cmd1 = ('qstat -f -x %s' % JOB_ID).split()
-        cmd2 = 'grep job_state'.split()
-        run1 = sp.Popen(cmd1, stdout=sp.PIPE, stderr=sp.PIPE)
-        rtrnCode = run1.wait()
-        if rtrnCode != 0: raise Exception('run1 (qstat -f %s) failed' % JOB_ID)
-        run2 = sp.Popen(cmd2, stdin=run1.stdout,stdout=sp.PIPE)
-        rtrnCode = run2.wait()
-        if rtrnCode != 0: raise Exception('run2 (grep job_state) failed')
-        run1.stdout.close()
-        output = run2.communicate()
-        if output[1]:
-            print('0:'); print(output[0]); print('1:'); print(output[1])
-            raise Exception('utils:job_completed_script - something wrong')
-        status = output[0].split('=')[1].strip()
-        if status=='F': return True
-        else: return False
-    else:
-        raise Exception('host [%s] not recognized' % HOST)
 
 def git_clone(GITREPO, DIR=None, GITTAG=None, fout=None):
     """
@@ -2368,6 +2872,8 @@ def git_clone(GITREPO, DIR=None, GITTAG=None, fout=None):
         cmd = ['/gpfsm/dulocal/sles11/other/SLES11.3/git/2.21.0/libexec/git-core/git', 'clone']
     elif HOST == 'PLEIADES':
         cmd = ['/nobackup/gmao_SIteam/git/git-2.21.0/bin/git', 'clone']
+    else:
+        cmd = ['git', 'clone']
 
     if GITTAG: cmd.extend(['-b', ''.join(GITTAG)])
 
@@ -2543,10 +3049,184 @@ def useOpsGOCART(RUN_DIR, fout=None):
 
     writemsg('done.\n', fout)
 
+# digests of already hashed files, keyed by (device, inode, size, mtime)
+# --------------------------------------------------------------------------
+_DIGEST_CACHE = {}
+_DIGEST_CACHE_LOCK = threading.Lock()
+
+
+def _scan_dir(path):
+    """
+    # --------------------------------------------------------------------------
+    # List the entries of 'path' (following symlinks like filecmp.dircmp)
+    #
+    # Input:
+    #          path: directory to list
+    # Output:
+    #       entries: a dict with entry name as key and (kind, stat) as val,
+    #                kind is one of 'dir', 'file' or 'funny'. stat is only
+    #                filled in for files
+    # --------------------------------------------------------------------------
+    """
+
+    entries = {}
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(path):
+            try:
+                if entry.is_dir():
+                    entries[entry.name] = ('dir', None)
+                elif entry.is_file():
+                    entries[entry.name] = ('file', entry.stat())
+                else:
+                    entries[entry.name] = ('funny', None)
+            except OSError:
+                entries[entry.name] = ('funny', None)
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                entries[name] = ('funny', None)
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                entries[name] = ('dir', None)
+            elif stat.S_ISREG(st.st_mode):
+                entries[name] = ('file', st)
+            else:
+                entries[name] = ('funny', None)
+    return entries
+
+
+def _file_digest(path, st):
+    """
+    # --------------------------------------------------------------------------
+    # Return the sha1 digest of file 'path' whose os.stat result is 'st'.
+    # Digests are cached on (device, inode, size, mtime) so that unchanged
+    # files are read only once per process
+    # --------------------------------------------------------------------------
+    """
+
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+    with _DIGEST_CACHE_LOCK:
+        digest = _DIGEST_CACHE.get(key)
+    if digest is None:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _DIGEST_CACHE_LOCK:
+            _DIGEST_CACHE[key] = digest
+    return digest
+
+
+def _compare_large_files(args):
+    """
+    # --------------------------------------------------------------------------
+    # ThreadPool worker for compare_dir_trees: compare two files by digest.
+    # Returns None if equal, else a (relpath, reason, detail) difference
+    # --------------------------------------------------------------------------
+    """
+
+    relpath, path1, st1, path2, st2 = args
+    try:
+        if _file_digest(path1, st1) != _file_digest(path2, st2):
+            return (relpath, 'content', 'sha1 differs')
+    except (IOError, OSError) as exc:
+        return (relpath, 'error', str(exc))
+    return None
+
+
+def compare_dir_trees(dir1, dir2, hash_threshold=1<<20, nthreads=None):
+    """
+    # --------------------------------------------------------------------------
+    # Compare two directories recursively. Files are assumed to be equal if
+    # their names, sizes and contents are equal. Files whose sizes differ are
+    # not read at all, files smaller than 'hash_threshold' bytes are compared
+    # byte by byte and larger files are compared by (cached) sha1 digests
+    # computed in 'nthreads' worker threads
+    #
+    # Inputs:
+    #               dir1: first directory path
+    #               dir2: second directory path
+    #     hash_threshold: size (bytes) above which files are hashed
+    #           nthreads: number of hashing threads, if None use #cpus (max 8)
+    # Output:
+    #        differences: sorted list of (relpath, reason, detail) tuples,
+    #                     reason is one of 'left_only', 'right_only', 'funny',
+    #                     'size', 'content' or 'error'. An empty list means
+    #                     the trees are the same
+    # --------------------------------------------------------------------------
+    """
+
+    differences = []
+    small_files = []
+    large_files = []
+
+    # walk both trees together, prefiltering on type and size
+    # -------------------------------------------------------
+    stack = ['']
+    while stack:
+        reldir = stack.pop()
+        try:
+            entries1 = _scan_dir(os.path.join(dir1, reldir))
+            entries2 = _scan_dir(os.path.join(dir2, reldir))
+        except OSError as exc:
+            differences.append((reldir or os.curdir, 'error', str(exc)))
+            continue
+        for name in set(entries1) | set(entries2):
+            relpath = os.path.join(reldir, name)
+            if name not in entries2:
+                differences.append((relpath, 'left_only', ''))
+                continue
+            if name not in entries1:
+                differences.append((relpath, 'right_only', ''))
+                continue
+            kind1, st1 = entries1[name]
+            kind2, st2 = entries2[name]
+            if kind1 != kind2 or kind1 == 'funny':
+                differences.append((relpath, 'funny', '%s/%s' % (kind1, kind2)))
+            elif kind1 == 'dir':
+                stack.append(relpath)
+            elif st1.st_size != st2.st_size:
+                differences.append((relpath, 'size', '%d/%d' % (st1.st_size, st2.st_size)))
+            else:
+                item = (relpath, os.path.join(dir1, relpath), st1,
+                        os.path.join(dir2, relpath), st2)
+                if st1.st_size < hash_threshold:
+                    small_files.append(item)
+                else:
+                    large_files.append(item)
+
+    # small files: direct comparison
+    # ------------------------------
+    for relpath, path1, st1, path2, st2 in small_files:
+        try:
+            if not filecmp.cmp(path1, path2, shallow=False):
+                differences.append((relpath, 'content', ''))
+        except (IOError, OSError) as exc:
+            differences.append((relpath, 'error', str(exc)))
+
+    # large files: hash in worker threads
+    # -----------------------------------
+    if large_files:
+        if not nthreads: nthreads = min(8, multiprocessing.cpu_count())
+        pool = ThreadPool(min(nthreads, len(large_files)))
+        try:
+            results = pool.map(_compare_large_files, large_files)
+        finally:
+            pool.close()
+            pool.join()
+        differences.extend([result for result in results if result])
+
+    return sorted(differences)
+
+
 def are_dir_trees_equal(dir1, dir2):
     """
     Compare two directories recursively. Files in each directory are
     assumed to be equal if their names and contents are equal.
+    See compare_dir_trees for the list of differences.
 
     @param dir1: First directory path
     @param dir2: Second directory path
@@ -2556,20 +3236,7 @@ def are_dir_trees_equal(dir1, dir2):
         False otherwise.
    """
 
-    dirs_cmp = filecmp.dircmp(dir1, dir2)
-    if len(dirs_cmp.left_only)>0 or len(dirs_cmp.right_only)>0 or \
-        len(dirs_cmp.funny_files)>0:
-        return False
-    (_, mismatch, errors) =  filecmp.cmpfiles(
-        dir1, dir2, dirs_cmp.common_files, shallow=False)
-    if len(mismatch)>0 or len(errors)>0:
-        return False
-    for common_dir in dirs_cmp.common_dirs:
-        new_dir1 = os.path.join(dir1, common_dir)
-        new_dir2 = os.path.join(dir2, common_dir)
-        if not are_dir_trees_equal(new_dir1, new_dir2):
-            return False
-    return True
+    return len(compare_dir_trees(dir1, dir2)) == 0
 
 
 def useSingleNode(RUN_DIR, fout=None):
@@ -2610,7 +3277,7 @@ def is_tool(name):
 
     return find_executable(name) is not None
 
-def nc4_compare(bas_file, cur_file, debug=None, toolToUse='nccmp', AllowNan=None):
+def nc4_compare(bas_file, cur_file, debug=None, toolToUse='nccmp', AllowNan=None, tolerance=None):
     """
     # --------------------------------------------------------------------------
     # Compare two netcdf files
@@ -2619,6 +3286,7 @@ def nc4_compare(bas_file, cur_file, debug=None, toolToUse='nccmp', AllowNan=None
     #         bas_file: baseline file
     #         cur_file: current file
     #            debug: debug prints
+    #        tolerance: absolute tolerance of the data (nccmp only)
     # Output:
     #         0 for success, 1 for failure
     # --------------------------------------------------------------------------
@@ -2627,14 +3295,14 @@ def nc4_compare(bas_file, cur_file, debug=None, toolToUse='nccmp', AllowNan=None
     if 'cdo' in toolToUse and is_tool('cdo'):
         rc = cdo_compare(bas_file, cur_file, diff='cdo', debug=debug)
     elif 'nccmp' in toolToUse and is_tool('nccmp'):
-        rc = nccmp_compare(bas_file, cur_file, diff='nccmp', debug=debug, AllowNan=AllowNan)
+        rc = nccmp_compare(bas_file, cur_file, diff='nccmp', debug=debug, AllowNan=AllowNan, tolerance=tolerance)
     else:
         print("Neither nccmp or cdo found in path!!!")
         raise Exception('no nc4 comparator found')
 
     return rc
 
-def nccmp_compare(bas_file, cur_file, diff='nccmp', debug=None, AllowNan=None):
+def nccmp_compare(bas_file, cur_file, diff='nccmp', debug=None, AllowNan=None, tolerance=None):
     """
     # --------------------------------------------------------------------------
     # Compare two netcdf files using nccmp
@@ -2644,6 +3312,7 @@ def nccmp_compare(bas_file, cur_file, diff='nccmp', debug=None, AllowNan=None):
     #         cur_file: current file
     #             diff: differencer
     #            debug: debug prints
+    #        tolerance: absolute tolerance of the data (default: exact)
     # Output:
     #         0 for success, 1 for failure
     # --------------------------------------------------------------------------
@@ -2655,6 +3324,8 @@ def nccmp_compare(bas_file, cur_file, diff='nccmp', debug=None, AllowNan=None):
         cmp_options = '-Bd'
 
     cmd = [diff, cmp_options, bas_file, cur_file]
+    if tolerance:
+        cmd[2:2] = ['-t', str(tolerance)]
     if debug: 
         print("\nUsing", diff)
         print("Running ", cmd)
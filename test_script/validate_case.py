@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+"""
+# ------------------------------------------------------------------------------
+# Preflight checks of ExtData test cases. Only the rc/yaml files of a case
+# are read, so a misconfigured case is caught in milliseconds instead of
+# after its GenerateExports run:
+#
+#      check_cases      CAP.rc CASES (and their ROOT_CF/HIST_CF) exist
+#      check_imports    imports have ExtData rules and History fields
+#      check_templates  ExtData templates/frequencies match History
+#      check_years      the data covers the CAP run times
+#      check_layout     NX*NY matches nproc.rc
+#      validate_case
+# ------------------------------------------------------------------------------
+"""
+
+import argparse, sys, os
+import re
+import time
+
+import utils
+import case_config
+import extdata_convert
+
+# sample values of the template tokens, to match ExtData against History templates
+_TOKEN_SAMPLES = [('%y4', '2004'), ('%m2', '01'), ('%d2', '01'), ('%h2', '00'), ('%n2', '00')]
+_YEAR_RE = re.compile(r'(?<!\d)((?:19|20)\d\d)(?!\d)')
+_ISO_RE = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+
+def parse_comm_args():
+
+    p = argparse.ArgumentParser(description='Check ExtData test cases before running them')
+
+    p.add_argument("--casedir",  dest="case_dir",help='where cases are located')
+    p.add_argument("--cases",  dest="cases",help='file with list of cases')
+
+    args = vars(p.parse_args()) # vars converts to dict
+
+    if not args['case_dir'] or not os.path.isdir(args['case_dir']):
+        raise Exception('case_dir [%s] does not exist' % args['case_dir'])
+    if not args['cases'] or not os.path.isfile(args['cases']):
+        raise Exception('case file [%s] does not exist' % args['cases'])
+
+    return args
+
+
+def _seconds(frequency):
+
+    # HHMMSS (History) or ISO 8601 day/time duration; None for months/years
+    if frequency.isdigit():
+        frequency = frequency.zfill(6)
+        return int(frequency[:-4])*3600 + int(frequency[-4:-2])*60 + int(frequency[-2:])
+    m = _ISO_RE.match(frequency)
+    if not m: return None
+    days, hours, minutes, seconds = [int(n or 0) for n in m.groups()]
+    return ((days*24 + hours)*60 + minutes)*60 + seconds
+
+
+def _template_re(template):
+
+    pattern = re.escape(template)
+    for token, sample in _TOKEN_SAMPLES:
+        pattern = pattern.replace(re.escape(token), r'\d{%d}' % len(sample))
+    return re.compile('^' + pattern + '$')
+
+
+def _template_sample(template):
+
+    for token, sample in _TOKEN_SAMPLES:
+        template = template.replace(token, sample)
+    return template
+
+
+def _years(rows):
+
+    return sorted(set([int(row.split()[0][:4]) for row in rows]))
+
+
+def load_case(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # read what the checks need from the files of a case (see check_cases
+    # for the files that must exist)
+    #
+    # Output:
+    #     dict with keys
+    #        caps: list of dicts (cap, agcm, grid (see get_grid), run_mode,
+    #              run_years, imports) of the CAPs in CASES
+    #     history: OrderedDict with collection as key and dict (file,
+    #              frequency (s), fields) as val, for the GenerateExports CAPs
+    #     entries: list of dicts (config, name, file_var, template,
+    #              frequency (s), years, cycling), one per ExtData rule
+    #     extrap: Ext_AllowExtrap is set
+    #     data_years: [first, last] year of the generated data, or None
+    # --------------------------------------------------------------------------
+    """
+
+    case = {'caps': [], 'history': {}, 'entries': []}
+
+    for cap_file in case_config.get_cap_cases(case_path):
+        values, tables = case_config.read_rc(os.path.join(case_path, cap_file))
+        root_cf = case_config.clean_value(values['ROOT_CF'])
+        hist_cf = case_config.clean_value(values['HIST_CF'])
+        root_name = case_config.clean_value(values.get('ROOT_NAME', 'Root'))
+        agcm_values, agcm_tables = case_config.read_rc(os.path.join(case_path, root_cf))
+        grid = case_config.get_grid(os.path.join(case_path, root_cf), root_name)
+        if 'RUN_TIMES' in tables:
+            run_years = _years(tables['RUN_TIMES'])
+        else:
+            run_years = _years([case_config.clean_value(values['BEG_DATE'])])
+        cap = {'cap': cap_file, 'agcm': root_cf, 'grid': grid,
+               'run_mode': case_config.clean_value(agcm_values.get('RUN_MODE', '')),
+               'run_years': run_years,
+               'imports': [row.split(',')[0].strip() for row in agcm_tables.get('IMPORT_STATE', [])]}
+        case['caps'].append(cap)
+
+        if cap['run_mode'] != 'GenerateExports': continue
+        hist_values = case_config.read_rc(os.path.join(case_path, hist_cf))[0]
+        for coll in case_config.clean_value(hist_values.get('COLLECTIONS', '')).split():
+            coll = case_config.clean_value(coll)
+            tokens = [case_config.clean_value(t) for t in hist_values.get(coll+'.fields', '').split(',')]
+            fields = [t for i, t in enumerate(tokens[:-1]) if tokens[i+1] == root_name]
+            case['history'][coll] = {
+                'file': coll + '.' + case_config.clean_value(hist_values.get(coll+'.template', '')),
+                'frequency': _seconds(case_config.clean_value(hist_values.get(coll+'.frequency', '060000'))),
+                'fields': fields}
+
+    extdata_rc = os.path.join(case_path, 'ExtData.rc')
+    extdata_yaml = os.path.join(case_path, 'extdata.yaml')
+    case['extrap'] = False
+    if os.path.isfile(extdata_rc):
+        values, primary, derived = extdata_convert.read_extdata_rc(extdata_rc)
+        case['extrap'] = case_config.clean_value(values.get('Ext_AllowExtrap', '.false.')).lower() \
+            in ['.true.', 'true', 'yes']
+        for row in primary:
+            name, clim, file_var, template = row[0], row[2], row[7], row[8]
+            years = None
+            if clim.isdigit():
+                years = [int(clim), int(clim)]
+            elif clim in ['Y', 'y'] and _YEAR_RE.search(template):
+                year = int(_YEAR_RE.search(template).group(1))
+                years = [year, year]
+            frequency = None
+            if len(row) > 9:
+                frequency = _seconds(extdata_convert.iso_duration('P' + row[9].split('P', 1)[1]))
+            case['entries'].append({'config': 'ExtData.rc', 'name': name, 'file_var': file_var,
+                                    'template': template, 'frequency': frequency,
+                                    'years': years, 'cycling': clim not in ['N', 'n']})
+        for row in derived:
+            case['entries'].append({'config': 'ExtData.rc', 'name': row[0], 'template': None})
+    if os.path.isfile(extdata_yaml):
+        config = extdata_convert.read_extdata_yaml(extdata_yaml)
+        data_sets = config.get('data_sets', {})
+        for name, rule in config.get('rules', {}).items():
+            data_set = data_sets.get(rule.get('file_template_key'), {})
+            cycling = rule.get('cycling', 'false').lower() == 'true'
+            years = rule.get('source_time') if cycling else data_set.get('valid_range')
+            frequency = data_set.get('file_frequency')
+            case['entries'].append({'config': 'extdata.yaml', 'name': name, 'file_var': rule.get('file_var', name),
+                                    'template': data_set.get('file_template', rule.get('file_template_key')),
+                                    'frequency': _seconds(frequency) if frequency else None,
+                                    'years': [int(y) for y in years] if years else None,
+                                    'cycling': cycling})
+        for name in config.get('derived', {}):
+            case['entries'].append({'config': 'extdata.yaml', 'name': name, 'template': None})
+
+    case['data_years'] = extdata_convert.get_data_years(case_path) if case['history'] else None
+    return case
+
+
+def check_cases(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # CAP.rc lists at least one CAP, and every CAP with its ROOT_CF and HIST_CF
+    # exists
+    # --------------------------------------------------------------------------
+    """
+
+    problems = []
+    if not os.path.isfile(os.path.join(case_path, 'CAP.rc')):
+        return ['CAP.rc does not exist']
+    cap_files = case_config.get_cap_cases(case_path)
+    if not cap_files:
+        return ['CAP.rc: CASES is empty']
+    for cap_file in cap_files:
+        if not os.path.isfile(os.path.join(case_path, cap_file)):
+            problems.append('CAP.rc: %s does not exist' % cap_file)
+            continue
+        values = case_config.read_rc(os.path.join(case_path, cap_file))[0]
+        for label in ['ROOT_CF', 'HIST_CF']:
+            rc_file = case_config.clean_value(values.get(label, ''))
+            if not rc_file:
+                problems.append('%s: %s is not set' % (cap_file, label))
+            elif not os.path.isfile(os.path.join(case_path, rc_file)):
+                problems.append('%s: %s %s does not exist' % (cap_file, label, rc_file))
+    if not os.path.isfile(os.path.join(case_path, 'ExtData.rc')) and \
+       not os.path.isfile(os.path.join(case_path, 'extdata.yaml')):
+        problems.append('neither ExtData.rc nor extdata.yaml exist')
+    return problems
+
+
+def _history_for(case, template):
+
+    sample = _template_sample(template)
+    return [coll for coll, hist in case['history'].items() if _template_re(hist['file']).match(sample)]
+
+
+def check_imports(case):
+    """
+    # --------------------------------------------------------------------------
+    # every import of a CompareImports CAP has a rule in each ExtData config,
+    # and the file variables of the imported rules are History fields
+    # --------------------------------------------------------------------------
+    """
+
+    problems = []
+    for config in sorted(set([entry['config'] for entry in case['entries']])):
+        entries = [entry for entry in case['entries'] if entry['config'] == config]
+        names = set()
+        for entry in entries:
+            names.update(entry['name'].split(';'))
+        for cap in case['caps']:
+            for name in cap['imports']:
+                if name not in names:
+                    problems.append('%s: import %s of %s has no rule' % (config, name, cap['agcm']))
+
+        # rules nothing imports are never read
+        if not case['history']: continue
+        imports = set(sum([cap['imports'] for cap in case['caps']], []))
+        for entry in entries:
+            if not entry['template'] or entry['template'].startswith('/dev/null'): continue
+            if not imports.intersection(entry['name'].split(';')): continue
+            for coll in _history_for(case, entry['template']):
+                for file_var in entry['file_var'].split(';'):
+                    if file_var not in case['history'][coll]['fields']:
+                        problems.append('%s: %s reads %s, which History collection %s does not write' %
+                                        (config, entry['name'], file_var, coll))
+    return problems
+
+
+def check_templates(case):
+    """
+    # --------------------------------------------------------------------------
+    # every ExtData file template is written by a History collection of the
+    # GenerateExports CAP, at the file frequency the rule expects
+    # --------------------------------------------------------------------------
+    """
+
+    problems = []
+    if not case['history']: return problems
+    for entry in case['entries']:
+        if not entry['template'] or entry['template'].startswith('/dev/null'): continue
+        colls = _history_for(case, entry['template'])
+        if not colls:
+            problems.append('%s: template %s of %s is not written by any History collection' %
+                            (entry['config'], entry['template'], entry['name']))
+            continue
+        if entry['frequency'] and entry['frequency'] not in [case['history'][c]['frequency'] for c in colls]:
+            problems.append('%s: file frequency of %s (%ds) differs from History collection %s (%ds)' %
+                            (entry['config'], entry['name'], entry['frequency'], colls[0],
+                             case['history'][colls[0]]['frequency']))
+    return problems
+
+
+def check_years(case):
+    """
+    # --------------------------------------------------------------------------
+    # unless Ext_AllowExtrap is set: climatology years are in the generated
+    # data, and the valid_range of other rules covers the CAP run times
+    # --------------------------------------------------------------------------
+    """
+
+    problems = []
+    if case['extrap']: return problems
+    run_years = sorted(set(sum([cap['run_years'] for cap in case['caps'] if cap['imports']], [])))
+    for entry in case['entries']:
+        if not entry['template'] or entry['template'].startswith('/dev/null') or not entry['years']: continue
+        first, last = entry['years']
+        if entry['cycling']:
+            data_years = case['data_years']
+            if data_years and (first < data_years[0] or last > data_years[1]):
+                problems.append('%s: climatology years %d-%d of %s are outside the data (%d-%d)' %
+                                (entry['config'], first, last, entry['name'], data_years[0], data_years[1]))
+        else:
+            outside = [year for year in run_years if year < first or year > last]
+            if outside:
+                problems.append('%s: run years %s are outside the valid range %d-%d of %s' %
+                                (entry['config'], ','.join([str(y) for y in outside]), first, last, entry['name']))
+    return problems
+
+
+def check_layout(case_path, case):
+    """
+    # --------------------------------------------------------------------------
+    # NX*NY of every AGCM rc file equals the rank count of nproc.rc (1 if
+    # there is none) and is a valid decomposition of its grid
+    # --------------------------------------------------------------------------
+    """
+
+    problems = []
+    nproc = 1
+    nproc_file = os.path.join(case_path, 'nproc.rc')
+    if os.path.isfile(nproc_file):
+        fin = open(nproc_file, 'r'); nproc = int(fin.readline().strip() or 1); fin.close()
+    for cap in case['caps']:
+        grid = cap['grid']
+        if grid['nx']*grid['ny'] != nproc:
+            problems.append('%s: NX*NY = %d*%d does not match nproc.rc (%d)' %
+                            (cap['agcm'], grid['nx'], grid['ny'], nproc))
+        elif not case_config.is_valid_layout(grid, grid['nx'], grid['ny'], min_points=1):
+            problems.append('%s: layout %dx%d is not valid for its grid' % (cap['agcm'], grid['nx'], grid['ny']))
+    return problems
+
+
+def validate_case(case_path):
+    """
+    # --------------------------------------------------------------------------
+    # run all checks on a case
+    #
+    # Inputs:
+    #     case_path: path to the case
+    # Output:
+    #     list of problems (strings), empty if the case looks runnable
+    # --------------------------------------------------------------------------
+    """
+
+    problems = check_cases(case_path)
+    if problems: return problems
+    try:
+        case = load_case(case_path)
+    except Exception as exc:
+        return ['cannot read case: %s' % exc]
+    return check_imports(case) + check_templates(case) + check_years(case) + check_layout(case_path, case)
+
+
+if __name__ == "__main__":
+
+    comm_opts = parse_comm_args()
+    case_file = open(comm_opts['cases'], 'r')
+    cases = [line.strip() for line in case_file if line.strip()]
+    case_file.close()
+
+    nbad = 0
+    for case in cases:
+        sTart = time.time()
+        problems = validate_case(os.path.join(comm_opts['case_dir'], case))
+        utils.writemsg(' %-24s %s (%.3fs)\n' % (case, 'FAILED' if problems else 'ok', time.time()-sTart))
+        for problem in problems:
+            utils.writemsg('     %s\n' % problem)
+        if problems: nbad += 1
+    sys.exit(1 if nbad else 0)